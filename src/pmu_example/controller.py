@@ -8,13 +8,20 @@ import socket
 import math
 from jpt_algo_evaluation.jpt_algo import calculate_complex_voltage, jpt_algo, phase_angle_and_magnitude_from_complex_voltage, calculate_approximation_error, calculate_angle_error
 from statistics import mean, stdev
-from sorted_list import KeySortedList
-from threading import Thread
-from queue import Queue
+from recovery_engine import RecoveryEngine, PREDICTORS
 import time
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+from pmu_lib.digest_layouts import DigestDecoderTable
+from pmu_lib.digest_ingest import add_ingest_arguments, ingestor_from_args, serve_digests, RUNTIME_ASYNCIO
+from pmu_lib.async_runtime import AsyncRuntime
+from pmu_lib.udp_pool import UdpSocketPool
+from pmu_lib.frame_encoder import FrameEncoder, STAT_CONTROLLER_GENERATED
 
 
 missing_packet_counter = 0
+digest_decoders = None
 
 class SimpleSwitchAPI(runtime_CLI.RuntimeAPI):
     @staticmethod
@@ -27,14 +34,16 @@ class SimpleSwitchAPI(runtime_CLI.RuntimeAPI):
         self.sswitch_client = sswitch_client
 
 
-pmu_recovery_data_buffer = KeySortedList(keyfunc = lambda obj: obj["timestamp"])
+# recovery state per PMU stream, the digests don't carry the id_code so everything is PMU 12 for now
+recovery_engine = None
+recovery_stream_id = 12
 
-
-def queue_digests(terminate_after, digest_queue, sub):
-    #### Define the controller logic below ###
-    while missing_packet_counter < terminate_after:
-        message = sub.recv()
-        digest_queue.put(message)
+# recovered packets are injected through sockets that stay open for the whole session
+udp_socket_pool = UdpSocketPool()
+#TODO: make command line arguments
+recovered_packet_destination = ("10.0.2.2", 4712)
+# PMU 12, one phasor, stat marks the frames as controller generated
+recovered_packet_encoder = FrameEncoder(num_phasors=1, id_code=12, stat=STAT_CONTROLLER_GENERATED)
 
 
 def parse_phasors(phasor_data, settings={"num_phasors": 1, "pmu_measurement_bytes": 8}):
@@ -67,88 +76,41 @@ def pmu_packet_parser(data, settings={"pmu_measurement_bytes": 8, "num_phasors":
 
     return pmu_packet
 
-def generate_new_packets(interface, num_packets, initial_jpt_inputs, last_stored_soc, last_stored_fracsec, curr_soc, curr_fracsec):
-    jpt_inputs = initial_jpt_inputs[0:]
+def generate_new_packets(interface, num_packets, stream, last_stored_soc, last_stored_fracsec, curr_soc, curr_fracsec):
+    recovered_packets = []
     for i in range(num_packets):
         new_soc = last_stored_soc
         new_frac = last_stored_fracsec + 16666
-        complex_voltage_estimate = jpt_algo(jpt_inputs[0], jpt_inputs[1], jpt_inputs[2])
-        generated_mag, generated_pa = phase_angle_and_magnitude_from_complex_voltage(complex_voltage_estimate)
         if (new_frac) / 1000000 >= 1:
             new_frac = (new_frac) % 1000000
             new_soc = new_soc + 1
 
         #make sure not generating too many
         #print(str((curr_soc * 1000000 + curr_fracsec) - (new_soc * 1000000 + new_frac)))
-        if (curr_soc * 1000000 + curr_fracsec) - (new_soc * 1000000 + new_frac) > 16000:
-            pmu_recovery_data_buffer.insert({"timestamp": new_soc + new_frac / 1000000, "magnitude": generated_mag, "phase_angle": generated_pa})
-            generate_new_packet("s1-eth2", new_soc, new_frac, generated_mag, generated_pa)
-            #time.sleep(.017)
+        if (curr_soc * 1000000 + curr_fracsec) - (new_soc * 1000000 + new_frac) <= 16000:
+            break
 
+        complex_voltage_estimate = stream.predict_next()
+        generated_mag, generated_pa = phase_angle_and_magnitude_from_complex_voltage(complex_voltage_estimate)
+        #recovered samples become history for the next prediction
+        stream.observe(new_soc + new_frac / 1000000, complex_voltage_estimate, measured=False)
+        recovered_packets.append(build_new_packet(new_soc, new_frac, generated_mag, generated_pa))
 
         last_stored_soc = new_soc
         last_stored_fracsec = new_frac
-        jpt_inputs = [complex_voltage_estimate] + jpt_inputs[0:2]
-
-
-
-def generate_new_packet(interface, soc_in, frac_sec_in, voltage, angle, settings={"pmu_measurement_bytes": 8, "destination_ip": "10.0.2.2", "destination_port": 4712}):
-    # 2 byte
-    sync = b'\xAA\x01'
-
-    # 2 byte, 44 for 32 bit values of PMU, 40 for 16 bit values of PMU
-    # 36 - 8 + 8 * number of PMUs || 36 - 8 + 4 * number PMUs
-    frame_size = b'\x00\x24'
-
-    # 2 byte, 12 for this
-    id_code = b'\x00\x0C'
-
-    # 4 byte
-    soc = int(soc_in).to_bytes(4, 'big')
-
-    # 4 byte
-    frac_sec = int(frac_sec_in).to_bytes(4, 'big')
-
-    # 2 byte
-    #0000000000001001 = controller generated pmu
-    stat = b'\x00\x09'
-
-    # 4 or 8 byte x number of phasors (see doc, 8 is for float)
-    voltage_bytes = struct.pack('>f', voltage)
-    angle_bytes = struct.pack('>f', math.radians(angle))
-    phasors = voltage_bytes + angle_bytes
-
-    # 2 byte, assumed 60
-    freq = b'\x09\xC4'
-
-    # 2 byte
-    dfreq = b'\x00\x00'
-
-    # 4 byte
-    analog = b'\x00\x00\x00\x00'
 
-    # 2 byte
-    digital = b'\x00\x00'
+    #all packets recovered for this gap go out together
+    if recovered_packets:
+        udp_socket_pool.send_batch(interface, recovered_packet_destination, recovered_packets)
 
-    # 2 byte
-    chk = b'\x00\x00'
 
-    pmu_packet = sync + frame_size + id_code + soc + frac_sec + \
-        stat + phasors + freq + dfreq + analog + digital + chk
 
-    # Set the destination IP address and port number
-    #TODO: make command line arguments
-    destination_ip = "10.0.2.2"
-    destination_port = 4712
+def build_new_packet(soc_in, frac_sec_in, voltage, angle):
+    return recovered_packet_encoder.encode(soc_in, frac_sec_in, (voltage,), (angle,))
 
-    # Create a UDP socket
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.setsockopt(socket.SOL_SOCKET, 25, str(interface + '\0').encode('utf-8'))
-    # Send the PMU packet to the destination IP address and port number
-    udp_socket.sendto(pmu_packet, (destination_ip, destination_port))
-
-    # Close the UDP socket
-    udp_socket.close()
+def generate_new_packet(interface, soc_in, frac_sec_in, voltage, angle, settings={"pmu_measurement_bytes": 8, "destination_ip": "10.0.2.2", "destination_port": 4712}):
+    # Send the PMU packet to the destination IP address and port number over the pooled socket
+    udp_socket_pool.send(interface, (settings["destination_ip"], settings["destination_port"]), build_new_packet(soc_in, frac_sec_in, voltage, angle))
 
 def calc_missing_packet_count(curr_soc, curr_fracsec, last_stored_soc, last_stored_fracsec, freq_hz=60):
     soc_diff = curr_soc - last_stored_soc
@@ -170,51 +132,35 @@ def calc_missing_packet_count(curr_soc, curr_fracsec, last_stored_soc, last_stor
 
 
 def on_digest_recv(msg):
-    _, _, ctx_id, list_id, buffer_id, num = struct.unpack("<iQiiQi", msg[:32])
+    #unpacking digest header, "num" is the number of messages in the digest,
+    #the layout is looked up by the header's list_id and the messages are unpacked lazily
+    try:
+        header, layout, records = digest_decoders.decode(msg)
+    except KeyError as e:
+        print("Ignoring digest: " + str(e))
+        return
+    digest_handlers[layout.name](records)
+
+def recover_missing_packets(records):
+    global missing_packet_counter
+    stream = recovery_engine.stream(recovery_stream_id)
     ### Insert the receiving logic below ###
-    msg = msg[32:]
-    #pmu_packet = pmu_packet_parser(msg)
-    #offset = 36
-    controller_phasor_info_packet_length = 16
-    controller_phasor_info_packet_count = 3
-
-    # the extra 8 here is for the most current timestamp
-    offset = controller_phasor_info_packet_length * controller_phasor_info_packet_count + 8
 
     # For listening the next digest
-    for m in range(num):
-        global pmu_recovery_data_buffer
-        global missing_packet_counter
-        jpt_inputs = []
-        msg_copy = msg[0:]
-        last_stored_soc = 0
-        last_stored_fracsec = 0
-        # extracting phasor data from digest messages
-        for j in range(controller_phasor_info_packet_count):
-            frac = int.from_bytes(msg_copy[4:8], byteorder="big")
-            soc = int.from_bytes(msg_copy[0:4], byteorder="big")
-            phasor = parse_phasors(msg_copy[8:controller_phasor_info_packet_length])
-
-
-            pmu_recovery_data_buffer.insert({"timestamp": soc + frac / 1000000, "magnitude": phasor[0]["magnitude"], "phase_angle": phasor[0]["angle"]})
-            #top of receive stack = most recent measurement
-            if j == 0:
-                last_stored_soc = soc
-                last_stored_fracsec = frac
-
-            #jpt_inputs.append(calculate_complex_voltage(phasor[0]["magnitude"], phasor[0]["angle"]))
-            #move to next jpt_phasor in triplet of
-            msg_copy = msg_copy[controller_phasor_info_packet_length:]
-
-        # extracting most recent time measurement
-        curr_soc = int.from_bytes(msg_copy[0:4], byteorder="big")
-        curr_fracsec = int.from_bytes(msg_copy[4:8], byteorder="big")
-
-        #getting last 3 measurements from pmu_data buffer
-        jpt_inputs = list(map(lambda pmu_data: calculate_complex_voltage(pmu_data["magnitude"], pmu_data["phase_angle"]), pmu_recovery_data_buffer.get_last_n(3)))
-
-        #put measurements in correct order for current recovery functions
-        jpt_inputs.reverse()
+    for record in records:
+        # storing the phasor triplet oldest first, 0 = top of receive stack = most recent measurement
+        for soc, frac, magnitude, angle in (
+                (record.soc2, record.fracsec2, record.magnitude2, record.angle2),
+                (record.soc1, record.fracsec1, record.magnitude1, record.angle1),
+                (record.soc0, record.fracsec0, record.magnitude0, record.angle0)):
+            stream.observe(soc + frac / 1000000, calculate_complex_voltage(magnitude, math.degrees(angle)))
+
+        last_stored_soc = record.soc0
+        last_stored_fracsec = record.fracsec0
+
+        # most recent time measurement
+        curr_soc = record.curr_soc
+        curr_fracsec = record.curr_fracsec
 
         missing_packets = calc_missing_packet_count(curr_soc, curr_fracsec, last_stored_soc, last_stored_fracsec)
 
@@ -224,15 +170,22 @@ def on_digest_recv(msg):
 
 
 
-        if len(jpt_inputs) > 2:
-            generate_new_packets("s1-eth2", missing_packets, jpt_inputs, last_stored_soc, last_stored_fracsec, curr_soc, curr_fracsec)
+        #only recover once the stream holds enough history for the predictor
+        if stream.ready():
+            generate_new_packets("s1-eth2", missing_packets, stream, last_stored_soc, last_stored_fracsec, curr_soc, curr_fracsec)
 
-        #move to next digest packet
-        msg = msg[offset:]
+#digest struct name -> handler for its decoded messages
+digest_handlers = {
+    "jpt_pmu_triplet_t": recover_missing_packets,
+}
 
 def setup():
     parser = runtime_CLI.get_parser()
-    parser.add_argument('--terminate_after', type=int, help='Number of packets to generate before terminating')
+    parser.add_argument('--terminate_after', type=int, default=0, help='Number of packets to generate before terminating (0 runs until interrupted)')
+    add_ingest_arguments(parser)
+    parser.add_argument('--predictor', choices=sorted(PREDICTORS), default='jpt', help='Algorithm used to recover missing packets')
+    parser.add_argument('--predictor_window', type=int, help='History window of the lsq predictor')
+    parser.add_argument('--p4info', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build/basic.p4.p4info.txt'), help='p4info file the digest layouts are read from')
 
     args = parser.parse_args()
 
@@ -249,30 +202,69 @@ def setup():
     runtime_api = SimpleSwitchAPI(
         args.pre, standard_client, mc_client, sswitch_client)
 
+    global recovery_engine
+    predictor_options = {}
+    if args.predictor_window is not None:
+        predictor_options["window"] = args.predictor_window
+    recovery_engine = RecoveryEngine(args.predictor, **predictor_options)
+
+    global digest_decoders
+    digest_decoders = DigestDecoderTable(args.p4info, args.json or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build/basic.json'))
+    digest_decoders.get_by_name("jpt_pmu_triplet_t").check_fields(
+        ["soc0", "fracsec0", "magnitude0", "angle0", "soc1", "fracsec1", "magnitude1", "angle1",
+         "soc2", "fracsec2", "magnitude2", "angle2", "curr_soc", "curr_fracsec"])
+
     sub = nnpy.Socket(nnpy.AF_SP, nnpy.SUB)
     socket = runtime_api.client.bm_mgmt_get_info().notifications_socket
     print("socket is : " + str(socket))
     sub.connect(socket)
     sub.setsockopt(nnpy.SUB, nnpy.SUB_SUBSCRIBE, '')
 
-    return runtime_api, args.terminate_after, sub
+    return runtime_api, args, sub
 
-def listen_for_new_digests(q, terminate_after):
-    while missing_packet_counter < terminate_after:
-        event_data = q.get()
-        on_digest_recv(event_data)
-        q.task_done()
+def terminated(terminate_after):
+    return terminate_after > 0 and missing_packet_counter >= terminate_after
 
-if __name__ == "__main__":
+def listen_for_new_digests(ingestor, terminate_after):
+    while not terminated(terminate_after):
+        for event_data in ingestor.get_batch(timeout=1.0):
+            on_digest_recv(event_data)
+            if terminated(terminate_after):
+                break
 
-    runtime_api, terminate_after, sub = setup()
+def on_digest_batch(batch, terminate_after):
+    for event_data in batch:
+        on_digest_recv(event_data)
+        if terminated(terminate_after):
+            return True
+    return False
+
+#digests are handled on one event loop until terminate_after packets were generated or SIGINT/SIGTERM
+def run_event_loop(runtime_api, args, sub):
+    runtime = AsyncRuntime()
+    runtime.add_cleanup(udp_socket_pool.close)
+    serve_digests(runtime, sub, args, runtime_api.client,
+                  lambda batch: on_digest_batch(batch, args.terminate_after))
+    runtime.run()
+
+def run_threads(runtime_api, args, sub):
+    # receives digests continuously on its own thread into a bounded buffer,
+    # each digest buffer is acked back to the switch from a separate thread
+    ingestor = ingestor_from_args(sub, args, runtime_api.client).start()
 
+    #does some stuff when a digest is received
+    try:
+        listen_for_new_digests(ingestor, args.terminate_after)
+    finally:
+        ingestor.stop()
+        ingestor.print_stats()
+        udp_socket_pool.close()
 
-    digest_message_queue = Queue()
-    # Create the thread to listen for digest messages
-    digest_message_thread = Thread(target=queue_digests, args=(terminate_after, digest_message_queue, sub))
-    digest_message_thread.daemon = True
-    digest_message_thread.start()
+if __name__ == "__main__":
 
-    #does some stuff when a digest is received
-    listen_for_new_digests(digest_message_queue, terminate_after)
+    runtime_api, args, sub = setup()
+
+    if args.runtime == RUNTIME_ASYNCIO:
+        run_event_loop(runtime_api, args, sub)
+    else:
+        run_threads(runtime_api, args, sub)
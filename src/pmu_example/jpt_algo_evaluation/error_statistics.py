@@ -0,0 +1,52 @@
+import numpy as np
+
+'''
+Batch error statistics for comparing exact and approximated (recovered) phasors.
+Everything works on whole arrays; pass generated_indexes (integer indexes or a
+boolean mask) to only look at the recovered samples.
+'''
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+def _select(values, generated_indexes):
+    values = np.asarray(values)
+    if generated_indexes is None:
+        return values
+    return values[np.asarray(generated_indexes)]
+
+# approximation error in percent for every sample
+def approximation_errors(exact, approximate):
+    exact = np.asarray(exact, dtype=np.float64)
+    approximate = np.asarray(approximate, dtype=np.float64)
+    return np.abs(exact - approximate) / exact * 100
+
+# angle in degrees between the exact and approximated complex voltages of every sample
+def angle_deviations(exact, approximate):
+    exact = np.asarray(exact, dtype=np.complex128)
+    approximate = np.asarray(approximate, dtype=np.complex128)
+    dot_product = exact.real * approximate.real + exact.imag * approximate.imag
+    cosine = dot_product / (np.abs(exact) * np.abs(approximate))
+    # rounding can push the cosine of (nearly) parallel vectors past 1
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+# mean, sample standard deviation (like statistics.stdev), max and percentiles
+def summarize(values, percentiles=DEFAULT_PERCENTILES):
+    values = np.asarray(values, dtype=np.float64)
+    summary = {
+        "count": values.size,
+        "mean": values.mean(),
+        "stdev": values.std(ddof=1) if values.size > 1 else float("nan"),
+        "max": values.max(),
+    }
+    for p, value in zip(percentiles, np.percentile(values, percentiles)):
+        summary["p%g" % p] = value
+    return summary
+
+def approximation_error_statistics(exact_measurements, approximate_measurements, generated_indexes=None, percentiles=DEFAULT_PERCENTILES):
+    errors = approximation_errors(_select(exact_measurements, generated_indexes), _select(approximate_measurements, generated_indexes))
+    return summarize(errors, percentiles)
+
+def angle_statistics(exact_measurements, approximate_measurements, generated_indexes=None, percentiles=DEFAULT_PERCENTILES):
+    deviations = angle_deviations(_select(exact_measurements, generated_indexes), _select(approximate_measurements, generated_indexes))
+    return summarize(deviations, percentiles)
@@ -2,8 +2,11 @@ import math
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-from statistics import mean, stdev
 import cmath
+try:
+    from .error_statistics import approximation_error_statistics, angle_deviations, summarize
+except ImportError:
+    from error_statistics import approximation_error_statistics, angle_deviations, summarize
 
 wt = 0
 
@@ -37,21 +40,31 @@ def phase_angle_and_magnitude_from_complex_voltage(voltage):
     magnitude = math.sqrt(voltage.real**2 + voltage.imag**2)
     return magnitude, math.degrees(phase_angle)
 
+# vectorized calculate_complex_voltage over whole columns, works on 1-D (samples)
+# or 2-D (channels x samples) arrays of magnitudes and phase angles in degrees
+def calculate_complex_voltages(magnitudes, phase_angles):
+    magnitudes = np.asarray(magnitudes, dtype=np.float64)
+    phase_angles = np.radians(np.asarray(phase_angles, dtype=np.float64) + wt)
+    voltages = np.empty(np.broadcast(magnitudes, phase_angles).shape, dtype=np.complex128)
+    voltages.real = np.cos(phase_angles) * magnitudes
+    voltages.imag = np.sin(phase_angles) * magnitudes
+    return voltages
+
+# jpt_algo applied to every window of 3 consecutive samples along the last axis in one pass,
+# prediction i is made from samples i, i+1, i+2 and approximates sample i+3
+def jpt_predict_complex(voltages):
+    voltages = np.asarray(voltages, dtype=np.complex128)
+    return jpt_algo(voltages[..., 2:-1], voltages[..., 1:-2], voltages[..., :-3])
+
+# same as generate_jpt_predictions but stays in numpy: returns (magnitudes, phase_angles)
+# arrays of shape (..., n - 3), many PMU channels can be passed at once as a 2-D array
+def generate_jpt_prediction_arrays(magnitudes, phase_angles):
+    predictions = jpt_predict_complex(calculate_complex_voltages(magnitudes, phase_angles))
+    return np.abs(predictions), np.angle(predictions, deg=True)
+
 def generate_jpt_predictions(magnitudes, phase_angles):
-    predictions = {"magnitudes": [], "phase_angles": []}
-    for i in range(len(magnitudes) - 3):
-        three_previous = []
-        for j in range(i, i + 3):
-            three_previous.append({"magnitude": magnitudes[j], "phase_angle": phase_angles[j]})
-        k_min = []
-        for measurement in three_previous:
-            complex_voltage = calculate_complex_voltage(measurement["magnitude"], measurement["phase_angle"])
-            k_min.append(complex_voltage)
-        complex_voltage_future_approximation = jpt_algo(k_min[2],k_min[1],k_min[0])
-        predicted_magnitude, predicted_phase_angle = phase_angle_and_magnitude_from_complex_voltage(complex_voltage_future_approximation)
-        predictions["magnitudes"].append(predicted_magnitude)
-        predictions["phase_angles"].append(predicted_phase_angle)
-    return predictions
+    predicted_magnitudes, predicted_phase_angles = generate_jpt_prediction_arrays(magnitudes, phase_angles)
+    return {"magnitudes": predicted_magnitudes.tolist(), "phase_angles": predicted_phase_angles.tolist()}
 
 #approximation error formula
 def calculate_approximation_error(exact, approximate):
@@ -59,15 +72,10 @@ def calculate_approximation_error(exact, approximate):
 
 #calculate the average, std deviation, and range of approximation errors
 def calculate_approximation_error_statistics(exact_measurements, approximate_measurements, generated_indexes = None):
-    approximation_errors = []
-    if generated_indexes is not None:
-        for i in generated_indexes:
-            approximation_errors.append(calculate_approximation_error(exact_measurements[i], approximate_measurements[i]))
-    else:
-        for i in range(len(exact_measurements)):
-            approximation_errors.append(calculate_approximation_error(exact_measurements[i], approximate_measurements[i]))
-
-    return mean(approximation_errors), stdev(approximation_errors), max(approximation_errors)
+    if generated_indexes is None:
+        approximate_measurements = approximate_measurements[:len(exact_measurements)]
+    summary = approximation_error_statistics(exact_measurements, approximate_measurements, generated_indexes)
+    return summary["mean"], summary["stdev"], summary["max"]
 
 def calculate_angle_error(exact, approximate):
     ex = np.array([exact.real, exact.imag])
@@ -77,36 +85,23 @@ def calculate_angle_error(exact, approximate):
     return angle
 
 def calculate_angle_statistics(exact_measurements, approximate_measurements, generated_indexes = None):
-    angle_deviations = []
-    if generated_indexes is not None:
-        for i in generated_indexes:
-            ex = np.array([exact_measurements[i].real, exact_measurements[i].imag])
-            app = np.array([approximate_measurements[i].real, approximate_measurements[i].imag])
-            dot_product = np.dot(ex, app)
-            if dot_product / (np.linalg.norm(ex) * np.linalg.norm(app)) > 1:
-                angle = 0
-            else:
-                angle =  math.degrees(math.acos(dot_product / (np.linalg.norm(ex) * np.linalg.norm(app))))
-            angle_deviations.append(angle)
-            if angle > 50:
-                print("issue with: ")
+    exact_measurements = np.asarray(exact_measurements)
+    approximate_measurements = np.asarray(approximate_measurements)
+    if generated_indexes is None:
+        deviations = angle_deviations(exact_measurements[:len(approximate_measurements)], approximate_measurements)
     else:
-        for i in range(len(approximate_measurements)):
-            ex = np.array([exact_measurements[i].real, exact_measurements[i].imag])
-            app = np.array([approximate_measurements[i].real, approximate_measurements[i].imag])
-            dot_product = np.dot(ex, app)
-            if dot_product / (np.linalg.norm(ex) * np.linalg.norm(app)) > 1:
-                angle = 0
-            else:
-                angle =  math.degrees(math.acos(dot_product / (np.linalg.norm(ex) * np.linalg.norm(app))))
-            angle_deviations.append(angle)
-    return mean(angle_deviations), stdev(angle_deviations), max(angle_deviations)
+        generated_indexes = np.asarray(generated_indexes)
+        #a boolean mask becomes the indexes it selects, so the printed indexes line up with the deviations
+        if generated_indexes.dtype == bool:
+            generated_indexes = np.flatnonzero(generated_indexes)
+        deviations = angle_deviations(exact_measurements[generated_indexes], approximate_measurements[generated_indexes])
+        if (deviations > 50).any():
+            print("issue with: " + str(generated_indexes[deviations > 50].tolist()))
+    summary = summarize(deviations)
+    return summary["mean"], summary["stdev"], summary["max"]
 
 def calculate_complex_voltage_set(magnitudes, phase_angles):
-    complex_voltage_set = []
-    for i in range(len(magnitudes)):
-        complex_voltage_set.append(calculate_complex_voltage(magnitudes[i], phase_angles[i]))
-    return complex_voltage_set
+    return calculate_complex_voltages(magnitudes, phase_angles).tolist()
 
 if __name__ == "__main__":
     pmu_raw_data = parse_csv_data()
@@ -1,8 +1,17 @@
 import socket
-import struct
-import math
 import sys
-from sorted_list import KeySortedList
+import os
+import logging
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+from sorted_list import ReorderWindow
+from pmu_lib.frame_decoder import FrameDecoder
+from pmu_lib.rate_limited_log import get_rate_limited_logger, add_logging_arguments
+from pmu_lib.batch_receiver import BatchReceiver
+from pmu_lib.async_runtime import AsyncRuntime
+from pmu_lib.sharded_receiver import run_sharded, print_sharded_stats, shard_log_path, shard_log_row, merge_shard_logs, frame_log_sink, frame_log_record, SHARD_LOG_HEADER, SHARD_MODES, MODE_REUSEPORT
+from pmu_lib.log_sink import CsvLogSink
+from pmu_lib.binary_log import COMPRESSIONS, COMPRESSION_NONE
+from pmu_lib.frame_encoder import STAT_CONTROLLER_GENERATED
 import signal
 import argparse
 from threading import Thread
@@ -11,104 +20,214 @@ from datetime import datetime
 
 UDP_IP_ADDRESS = "0.0.0.0"  # listen on all available interfaces
 UDP_PORT_NO = 4712  # PMU data port number
-sorted_pmus = KeySortedList(keyfunc = lambda pmu: pmu["soc"] + pmu["frac_sec"] / 1000000)
-
-# create a UDP socket object
-serverSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-# bind the socket to the specified IP address and port number
-serverSock.bind((UDP_IP_ADDRESS, UDP_PORT_NO))
-
-def parse_phasors(phasor_data, settings={"num_phasors": 1, "pmu_measurement_bytes": 8}):
-    phasor = {
-        "magnitude": struct.unpack('>f', phasor_data[0:int(settings["pmu_measurement_bytes"]/2)])[0],
-        "angle": math.degrees(struct.unpack('>f', phasor_data[int(settings["pmu_measurement_bytes"]/2) : settings["pmu_measurement_bytes"]])[0]),
-    }
-    return [phasor]
-
-def pmu_packet_parser(data, settings={"pmu_measurement_bytes": 8, "num_phasors": 1, "freq_bytes": 2, "dfreq_bytes": 2}):
-    freq_start_byte = 16 + settings["num_phasors"] * settings["pmu_measurement_bytes"]
-    dfreq_start_byte = freq_start_byte + settings["freq_bytes"]
-    analog_start_byte = dfreq_start_byte + settings["dfreq_bytes"]
-    digital_start_byte = analog_start_byte + 4
-    chk_start_byte = digital_start_byte + 2
-
-    # convert each field to correct data type
-    pmu_packet = {
-        "sync": int.from_bytes(data[0:2], byteorder="big"),
-        "frame_size": int.from_bytes(data[2:4], byteorder="big"),
-        "id_code": int.from_bytes(data[4:6], byteorder="big"),
-        "soc": int.from_bytes(data[6:10], byteorder="big"),
-        "frac_sec": int.from_bytes(data[10:14], byteorder="big"),
-        "stat": int.from_bytes(data[14:16], byteorder="big"),
-        "phasors": parse_phasors(data[16:16 + settings["pmu_measurement_bytes"]], {"num_phasors": settings["num_phasors"], "pmu_measurement_bytes": settings["pmu_measurement_bytes"]}),
-        "freq": data[freq_start_byte:dfreq_start_byte],
-        "dfreq": data[dfreq_start_byte:analog_start_byte],
-        "analog": data[analog_start_byte:digital_start_byte],
-        "digital": data[digital_start_byte:chk_start_byte],
-        "chk": data[chk_start_byte:]
-    }
-
-    return pmu_packet
-
-#stuff you want to print out if you have to cntrl-c out of program due to error
+# PMU 12 frames with 1 phasor
+frame_decoder = FrameDecoder(num_phasors=1)
+logger = logging.getLogger("pmu-receiver")
+
+# UDP socket of the single process runtimes, sharded mode binds its own SO_REUSEPORT sockets
+serverSock = None
+# drains the socket in batches, created once the console args are known
+batch_receiver = None
+# frames wait in the reorder window for late arrivals, then are streamed to the received log
+reorder_window = None
+received_log = None
+
+RECEIVED_LOG_HEADER = ["index", "magnitude", "phase_angle", "is_predicted", "received_at"]
+
+def received_log_row(index, pmu):
+    return [index, pmu.magnitudes[0], pmu.angles[0], pmu.stat == STAT_CONTROLLER_GENERATED, pmu.received_at]
+
+#returns the log sink and the function that writes a frame to it, binary logs hold every frame field
+def open_frame_log(path, csv_header, csv_row, args):
+    if args.log_format == 'binary':
+        sink = frame_log_sink(path, frame_decoder.num_phasors, compression=args.log_compression)
+        return sink, lambda index, pmu: sink.write(frame_log_record(index, pmu))
+    sink = CsvLogSink(path, csv_header, mode='w')
+    return sink, lambda index, pmu: sink.write(csv_row(index, pmu))
+
+def open_received_log(args):
+    global reorder_window, received_log
+    received_log, write_frame = open_frame_log(args.output, RECEIVED_LOG_HEADER, received_log_row, args)
+    reorder_window = ReorderWindow(args.lateness_frames / args.frame_rate, write_frame)
+
+#emits the frames still in the window, also when you have to cntrl-c out of program due to error
+def close_received_log():
+    reorder_window.flush()
+    received_log.close()
+    stats = reorder_window.stats()
+    logger.info("Logged %d of %d frames to %s | late: %d | duplicates: %d | max buffered: %d", stats["emitted"],
+                stats["received"], received_log.filename, stats["late"], stats["duplicates"], stats["max_buffered"])
+
 def cntrl_c_handler(signum, frame):
-    sorted_pmus.write_to_csv("error.csv")
+    close_received_log()
     exit(1)
 
 
 def parse_console_args(parser):
-    parser.add_argument('--terminate_after', type=int, help='Number of packets to receive before terminating')
-
-    return parser.parse_args()
-
-
-#queue pmu packets for processing
+    parser.add_argument('--terminate_after', type=int, default=0, help='Number of packets to receive before terminating (0 runs until SIGINT/SIGTERM)')
+    parser.add_argument('--runtime', choices=['asyncio', 'threads'], default='asyncio', help='One event loop for every port, or a receiver thread feeding a queue')
+    parser.add_argument('--extra_ports', type=int, nargs='*', default=[], help='More UDP ports to receive PMU frames on (asyncio runtime)')
+    parser.add_argument('--stats_interval', type=float, default=10.0, help='Seconds between receive stats log lines (asyncio runtime, 0 = off)')
+    parser.add_argument('--shards', type=int, default=0, help='Number of receiver processes, frames are partitioned by id_code (0 = single process)')
+    parser.add_argument('--shard_mode', choices=SHARD_MODES, default=MODE_REUSEPORT, help='Kernel steered SO_REUSEPORT sockets, or one process dispatching to the shards')
+    parser.add_argument('--output', default=None, help='Log of received frames in timestamp order, merged log of every shard in sharded mode (default received.csv or received.bin)')
+    parser.add_argument('--log_format', choices=['csv', 'binary'], default='csv', help='Log rows as text, or as fixed size binary records (export with utils/export_log.py)')
+    parser.add_argument('--log_compression', choices=COMPRESSIONS, default=COMPRESSION_NONE, help='Compression of the binary log blocks')
+    parser.add_argument('--lateness_frames', type=float, default=3, help='Frame periods a frame is held for late arrivals before it is logged')
+    parser.add_argument('--frame_rate', type=float, default=60, help='PMU frame rate, frames per second')
+    parser.add_argument('--recv_batch_size', type=int, default=64, help='Most datagrams taken off the socket per wakeup')
+    parser.add_argument('--recv_buffers', type=int, default=4, help='Number of preallocated batch buffers')
+    parser.add_argument('--socket_buffer', type=int, default=None, help='SO_RCVBUF of the PMU socket in bytes')
+    add_logging_arguments(parser)
+
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = 'received.bin' if args.log_format == 'binary' else 'received.csv'
+    return args
+
+
+#queue batches of pmu packets for processing
 def queue_pmu_packets(q, terminate_after):
     received_counter = 0
     while received_counter < terminate_after:
-        data, addr = serverSock.recvfrom(1500)  # receive up to 1500 bytes of data
-        received_counter += 1
-        q.put(data)
-    print("Receieved " + str(received_counter) + " packets")
+        batch = batch_receiver.receive_batch()
+        # the frames past terminate_after stay unhandled
+        batch.truncate(terminate_after - received_counter)
+        received_counter += len(batch)
+        q.put(batch)
+    logger.info("Received %d packets", received_counter)
 
 def process_pmu_packet(raw_pmu_packet, received_counter):
-    global sorted_pmus
-    pmu_data = pmu_packet_parser(raw_pmu_packet)
-    pmu_data["received_at"] = datetime.now()
-    sorted_pmus.insert(pmu_data)
-    #print(str(received_counter) + " : " + str(pmu_data["sync"]) + " | " + "Magnitude: " + str(pmu_data["phasors"][0]["magnitude"]) + " | Phase_angle: " + str(pmu_data["phasors"][0]["angle"]))
+    try:
+        pmu_data = frame_decoder.decode(raw_pmu_packet, datetime.now())
+    except ValueError as e:
+        logger.warning("Dropping packet %d: %s", received_counter, e)
+        return
+    logger.debug("%d: id_code %d | soc %d | frac_sec %d | magnitudes %s | angles %s", received_counter,
+                 pmu_data.id_code, pmu_data.soc, pmu_data.frac_sec, pmu_data.magnitudes, pmu_data.angles)
+    reorder_window.insert(pmu_data)
 
 
 def listen_for_pmu_queue(q, terminate_after):
     received_counter = 0
     while received_counter < terminate_after:
-        received_counter += 1
-        event_data = q.get()
-        process_pmu_packet(event_data, received_counter)
+        batch = q.get()
+        for event_data in batch:
+            received_counter += 1
+            process_pmu_packet(event_data, received_counter)
+        batch_receiver.release(batch)
         q.task_done()
-    #sorted_pmus.print_pmu()
+        received_log.poll()
 
 
-# wait for incoming PMU packets
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-                        prog='pmu-packet-receiver',
-                        description='Receives pmu packets',
-                        epilog='Text at the bottom of help')
-    args = parse_console_args(parser)
+def run_threads(args):
     signal.signal(signal.SIGINT, cntrl_c_handler)
+    terminate_after = args.terminate_after or float("inf")
 
     raw_pmu_packet_queue = Queue()
 
-    raw_pmu_packet_receiver_thread = Thread(target=queue_pmu_packets, args=(raw_pmu_packet_queue, args.terminate_after))
+    raw_pmu_packet_receiver_thread = Thread(target=queue_pmu_packets, args=(raw_pmu_packet_queue, terminate_after))
     raw_pmu_packet_receiver_thread.daemon = True
     raw_pmu_packet_receiver_thread.start()
 
-    listen_for_pmu_queue(raw_pmu_packet_queue, args.terminate_after)
+    listen_for_pmu_queue(raw_pmu_packet_queue, terminate_after)
 
     Thread.join(raw_pmu_packet_receiver_thread)
-    print("Received all packets at: " + str(datetime.now()))
+    logger.info("Received all packets at: %s", datetime.now())
+    batch_receiver.print_stats()
+    close_received_log()
 
     serverSock.close()
 
+
+#every port is served from one event loop, stops after terminate_after packets or on SIGINT/SIGTERM
+def run_event_loop(args):
+    runtime = AsyncRuntime()
+    received_counter = 0
+
+    def on_pmu_packet(data):
+        nonlocal received_counter
+        if runtime.stop_reason is not None:
+            return
+        received_counter += 1
+        process_pmu_packet(data, received_counter)
+        if args.terminate_after and received_counter >= args.terminate_after:
+            runtime.stop("terminate_after")
+
+    receiver_options = {"batch_size": args.recv_batch_size, "num_buffers": args.recv_buffers}
+    endpoints = [runtime.open_pmu_endpoint(on_pmu_packet, sock=serverSock, **receiver_options)]
+    for port in args.extra_ports:
+        endpoints.append(runtime.open_pmu_endpoint(on_pmu_packet, (UDP_IP_ADDRESS, port), **receiver_options))
+
+    def log_stats():
+        logger.info("Received %d packets | socket buffer drops: %s", received_counter,
+                    sum(endpoint.receiver.kernel_drops for endpoint in endpoints))
+    if args.stats_interval > 0:
+        runtime.every(args.stats_interval, log_stats)
+    # writes out logged frames while no new ones arrive
+    runtime.every(1.0, received_log.poll)
+
+    def on_shutdown():
+        close_received_log()
+        logger.info("Received %d packets, stopped (%s) at: %s", received_counter, runtime.stop_reason, datetime.now())
+        for endpoint in endpoints:
+            endpoint.receiver.print_stats()
+    runtime.add_cleanup(on_shutdown)
+
+    runtime.run()
+
+
+# runs in a shard worker: the frames of the shard's PMUs get their own reorder window and log
+class ShardHandler(object):
+    def __init__(self, shard, args):
+        self.log, write_frame = open_frame_log(shard_log_path(args.output, shard), SHARD_LOG_HEADER, shard_log_row, args)
+        self.window = ReorderWindow(args.lateness_frames / args.frame_rate, write_frame)
+
+    def __call__(self, data):
+        try:
+            self.window.insert(frame_decoder.decode(data, datetime.now()))
+        except ValueError as e:
+            logger.warning("Dropping packet: %s", e)
+
+    def close(self):
+        self.window.flush()
+        self.log.close()
+        stats = self.window.stats()
+        logger.info("%s: late: %d | duplicates: %d | max buffered: %d", self.log.filename,
+                    stats["late"], stats["duplicates"], stats["max_buffered"])
+
+
+def run_shards(args):
+    stats = run_sharded((UDP_IP_ADDRESS, UDP_PORT_NO), args.shards, lambda shard: ShardHandler(shard, args),
+                        args.shard_mode, args.terminate_after, args.recv_batch_size, args.socket_buffer)
+    print_sharded_stats(stats)
+    merged = merge_shard_logs([shard_log_path(args.output, shard) for shard in range(args.shards)], args.output)
+    logger.info("Merged %d frames from %d shards into %s", merged, args.shards, args.output)
+
+
+# wait for incoming PMU packets
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                        prog='pmu-packet-receiver',
+                        description='Receives pmu packets',
+                        epilog='Text at the bottom of help')
+    args = parse_console_args(parser)
+    get_rate_limited_logger("pmu-receiver", getattr(logging, args.log_level), args.log_rate)
+
+    if args.shards > 0:
+        run_shards(args)
+        sys.exit(0)
+
+    # create a UDP socket object and bind it to the specified IP address and port number
+    serverSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    serverSock.bind((UDP_IP_ADDRESS, UDP_PORT_NO))
+    if args.socket_buffer:
+        serverSock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.socket_buffer)
+
+    open_received_log(args)
+    if args.runtime == 'asyncio':
+        run_event_loop(args)
+    else:
+        batch_receiver = BatchReceiver(serverSock, args.recv_batch_size, num_buffers=args.recv_buffers)
+        run_threads(args)
+
@@ -0,0 +1,176 @@
+from bisect import bisect_left
+import numpy as np
+from jpt_algo_evaluation.jpt_algo import jpt_algo
+
+'''
+Missing data recovery engine. Predictors are registered by name and estimate the next
+complex voltage of a stream from its recent history; each one declares how many past
+samples (history) it needs, and every stream only keeps that many samples around.
+Recovered samples are fed back into the history so a gap of several frames is
+predicted one step at a time.
+'''
+
+PREDICTORS = {}
+
+def register_predictor(*names):
+    def register(cls):
+        for name in names:
+            PREDICTORS[name] = cls
+        return cls
+    return register
+
+
+class Predictor(object):
+    # number of past samples predict() is given, oldest first
+    history = 1
+
+    def __init__(self, **options):
+        pass
+
+    # called for every sample added to the stream, measured=False for recovered samples
+    def observe(self, voltage, measured=True):
+        pass
+
+    def predict(self, history):
+        raise NotImplementedError
+
+
+# JPT: 3*k1 - 3*k2 + k3, which is the quadratic through the last three samples
+@register_predictor("jpt", "quadratic")
+class JptPredictor(Predictor):
+    history = 3
+
+    def predict(self, history):
+        return jpt_algo(history[2], history[1], history[0])
+
+
+# straight line through the last two samples
+@register_predictor("linear")
+class LinearPredictor(Predictor):
+    history = 2
+
+    def predict(self, history):
+        return 2 * history[1] - history[0]
+
+
+# least squares polynomial fit over a short window, evaluated one step ahead.
+# The fit only depends on the window size, so it is reduced to fixed weights up front
+@register_predictor("lsq")
+class LeastSquaresPredictor(Predictor):
+    def __init__(self, window=6, degree=2, **options):
+        if window <= degree:
+            raise ValueError("lsq window (%d) must be larger than the degree (%d)" % (window, degree))
+        self.history = window
+        self.weights = self._weights(window, degree)
+
+    @staticmethod
+    def _weights(window, degree):
+        x = np.arange(window, dtype=np.float64)
+        vandermonde = np.vander(x, degree + 1)
+        # prediction = vander(window) @ pinv(V) @ y, so the weights are the first row of that product
+        return (np.vander(np.array([float(window)]), degree + 1) @ np.linalg.pinv(vandermonde))[0].tolist()
+
+    def predict(self, history):
+        return sum(w * v for w, v in zip(self.weights, history))
+
+
+# constant velocity Kalman filter, run on the real and imaginary parts of the phasor
+# (they share the same gains since both use the same noise settings)
+@register_predictor("kalman")
+class KalmanPredictor(Predictor):
+    history = 1
+
+    def __init__(self, process_noise=1e-3, measurement_noise=1e-2, **options):
+        self.q = process_noise
+        self.r = measurement_noise
+        self.x = None
+        self.v = 0j
+        # covariance [[p00, p01], [p01, p11]]
+        self.p00, self.p01, self.p11 = 1.0, 0.0, 1.0
+
+    def _time_update(self):
+        self.x = self.x + self.v
+        self.p00 = self.p00 + 2 * self.p01 + self.p11 + self.q
+        self.p01 = self.p01 + self.p11
+        self.p11 = self.p11 + self.q
+
+    def observe(self, voltage, measured=True):
+        if self.x is None:
+            self.x = voltage
+            return
+        self._time_update()
+        if not measured:
+            # recovered samples are our own prediction, they carry no new information
+            return
+        s = self.p00 + self.r
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        innovation = voltage - self.x
+        self.x = self.x + k0 * innovation
+        self.v = self.v + k1 * innovation
+        self.p11 = self.p11 - k1 * self.p01
+        self.p01 = self.p01 - k0 * self.p01
+        self.p00 = self.p00 - k0 * self.p00
+
+    def predict(self, history):
+        return self.x + self.v
+
+
+def create_predictor(name, **options):
+    if name not in PREDICTORS:
+        raise ValueError("Unknown predictor %r, expected one of %r" % (name, sorted(PREDICTORS)))
+    return PREDICTORS[name](**options)
+
+
+# per stream recovery state: the last predictor.history samples ordered by timestamp
+class RecoveryStream(object):
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.size = max(predictor.history, 1)
+        self._timestamps = []
+        self._voltages = []
+
+    # samples are kept ordered by timestamp, duplicates and samples older than the window are ignored
+    def observe(self, timestamp, voltage, measured=True):
+        timestamps = self._timestamps
+        newest = not timestamps or timestamp > timestamps[-1]
+        if newest:
+            i = len(timestamps)
+        else:
+            i = bisect_left(timestamps, timestamp)
+            if i < len(timestamps) and timestamps[i] == timestamp:
+                return
+            if i == 0 and len(timestamps) >= self.size:
+                return
+        timestamps.insert(i, timestamp)
+        self._voltages.insert(i, voltage)
+        if len(timestamps) > self.size:
+            del timestamps[0]
+            del self._voltages[0]
+        if newest:
+            self.predictor.observe(voltage, measured)
+
+    def ready(self):
+        return len(self._voltages) >= self.predictor.history
+
+    def predict_next(self):
+        return self.predictor.predict(self._voltages[-self.predictor.history:])
+
+    def last_n(self, n):
+        return self._voltages[-n:]
+
+
+# lazily creates one RecoveryStream per stream id, all using the same predictor settings
+class RecoveryEngine(object):
+    def __init__(self, predictor_name="jpt", **options):
+        # fail on unknown predictors/options now rather than on the first digest
+        create_predictor(predictor_name, **options)
+        self.predictor_name = predictor_name
+        self.options = options
+        self.streams = {}
+
+    def stream(self, stream_id):
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = self.streams[stream_id] = RecoveryStream(create_predictor(self.predictor_name, **self.options))
+        return stream
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# jpt_algo_evaluation is imported like recovery_engine.py imports it, from the pmu_example directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from jpt_algo_evaluation.jpt_algo import (calculate_angle_statistics, calculate_approximation_error_statistics,
+                                          calculate_complex_voltages)
+
+
+def phasors():
+    exact = calculate_complex_voltages(np.full(10, 100.0), np.arange(10) * 10.0)
+    approximate = exact.copy()
+    # sample 3 is off by 90 degrees, sample 6 by 5
+    approximate[3] *= 1j
+    approximate[6] *= np.exp(1j * np.radians(5))
+    return exact, approximate
+
+
+def test_angle_statistics_of_every_sample():
+    exact, approximate = phasors()
+    mean, stdev, maximum = calculate_angle_statistics(exact, approximate)
+    assert maximum == pytest.approx(90.0)
+    assert mean == pytest.approx(9.5)
+
+
+@pytest.mark.parametrize("generated", [[3, 6], np.array([3, 6]), np.isin(np.arange(10), [3, 6])],
+                         ids=["list", "indexes", "mask"])
+def test_angle_statistics_of_the_generated_samples(capsys, generated):
+    exact, approximate = phasors()
+    mean, stdev, maximum = calculate_angle_statistics(exact, approximate, generated)
+    assert (mean, maximum) == (pytest.approx(47.5), pytest.approx(90.0))
+    # deviations over 50 degrees are reported by their sample index
+    assert capsys.readouterr().out.strip() == "issue with: [3]"
+
+
+def test_approximation_error_statistics_with_a_mask():
+    exact = np.array([100.0, 200.0, 400.0, 50.0])
+    approximate = np.array([110.0, 200.0, 300.0, 50.0])
+    mask = np.array([True, False, True, False])
+    mean, stdev, maximum = calculate_approximation_error_statistics(exact, approximate, mask)
+    assert (mean, maximum) == (pytest.approx(17.5), pytest.approx(25.0))
+    assert calculate_approximation_error_statistics(exact, approximate, [0, 2]) == (mean, stdev, maximum)
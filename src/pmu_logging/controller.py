@@ -6,17 +6,33 @@ import struct
 import nnpy
 import socket
 import math
-from threading import Thread
-from queue import Queue
 import time
 import datetime
-import csv
-import ipaddress
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+from pmu_lib.log_sink import CsvLogSink, FSYNC_POLICIES, FSYNC_NONE
+from pmu_lib.binary_log import BinaryLogSink, COMPRESSIONS, COMPRESSION_NONE, FORMAT_EPOCH_US, FORMAT_IPV4
+from pmu_lib.segment_log import SegmentedLog
+import numpy as np
+from pmu_lib.digest_layouts import DigestDecoderTable
+from pmu_lib.digest_ingest import add_ingest_arguments, ingestor_from_args, serve_digests, RUNTIME_ASYNCIO
+from pmu_lib.async_runtime import AsyncRuntime
 
 # Global variables
-digest_message_num_bytes = 40
 delayed_packet_count = 0
 counter = 0
+log_sink = None
+digest_decoders = None
+
+#binary log record of a delayed packet, angles in degrees and addresses as big endian ints
+DELAYED_PACKET_DTYPE = np.dtype([
+    ("timestamp_us", "<u8"),
+    ("magnitude", "<f4", (3,)), ("angle", "<f4", (3,)),
+    ("src_addr", "<u4"), ("dst_addr", "<u4"),
+])
+DELAYED_PACKET_FORMATS = {"timestamp_us": FORMAT_EPOCH_US, "src_addr": FORMAT_IPV4, "dst_addr": FORMAT_IPV4}
+
 class SimpleSwitchAPI(runtime_CLI.RuntimeAPI):
     @staticmethod
     def get_thrift_services():
@@ -27,47 +43,39 @@ class SimpleSwitchAPI(runtime_CLI.RuntimeAPI):
                                         standard_client, mc_client)
         self.sswitch_client = sswitch_client
 
-def parse_phasors(phasor_data, settings={"num_phasors": 1, "pmu_measurement_bytes": 8}):
-    phasor = {
-        "magnitude": struct.unpack('>f', phasor_data[0:4])[0],
-        "angle": math.degrees(struct.unpack('>f', phasor_data[4:])[0]),
-    }
-    return [phasor]
+#phasor angles arrive in radians, they are logged in degrees
+def phasor_list(magnitude, angle):
+    return [{"magnitude": magnitude, "angle": math.degrees(angle)}]
 
 def on_digest_recv(msg):
     print('received a message')
+    #unpacking digest header, "num" is the number of messages in the digest,
+    #the layout is looked up by the header's list_id and the messages are unpacked lazily
+    try:
+        header, layout, records = digest_decoders.decode(msg)
+    except KeyError as e:
+        print("Ignoring digest: " + str(e))
+        return
+    digest_handlers[layout.name](records)
+
+def log_delayed_packets(records):
     global delayed_packet_count
-    #unpacking digest header, "num" is the number of messages in the digest
-    _, _, ctx_id, list_id, buffer_id, num = struct.unpack("<iQiiQi", msg[:32])
-
     ### Insert the receiving logic below ###
-    #trimming off the digest header
-    msg = msg[32:]
-
-    offset = digest_message_num_bytes
-
-
-
     # loop through the messages in the digest
-    for m in range(num):
+    for record in records:
         print('got something')
-        #TODO: log a delayed packet to a database here after extracting out the necessary info
-
 
         delayed_packet_count += 1
 
-        #### unpack the message
-        curr_soc = int.from_bytes(msg[0:4], byteorder="big")
-        curr_fracsec = int.from_bytes(msg[4:8], byteorder="big")
-        phasors0 = parse_phasors(msg[8:16])
-        phasors1 = parse_phasors(msg[16:24])
-        phasors2 = parse_phasors(msg[24:32])
-        src_ip = ipaddress.ip_address(msg[32:36])
-        dest_ip = ipaddress.ip_address(msg[36:40])
+        phasors0 = phasor_list(record.magnitude0, record.angle0)
+        phasors1 = phasor_list(record.magnitude1, record.angle1)
+        phasors2 = phasor_list(record.magnitude2, record.angle2)
+        src_ip = socket.inet_ntoa(record.src_addr)
+        dest_ip = socket.inet_ntoa(record.dst_addr)
 
         print("NUM DELAYED TOTAL: " + str(delayed_packet_count))
 
-        datetime_obj = datetime.datetime.fromtimestamp(curr_soc + (curr_fracsec / 1000000))
+        datetime_obj = datetime.datetime.fromtimestamp(record.soc0 + (record.fracsec0 / 1000000))
 
         print("Datetime:", datetime_obj)
         print("Phasors 0: ", phasors0)
@@ -76,19 +84,42 @@ def on_digest_recv(msg):
         print("Source IP:", src_ip)
         print("Destination IP:", dest_ip)
 
-        # Write to CSV
-        with open('log.csv', 'a', newline='') as file:
-            writer = csv.writer(file)
-            if file.tell() == 0:
-                writer.writerow(["Datetime", "Phasor 1", "Phasor 2", "Phasor 3", "Source IP", "Destination IP"])
-            writer.writerow([datetime_obj, phasors0, phasors1, phasors2, src_ip, dest_ip])
+        # hand the row to the log sink, it is written out with the next batch
+        if isinstance(log_sink, CsvLogSink):
+            log_sink.write([datetime_obj, phasors0, phasors1, phasors2, src_ip, dest_ip])
+        else:
+            log_sink.write(delayed_packet_record(record))
+
+#DELAYED_PACKET_DTYPE record of a digest message
+def delayed_packet_record(record):
+    return (record.soc0 * 1000000 + record.fracsec0,
+            (record.magnitude0, record.magnitude1, record.magnitude2),
+            (math.degrees(record.angle0), math.degrees(record.angle1), math.degrees(record.angle2)),
+            int.from_bytes(record.src_addr, "big"), int.from_bytes(record.dst_addr, "big"))
 
-        msg = msg[offset:]
-        
-        #return digest_packet
+#digest struct name -> handler for its decoded messages
+digest_handlers = {
+    "digest_pmu_packet": log_delayed_packets,
+}
 
 def setup():
-    args = runtime_CLI.get_parser().parse_args()
+    parser = runtime_CLI.get_parser()
+    parser.add_argument('--p4info', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build/pmu_logging.p4.p4info.txt'), help='p4info file the digest layouts are read from')
+    parser.add_argument('--terminate_after', type=int, default=10, help='Number of digests to process before terminating (0 runs until interrupted)')
+    add_ingest_arguments(parser)
+    parser.add_argument('--log_file', default=None, help='File delayed packets are logged to, directory for segments (default log.csv, log.bin or delayed-log)')
+    parser.add_argument('--log_format', choices=['csv', 'binary', 'segments'], default='csv', help='Log rows as text, as fixed size binary records, or as binary records in rotated time indexed segments (export/query with utils/export_log.py)')
+    parser.add_argument('--log_segment_seconds', type=float, default=3600, help='Seconds of packet time per log segment (segments format, 0 = no limit)')
+    parser.add_argument('--log_segment_bytes', type=int, default=64 << 20, help='Max bytes of a log segment (segments format, 0 = no limit)')
+    parser.add_argument('--log_retention_seconds', type=float, default=0, help='Segments older than this many seconds of packet time are deleted (0 = keep all)')
+    parser.add_argument('--log_retention_bytes', type=int, default=0, help='Oldest segments are deleted while all of them take more bytes than this (0 = no limit)')
+    parser.add_argument('--log_compression', choices=COMPRESSIONS, default=COMPRESSION_NONE, help='Compression of the binary log blocks')
+    parser.add_argument('--log_batch_size', type=int, default=512, help='Number of records buffered before they are written')
+    parser.add_argument('--log_flush_interval', type=float, default=1.0, help='Max seconds a record stays buffered before it is written')
+    parser.add_argument('--log_fsync', choices=FSYNC_POLICIES, default=FSYNC_NONE, help='When to fsync the log file: never, after every batch or on an interval')
+    parser.add_argument('--log_fsync_interval', type=float, default=5.0, help='Seconds between fsyncs for --log_fsync interval')
+
+    args = parser.parse_args()
 
     args.pre = runtime_CLI.PreType.SimplePreLAG
 
@@ -110,28 +141,80 @@ def setup():
     sub.connect(socket)
     sub.setsockopt(nnpy.SUB, nnpy.SUB_SUBSCRIBE, '')
 
-    return runtime_api, sub
-
-def listen_for_new_digests(q):
+    global digest_decoders
+    digest_decoders = DigestDecoderTable(args.p4info, args.json or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build/pmu_logging.json'))
+    digest_decoders.get_by_name("digest_pmu_packet").check_fields(
+        ["soc0", "fracsec0", "magnitude0", "angle0", "magnitude1", "angle1", "magnitude2", "angle2", "src_addr", "dst_addr"])
+
+    global log_sink
+    sink_options = {
+        "max_batch_records": args.log_batch_size,
+        "max_batch_delay": args.log_flush_interval,
+        "fsync_policy": args.log_fsync,
+        "fsync_interval": args.log_fsync_interval,
+    }
+    if args.log_format == 'segments':
+        log_sink = SegmentedLog(args.log_file or 'delayed-log', DELAYED_PACKET_DTYPE, "timestamp_us", DELAYED_PACKET_FORMATS,
+                                args.log_compression, args.log_segment_seconds, args.log_segment_bytes,
+                                args.log_retention_seconds, args.log_retention_bytes, **sink_options)
+    elif args.log_format == 'binary':
+        log_sink = BinaryLogSink(args.log_file or 'log.bin', DELAYED_PACKET_DTYPE, DELAYED_PACKET_FORMATS,
+                                 args.log_compression, **sink_options)
+    else:
+        log_sink = CsvLogSink(
+            args.log_file or 'log.csv',
+            header=["Datetime", "Phasor 1", "Phasor 2", "Phasor 3", "Source IP", "Destination IP"],
+            **sink_options)
+
+    return runtime_api, args, sub
+
+def listen_for_new_digests(ingestor, terminate_after):
     global counter
-    while counter < 10:
-        counter += 1
-        event_data = q.get()
+    while terminate_after <= 0 or counter < terminate_after:
+        #wake up periodically so buffered records are written even when no digests arrive
+        batch = ingestor.get_batch(timeout=log_sink.max_batch_delay)
+        if terminate_after > 0:
+            batch = batch[:terminate_after - counter]
+        for event_data in batch:
+            on_digest_recv(event_data)
+        counter += len(batch)
+        log_sink.poll()
+
+def on_digest_batch(batch, terminate_after):
+    global counter
+    if terminate_after > 0:
+        batch = batch[:terminate_after - counter]
+    for event_data in batch:
         on_digest_recv(event_data)
-        q.task_done()
-
-def queue_digests(digest_queue, sub):
-    message = sub.recv()
-    digest_queue.put(message)
+    counter += len(batch)
+    return terminate_after > 0 and counter >= terminate_after
+
+#digests are handled on one event loop until terminate_after digests or SIGINT/SIGTERM,
+#buffered log records are flushed by a periodic task and written out on shutdown
+def run_event_loop(runtime_api, args, sub):
+    runtime = AsyncRuntime()
+    runtime.add_cleanup(log_sink.close)
+    runtime.every(log_sink.max_batch_delay, log_sink.poll)
+    serve_digests(runtime, sub, args, runtime_api.client,
+                  lambda batch: on_digest_batch(batch, args.terminate_after))
+    runtime.run()
+
+def run_threads(runtime_api, args, sub):
+    # receives digests continuously on its own thread into a bounded buffer,
+    # each digest buffer is acked back to the switch from a separate thread
+    ingestor = ingestor_from_args(sub, args, runtime_api.client).start()
+
+    try:
+        listen_for_new_digests(ingestor, args.terminate_after)
+    finally:
+        ingestor.stop()
+        ingestor.print_stats()
+        log_sink.close()
 
 if __name__ == "__main__":
-    runtime_api, sub = setup()
-
-    digest_message_queue = Queue()
-
-    # Create the thread to listen for digest messages
-    digest_message_thread = Thread(target=queue_digests, args=(digest_message_queue, sub))
-    digest_message_thread.daemon = True
-    digest_message_thread.start()
+    runtime_api, args, sub = setup()
 
-    listen_for_new_digests(digest_message_queue)
+    if args.runtime == RUNTIME_ASYNCIO:
+        run_event_loop(runtime_api, args, sub)
+    else:
+        run_threads(runtime_api, args, sub)
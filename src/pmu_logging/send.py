@@ -2,108 +2,68 @@
 
 import socket
 import datetime
-import math
-import struct
 import pandas as pd
 import sys
 import time
 import argparse
 import json
 import csv
+import os
 sys.path.append('../')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
 from utilities.pmu_csv_parser import parse_csv_data
+from pmu_lib.frame_encoder import FrameEncoder
+from pmu_lib.replay_scheduler import ReplayScheduler
+from pmu_lib.replay_encoder import prepare_replay
+from pmu_lib.drop_model import drops_from_spec
+from pmu_lib.send_journal import SendJournal
+from pmu_lib.load_generator import source_from_csv_data, make_stream_specs, run_load, print_load_stats
 from datetime import datetime
 
-index = 0
-csv_sent_time_data = [["index", "sent_at"]]
-def generate_packet(time, voltages, angles, settings={"pmu_measurement_bytes": 8, "destination_ip": "192.168.0.100", "destination_port": 4712}):
-    # Define the PMU packet as a byte string
-    datetime_str = str(time)[:26]
-    global index
-    try:
-        dt = datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S.%f')
-    except ValueError:
-        dt = datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S')
-
-    # 2 byte
-
-    sync = b'\xAA\x01'
-    #sync = index.to_bytes(2, 'big')
-
-
-    # 2 byte, 44 for 32 bit values of PMU, 40 for 16 bit values of PMU
-    # 36 - 8 + 8 * number of PMUs || 36 - 8 + 4 * number PMUs
-    frame_size = b'\x00\x24'
-
-    # 2 byte, 12 for this
-    id_code = b'\x00\x0C'
-
-    # 4 byte
-    soc = int(dt.strftime("%s")).to_bytes(4, 'big')
-    #print(dt.strftime("%s"))
-    # 4 byte
-    frac_sec = dt.microsecond.to_bytes(4, 'big')
-    # 2 byte (no errors)
-    stat = b'\x00\x00'
-
-    # 4 or 8 byte x number of phasors (see doc, 8 is for float)
-    voltage_bytes0 = struct.pack('>f', voltages[0])
-    angle_bytes0 = struct.pack('>f', math.radians(angles[0]))
-
-    voltage_bytes1 = struct.pack('>f', voltages[1])
-    angle_bytes1 = struct.pack('>f', math.radians(angles[1]))
-
-    voltage_bytes2 = struct.pack('>f', voltages[2])
-    angle_bytes2 = struct.pack('>f', math.radians(angles[2]))
-
-    # 24 bytes total, first 8 bytes for first phasor, next 8 bytes for next phasor, and so on
-    phasors = voltage_bytes0 + angle_bytes0 + voltage_bytes1 + angle_bytes1 + voltage_bytes2 + angle_bytes2
-
-
-    # 2 byte, assumed 60
-    freq = b'\x09\xC4'
-
-    # 2 byte
-    dfreq = b'\x00\x00'
-
-    # 4 byte
-    analog = b'\x00\x00\x00\x00'
-
-    # 2 byte
-    digital = b'\x00\x00'
-
-    # 2 byte
-    chk = b'\x00\x00'
-
-    pmu_packet = sync + frame_size + id_code + soc + frac_sec + \
-        stat + phasors + freq + dfreq + analog + digital + chk
-
-    # Set the destination IP address and port number
-    destination_ip = settings["destination_ip"]
-    destination_port = 4712
-
-    # Create a UDP socket
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    #write to csv file the index and the time
-    csv_sent_time_data.append([index, datetime.now()])
-
-    # Send the PMU packet to the destination IP address and port number
-    udp_socket.sendto(pmu_packet, (destination_ip, destination_port))
-
-    # Close the UDP socket
-    udp_socket.close()
-
+# PMU 12 with 3 phasors, no errors in stat
+frame_encoder = FrameEncoder(num_phasors=3, id_code=12)
 
 def parse_console_args(parser):
     parser.add_argument('filename')
     parser.add_argument('--ip', default="10.0.2.2")
     parser.add_argument('--port', default=4712)
     parser.add_argument('--num_packets', default=100)
-    parser.add_argument('--drop_indexes', default='./missing-data.json')
+    parser.add_argument('--drop_indexes', default='./missing-data.json',
+                        help='JSON list of frame indexes to drop, or a generated pattern: uniform:<p>, '
+                             'gilbert:<p_good_bad>,<p_bad_good>[,<loss_good>,<loss_bad>] or periodic:<period>,<outage>[,<offset>]')
+    parser.add_argument('--drop_seed', type=int, default=None, help='Seed of the random drop patterns')
+    parser.add_argument('--sent_journal', default=None, help='Binary journal of the index and send time of every frame (off by default)')
+    parser.add_argument('--csv_cache', default=None, help='Binary copy of the parsed csv columns, reused while the csv is unchanged')
+    parser.add_argument('--replay_cache', default=None, help='npz file the encoded replay is cached in between runs')
+    parser.add_argument('--rate', default=1.0, help='Replay speed as a multiple of the original TimeTag spacing, 0 sends as fast as possible')
+    # load generation mode, simulates many PMUs instead of replaying PMU 12
+    parser.add_argument('--pmus', type=int, default=0, help='Number of PMUs to simulate (load generation mode when > 0)')
+    parser.add_argument('--extra_csv', nargs='*', default=[], help='More recordings the simulated PMUs are spread over')
+    parser.add_argument('--pmu_phasors', default='3', help='Comma separated phasor counts, cycled through the simulated PMUs')
+    parser.add_argument('--first_id_code', type=int, default=1, help='id_code of the first simulated PMU')
+    parser.add_argument('--time_shift', type=float, default=0.0, help='Seconds added to the time base of each successive simulated PMU')
+    parser.add_argument('--noise', type=float, default=0.0, help='Relative std deviation of the noise magnitudes of each simulated PMU are scaled by (0.01 = 1%%)')
+    parser.add_argument('--angle_noise', type=float, default=0.0, help='Std deviation in degrees of the noise added to the angles of each simulated PMU')
+    parser.add_argument('--workers', type=int, default=None, help='Number of sender processes (defaults to the number of cores)')
 
     return parser.parse_args()
 
+def run_load_generation(args):
+    phasor_counts = [int(count) for count in args.pmu_phasors.split(',')]
+    num_columns = max(phasor_counts)
+    sources = [source_from_csv_data(parse_csv_data(
+        filename,
+        "TimeTag",
+        ["Magnitude%02d" % (k + 1) for k in range(num_columns)],
+        ["Angle%02d" % (k + 1) for k in range(num_columns)]
+    )) for filename in [args.filename] + args.extra_csv]
+
+    specs = make_stream_specs(args.pmus, len(sources), phasor_counts, args.first_id_code, args.time_shift,
+                              args.noise, args.angle_noise)
+    print("Start load generation at: " + str(datetime.now()))
+    stats = run_load(sources, specs, (args.ip, int(args.port)), args.workers, float(args.rate), int(args.num_packets))
+    print_load_stats(stats)
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -113,27 +73,58 @@ if __name__ == "__main__":
 
     args = parse_console_args(parser)
 
-    drop_indexes_file = open(args.drop_indexes)
-
-    drop_indexes = json.load(drop_indexes_file)
+    if args.pmus > 0:
+        run_load_generation(args)
+        sys.exit(0)
+
+    def load_csv_data():
+        return parse_csv_data(
+            args.filename,
+            "TimeTag",
+            ["Magnitude01", "Magnitude02", "Magnitude03"],
+            ["Angle01", "Angle02", "Angle03"],
+            cache_path=args.csv_cache,
+            max_rows=int(args.num_packets) if int(args.num_packets) > 0 else None
+        )
+
+    # every frame is encoded before the first one is sent (or loaded from --replay_cache)
+    replay = prepare_replay(args.filename, frame_encoder, load_csv_data, int(args.num_packets), args.replay_cache)
+    frames = frame_encoder.split_frames(replay.frames)
+
+    # bitmap of the dropped frames, O(1) lookups however long the replay is
+    try:
+        drop_indexes = drops_from_spec(args.drop_indexes, replay.num_frames, args.drop_seed)
+    except ValueError as e:
+        parser.error("--drop_indexes: %s" % e)
+    print("Dropping %d of %d frames" % (len(drop_indexes), replay.num_frames))
 
-    pmu_csv_data = parse_csv_data(
-        args.filename,
-        "TimeTag",
-        ["Magnitude01", "Magnitude02", "Magnitude03"],
-        ["Angle01", "Angle02", "Angle03"]
-    )
-
-    num_to_send = len(pmu_csv_data["times"])
-    if int(args.num_packets) > 0:
-        num_to_send = int(args.num_packets)
-
-    for i in range(num_to_send):
-        if i == 0:
-            print("Start transmission at: " + str(datetime.now()))
-        #sending to loopback as opposed to switch
-        settings_obj = {"destination_ip": "127.0.0.1" if i in drop_indexes else  args.ip, "destination_port": int(args.port)}
-        time.sleep(0.017)
-        generate_packet(pmu_csv_data["times"][i], [pmu_csv_data["magnitudes"][0][i], pmu_csv_data["magnitudes"][1][i], pmu_csv_data["magnitudes"][2][i]], [pmu_csv_data["phase_angles"][0][i], pmu_csv_data["phase_angles"][1][i], pmu_csv_data["phase_angles"][2][i]], settings_obj)
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    destination = (args.ip, int(args.port))
+    #dropped packets go to loopback as opposed to switch
+    drop_destination = ("127.0.0.1", int(args.port))
+    sendto = udp_socket.sendto
+
+    def send_frame(i):
+        sendto(frames[i], drop_destination if i in drop_indexes else destination)
+
+    journal = None
+    if args.sent_journal:
+        journal = SendJournal(args.sent_journal)
+        record_sent = journal.record
+        send_unjournaled = send_frame
+
+        def send_frame(i):
+            #write the index and the time it was sent
+            record_sent(i)
+            send_unjournaled(i)
+
+    # frames go out at the original TimeTag spacing (scaled by --rate) on an absolute clock
+    scheduler = ReplayScheduler(float(args.rate))
+    print("Start transmission at: " + str(datetime.now()))
+    scheduler.run(replay.offsets, send_frame)
+    scheduler.print_stats()
+    udp_socket.close()
+    if journal is not None:
+        journal.close()
 
     # generate_packets()
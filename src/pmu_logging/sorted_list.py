@@ -1,62 +1,196 @@
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
+from itertools import chain
 import sys
 import csv
-#creates ascending order sorted list (no duplicates). inserts items in O(n)
+
+#items are kept in sorted chunks of at most 2 * CHUNK_SIZE
+CHUNK_SIZE = 512
+
+#creates ascending order sorted list (no duplicates). A binary search over the chunks' last keys
+#and one inside the chunk finds the insert position (and a duplicate key) in O(log n), the list
+#insert only shifts one chunk. Items arriving in key order are appended in amortized O(1)
 class KeySortedList:
-    def __init__(self, key=None,  keyfunc=lambda v: v):
-        self._list = []
-        self._keys = []
+    def __init__(self, key=None,  keyfunc=lambda v: v, chunk_size=CHUNK_SIZE):
         self._keyfunc = keyfunc
+        self._chunk_size = chunk_size
+        self._key_chunks = []
+        self._item_chunks = []
+        #last (largest) key of every chunk
+        self._maxes = []
+        self._len = 0
 
+    #returns False if an item with the same key is already in the list
     def insert(self, item):
         k = self._keyfunc(item)  # Get key.
-        try:
+        maxes = self._maxes
+        if not maxes:
+            self._key_chunks.append([k])
+            self._item_chunks.append([item])
+            maxes.append(k)
+            self._len = 1
+            return True
+        if k > maxes[-1]:
+            #newest item, the common case
+            c = len(maxes) - 1
+            self._key_chunks[c].append(k)
+            self._item_chunks[c].append(item)
+            maxes[c] = k
+        else:
+            c = bisect_left(maxes, k)  # first chunk that can hold the key
+            keys = self._key_chunks[c]
+            i = bisect_left(keys, k)  # Determine where to insert item.
             #won't add key if already exists
-            self._keys.index(k)
-        except:
-            i = bisect_left(self._keys, k)  # Determine where to insert item.
-            self._keys.insert(i, k)  # Insert key of item to keys list.
-            self._list.insert(i, item)  # Insert the item itself in the corresponding place.
+            if keys[i] == k:
+                return False
+            keys.insert(i, k)
+            self._item_chunks[c].insert(i, item)
+        self._len += 1
+        if len(self._key_chunks[c]) > 2 * self._chunk_size:
+            self._split(c)
+        return True
+
+    def _split(self, c):
+        half = self._chunk_size
+        keys = self._key_chunks[c]
+        items = self._item_chunks[c]
+        self._key_chunks[c:c + 1] = [keys[:half], keys[half:]]
+        self._item_chunks[c:c + 1] = [items[:half], items[half:]]
+        self._maxes[c:c + 1] = [keys[half - 1], keys[-1]]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._item_chunks)
+
+    #same slice semantics as list[-n:], only the chunks at the end are touched for 0 < n < len
+    def _last_n(self, n):
+        if 0 < n < self._len:
+            tail = []
+            count = 0
+            for items in reversed(self._item_chunks):
+                tail.append(items)
+                count += len(items)
+                if count >= n:
+                    break
+            return list(chain.from_iterable(reversed(tail)))[-n:]
+        return list(self)[-n:]
 
     def retrieve_last_n(self, n):
-        return self._list[-n:]
+        return self._last_n(n)
 
     def print_pmu(self):
         counter = 1
-        for pmu in self._list:
-            print(str(counter) + " : " + str(pmu["sync"]) + " | " + "Magnitude: " + str(pmu["phasors"][0]["magnitude"]) + " | Phase_angle: " + str(pmu["phasors"][0]["angle"]))
+        for pmu in self:
+            print(str(counter) + " : " + str(pmu.sync) + " | " + "Magnitude: " + str(pmu.magnitudes[0]) + " | Phase_angle: " + str(pmu.angles[0]))
             counter += 1
 
             #index starts at 1
     def print_recovered(self, indexes_only):
-        for i in range(len(self._list)):
-            pmu = self._list[i]
+        for i, pmu in enumerate(self):
             #generated packet
-            if pmu["stat"] == 9:
+            if pmu.stat == 9:
                 if indexes_only:
                     print(str(i + 1) + " indexed packet was recoved")
                 else:
-                    print(str(pmu["sync"]) + " | " + "Magnitude: " + str(pmu["phasors"][0]["magnitude"]) + " | Phase_angle: " + str(pmu["phasors"][0]["angle"]))
+                    print(str(pmu.sync) + " | " + "Magnitude: " + str(pmu.magnitudes[0]) + " | Phase_angle: " + str(pmu.angles[0]))
 
     def write_to_csv(self, filename):
         headers = ["index", "magnitude", "phase_angle", "is_predicted", "received_at"]
         csv_obj = [headers]
-        for i in range(len(self._list)):
-            pmu = self._list[i]
+        for i, pmu in enumerate(self):
             csv_obj.append(
                 [
                  i,
-                 pmu["phasors"][0]["magnitude"],
-                 pmu["phasors"][0]["angle"],
-                 pmu["stat"] == 9,
-                 pmu["received_at"]])
+                 pmu.magnitudes[0],
+                 pmu.angles[0],
+                 pmu.stat == 9,
+                 pmu.received_at])
         with open(filename, 'w', newline='') as file:
             writer = csv.writer(file)
             writer.writerows(csv_obj)
 
-    #TODO
-    def flush():
-        print("flush the list here")
+    #removes the items with key <= max_key (all items if max_key is None) from the front of the list,
+    #calls sink(item) for each in order and returns how many were removed
+    def flush(self, sink=None, max_key=None):
+        removed = 0
+        while self._maxes:
+            partial = max_key is not None and self._maxes[0] > max_key
+            if partial:
+                count = bisect_right(self._key_chunks[0], max_key)
+                if not count:
+                    break
+                items = self._item_chunks[0][:count]
+                del self._key_chunks[0][:count], self._item_chunks[0][:count]
+            else:
+                items = self._item_chunks[0]
+                del self._key_chunks[0], self._item_chunks[0], self._maxes[0]
+            if sink is not None:
+                for item in items:
+                    sink(item)
+            removed += len(items)
+            self._len -= len(items)
+            if partial:
+                break
+        return removed
 
     def get_last_n(self, n):
-        return self._list[-n:]
+        return self._last_n(n)
+
+#holds frames for a bounded lateness (seconds of frame time) so that late and reordered
+#frames can still be put in place, then emits them in timestamp order to sink(index, frame).
+#A frame is emitted once a frame more than lateness newer has arrived, frames that arrive after
+#their slot was emitted are counted as late and dropped, repeated frames are dropped
+class ReorderWindow:
+    def __init__(self, lateness, sink, timefunc=lambda pmu: pmu.timestamp, tiebreak=lambda pmu: pmu.id_code):
+        self.lateness = lateness
+        self.sink = sink
+        self._timefunc = timefunc
+        self._buffer = KeySortedList(keyfunc = lambda pmu: (timefunc(pmu), tiebreak(pmu)))
+        self._newest = None
+        #time of the last emitted frame, anything at or before it arrived too late
+        self._emitted_until = None
+
+        self.received = 0
+        self.emitted = 0
+        self.late = 0
+        self.duplicates = 0
+        self.max_buffered = 0
+
+    def _emit(self, pmu):
+        self._emitted_until = self._timefunc(pmu)
+        self.sink(self.emitted, pmu)
+        self.emitted += 1
+
+    def insert(self, pmu):
+        self.received += 1
+        t = self._timefunc(pmu)
+        if self._emitted_until is not None and t <= self._emitted_until:
+            self.late += 1
+            return False
+        if not self._buffer.insert(pmu):
+            self.duplicates += 1
+            return False
+        if len(self._buffer) > self.max_buffered:
+            self.max_buffered = len(self._buffer)
+        if self._newest is None or t > self._newest:
+            self._newest = t
+            self._buffer.flush(self._emit, (t - self.lateness, float("inf")))
+        return True
+
+    #emits every buffered frame, at the end of a run
+    def flush(self):
+        self._buffer.flush(self._emit)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "emitted": self.emitted,
+            "buffered": len(self._buffer),
+            "late": self.late,
+            "duplicates": self.duplicates,
+            "max_buffered": self.max_buffered,
+        }
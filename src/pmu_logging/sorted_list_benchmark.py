@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+from bisect import bisect_left
+from sorted_list import KeySortedList
+
+#the KeySortedList this replaced: linear duplicate scan plus two O(n) list inserts per item
+class LegacyKeySortedList:
+    def __init__(self, key=None,  keyfunc=lambda v: v):
+        self._list = []
+        self._keys = []
+        self._keyfunc = keyfunc
+
+    def insert(self, item):
+        k = self._keyfunc(item)
+        try:
+            self._keys.index(k)
+        except:
+            i = bisect_left(self._keys, k)
+            self._keys.insert(i, k)
+            self._list.insert(i, item)
+
+    def get_last_n(self, n):
+        return self._list[-n:]
+
+#frame timestamps at 60 fps arriving nearly sorted: a fraction of the frames is late by up to
+#max_delay frames and a fraction arrives twice
+def arrivals(n, late_fraction, max_delay, duplicate_fraction, seed):
+    rng = random.Random(seed)
+    timestamps = [1390950013 + i / 60 for i in range(n)]
+    order = list(range(n))
+    for i in range(n):
+        if rng.random() < late_fraction:
+            j = min(n - 1, i + rng.randint(1, max_delay))
+            order[i], order[j] = order[j], order[i]
+    stream = [timestamps[i] for i in order]
+    #(position, timestamp) of the repeated frames, merged in with one pass
+    duplicates = sorted((min(n, i + rng.randint(1, max_delay)), stream[i])
+                        for i in (rng.randrange(n) for _ in range(int(n * duplicate_fraction))))
+    merged = []
+    d = 0
+    for i, timestamp in enumerate(stream):
+        while d < len(duplicates) and duplicates[d][0] == i:
+            merged.append(duplicates[d][1])
+            d += 1
+        merged.append(timestamp)
+    merged.extend(timestamp for _, timestamp in duplicates[d:])
+    return merged
+
+def time_inserts(container, stream):
+    insert = container.insert
+    start = time.perf_counter()
+    for timestamp in stream:
+        insert(timestamp)
+    return time.perf_counter() - start
+
+def parse_console_args(parser):
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10**4, 10**5, 10**6, 10**7])
+    parser.add_argument('--legacy_max', type=int, default=10**5, help='Largest size the legacy class is run at, it is quadratic')
+    parser.add_argument('--late_fraction', type=float, default=0.01)
+    parser.add_argument('--max_delay', type=int, default=5, help='Frames a late frame is behind')
+    parser.add_argument('--duplicate_fraction', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                        prog='sorted-list-benchmark',
+                        description='Compares KeySortedList inserts with the previous implementation')
+    args = parse_console_args(parser)
+
+    print("%10s | %14s | %14s | %8s" % ("elements", "chunked (s)", "legacy (s)", "speedup"))
+    for n in args.sizes:
+        stream = arrivals(n, args.late_fraction, args.max_delay, args.duplicate_fraction, args.seed)
+        chunked = KeySortedList()
+        chunked_time = time_inserts(chunked, stream)
+        if n <= args.legacy_max:
+            legacy = LegacyKeySortedList()
+            legacy_time = time_inserts(legacy, stream)
+            if list(chunked) != legacy._list:
+                raise SystemExit("Implementations disagree at %d elements" % n)
+            print("%10d | %14.3f | %14.3f | %7.1fx" % (n, chunked_time, legacy_time, legacy_time / chunked_time))
+        else:
+            print("%10d | %14.3f | %14s | %8s" % (n, chunked_time, "skipped", "-"))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# sorted_list.py is imported like receive.py imports it, from the pmu_logging directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,101 @@
+import random
+from collections import namedtuple
+
+from sorted_list import KeySortedList, ReorderWindow
+
+Frame = namedtuple("Frame", ["timestamp", "id_code"])
+
+
+def make_window(lateness):
+    emitted = []
+    window = ReorderWindow(lateness, lambda index, pmu: emitted.append((index, pmu)))
+    return window, emitted
+
+
+def test_in_order_frames_are_emitted_after_the_lateness():
+    window, emitted = make_window(2)
+    for t in range(5):
+        assert window.insert(Frame(t, 12))
+    # frames newer than newest - lateness stay buffered
+    assert [pmu.timestamp for _, pmu in emitted] == [0, 1, 2]
+    assert len(window) == 2
+    assert [index for index, _ in emitted] == [0, 1, 2]
+
+
+def test_out_of_order_frames_within_the_lateness_are_sorted():
+    window, emitted = make_window(3)
+    for t in [0, 2, 1, 4, 3, 6, 5, 7]:
+        assert window.insert(Frame(t, 12))
+    window.flush()
+    assert [pmu.timestamp for _, pmu in emitted] == list(range(8))
+    assert [index for index, _ in emitted] == list(range(8))
+    assert window.stats()["late"] == 0
+
+
+def test_frames_behind_the_emitted_ones_are_late():
+    window, emitted = make_window(1)
+    for t in [0, 1, 2, 3]:
+        window.insert(Frame(t, 12))
+    # 2 was emitted when 3 arrived, so 2 and anything before it are late
+    assert not window.insert(Frame(2, 12))
+    assert not window.insert(Frame(0, 12))
+    assert window.insert(Frame(2.5, 12))
+    stats = window.stats()
+    assert stats["late"] == 2
+    assert stats["received"] == 7
+    window.flush()
+    assert [pmu.timestamp for _, pmu in emitted] == [0, 1, 2, 2.5, 3]
+
+
+def test_duplicates_are_counted_and_dropped():
+    window, emitted = make_window(5)
+    assert window.insert(Frame(1, 12))
+    assert not window.insert(Frame(1, 12))
+    # the same time from another PMU is a different frame
+    assert window.insert(Frame(1, 13))
+    window.flush()
+    assert emitted == [(0, Frame(1, 12)), (1, Frame(1, 13))]
+    assert window.stats()["duplicates"] == 1
+
+
+def test_flush_emits_everything_buffered():
+    window, emitted = make_window(100)
+    frames = [Frame(t, 12) for t in range(50)]
+    random.Random(1).shuffle(frames)
+    for frame in frames:
+        window.insert(frame)
+    assert emitted == []
+    assert window.stats()["max_buffered"] == 50
+    window.flush()
+    assert [pmu for _, pmu in emitted] == sorted(frames)
+    assert window.stats() == {"received": 50, "emitted": 50, "buffered": 0, "late": 0,
+                              "duplicates": 0, "max_buffered": 50}
+
+
+def test_random_arrival_order_matches_sorted_frames():
+    rng = random.Random(7)
+    frames = [Frame(t, 12) for t in range(1000)]
+    # every frame arrives at most 4 frames after its place
+    arrival = sorted(frames, key=lambda frame: frame.timestamp + rng.uniform(0, 4))
+    window, emitted = make_window(4)
+    for frame in arrival:
+        window.insert(frame)
+    window.flush()
+    assert [pmu for _, pmu in emitted] == frames
+    assert window.stats()["late"] == 0
+
+
+def test_sorted_list_flush_up_to_a_key():
+    sorted_list = KeySortedList(chunk_size=2)
+    for i in range(20):
+        sorted_list.insert(i)
+    flushed = []
+    assert sorted_list.flush(flushed.append, 6) == 7
+    assert flushed == list(range(7))
+    assert list(sorted_list) == list(range(7, 20))
+    # nothing at or below the key is left
+    assert sorted_list.flush(flushed.append, 6) == 0
+    assert sorted_list.flush() == 13
+    assert len(sorted_list) == 0
+    assert sorted_list.insert(3)
+    assert list(sorted_list) == [3]
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from sorted_list import KeySortedList
+
+
+def check_invariants(sorted_list):
+    items = list(sorted_list)
+    assert len(items) == len(sorted_list)
+    assert items == sorted(items)
+    assert sorted_list._maxes == [keys[-1] for keys in sorted_list._key_chunks]
+    assert all(0 < len(keys) <= 2 * sorted_list._chunk_size for keys in sorted_list._key_chunks)
+
+
+def test_in_order_inserts_append():
+    sorted_list = KeySortedList(chunk_size=4)
+    for i in range(100):
+        assert sorted_list.insert(i)
+    assert list(sorted_list) == list(range(100))
+    check_invariants(sorted_list)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 512])
+def test_random_inserts_match_sorted_set(chunk_size):
+    rng = random.Random(chunk_size)
+    values = [rng.randrange(1000) for _ in range(2000)]
+    sorted_list = KeySortedList(chunk_size=chunk_size)
+    for value in values:
+        sorted_list.insert(value)
+        check_invariants(sorted_list)
+    assert list(sorted_list) == sorted(set(values))
+
+
+def test_chunks_split_at_twice_the_chunk_size():
+    sorted_list = KeySortedList(chunk_size=4)
+    for i in range(8):
+        sorted_list.insert(i)
+    assert len(sorted_list._key_chunks) == 1
+    sorted_list.insert(8)
+    assert [len(keys) for keys in sorted_list._key_chunks] == [4, 5]
+    check_invariants(sorted_list)
+
+
+def test_duplicates_are_rejected():
+    sorted_list = KeySortedList(chunk_size=2)
+    for value in [5, 1, 9, 3, 7]:
+        assert sorted_list.insert(value)
+    # duplicate of the newest item, of one inside a chunk and of a chunk's last key
+    assert not sorted_list.insert(9)
+    assert not sorted_list.insert(3)
+    assert not sorted_list.insert(sorted_list._maxes[0])
+    assert list(sorted_list) == [1, 3, 5, 7, 9]
+
+
+def test_keyfunc_orders_and_deduplicates_by_key():
+    sorted_list = KeySortedList(keyfunc=lambda item: item[0])
+    assert sorted_list.insert((2, "b"))
+    assert sorted_list.insert((1, "a"))
+    assert not sorted_list.insert((2, "other"))
+    assert list(sorted_list) == [(1, "a"), (2, "b")]
+
+
+@pytest.mark.parametrize("n", [-1, 0, 1, 5, 10, 11, 50])
+def test_last_n_matches_list_slice(n):
+    sorted_list = KeySortedList(chunk_size=2)
+    for i in range(10):
+        sorted_list.insert(i)
+    assert sorted_list.get_last_n(n) == list(range(10))[-n:]
+    assert sorted_list.retrieve_last_n(n) == list(range(10))[-n:]
+
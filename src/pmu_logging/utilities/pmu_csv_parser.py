@@ -1,10 +1,146 @@
+import json
+import os
+
+import numpy as np
 import pandas as pd
 
-def parse_csv_data(file_path, time_header_name, magnitude_header_names, angle_header_names):
-    data = pd.read_csv(file_path)
-    times = data[time_header_name].values
-    magnitudes = list(map(
-        lambda magnitude_header: data[magnitude_header].values, magnitude_header_names))
-    phase_angles = list(
-        map(lambda angle_header: data[angle_header].values, angle_header_names))
-    return {"times": times, "magnitudes": magnitudes, "phase_angles": phase_angles}
+'''
+Streaming reader for PMU csv exports. Only the TimeTag column and the requested magnitude and
+angle columns are parsed, with fixed dtypes, chunk_size rows at a time, and every chunk is
+yielded as a (times, magnitudes, angles) block:
+- times: datetime64[ns] array of the chunk's TimeTags
+- magnitudes / angles: (len(header_names), rows) float64 arrays
+With a cache_path the parsed columns are also written to a binary copy next to the export
+(fixed size records behind a small json header keyed on the export's path, size and mtime),
+later reads memory map that copy instead of parsing the csv again.
+'''
+
+CACHE_MAGIC = b"PMUCSV01"
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def _parse_times(times):
+    try:
+        parsed = pd.to_datetime(times)
+    except ValueError:
+        # pandas >= 2 infers one format from the first value, exports mix in whole seconds without a fraction
+        parsed = pd.to_datetime(times, format="mixed")
+    return parsed.values.astype("datetime64[ns]")
+
+
+def _cache_key(file_path, time_header_name, magnitude_header_names, angle_header_names):
+    stat = os.stat(file_path)
+    return {
+        "source": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "time": time_header_name,
+        "magnitudes": list(magnitude_header_names),
+        "angles": list(angle_header_names),
+    }
+
+
+def _record_dtype(num_magnitudes, num_angles):
+    return np.dtype([("time", "<i8"), ("magnitudes", "<f8", (num_magnitudes,)), ("angles", "<f8", (num_angles,))])
+
+
+def _cache_header(key):
+    header = json.dumps(key, sort_keys=True).encode()
+    header += b" " * (-(len(CACHE_MAGIC) + 4 + len(header)) % 8)
+    return CACHE_MAGIC + len(header).to_bytes(4, "little") + header
+
+
+# the cached records as a memory mapped structured array, None if the cache is missing or stale
+def _open_cache(cache_path, key, dtype):
+    try:
+        with open(cache_path, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            header_size = int.from_bytes(f.read(4), "little")
+            if json.loads(f.read(header_size).decode()) != key:
+                return None
+            offset = f.tell()
+            f.seek(0, 2)
+            num_records = (f.tell() - offset) // dtype.itemsize
+    except (OSError, ValueError):
+        return None
+    if not num_records:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(cache_path, dtype=dtype, mode="r", offset=offset, shape=(num_records,))
+
+
+def _cached_blocks(records, chunk_size, max_rows):
+    end = len(records) if max_rows is None else min(max_rows, len(records))
+    for start in range(0, end, chunk_size):
+        block = records[start:min(start + chunk_size, end)]
+        yield block["time"].view("datetime64[ns]"), block["magnitudes"].T, block["angles"].T
+
+
+def iter_csv_blocks(file_path, time_header_name, magnitude_header_names, angle_header_names,
+                    chunk_size=DEFAULT_CHUNK_SIZE, cache_path=None, max_rows=None):
+    dtype = _record_dtype(len(magnitude_header_names), len(angle_header_names))
+    key = None
+    if cache_path:
+        key = _cache_key(file_path, time_header_name, magnitude_header_names, angle_header_names)
+        records = _open_cache(cache_path, key, dtype)
+        if records is not None:
+            yield from _cached_blocks(records, chunk_size, max_rows)
+            return
+
+    value_columns = list(magnitude_header_names) + list(angle_header_names)
+    columns = [time_header_name] + value_columns
+    column_dtypes = dict.fromkeys(value_columns, np.float64)
+    column_dtypes[time_header_name] = str
+    # a cache always holds the whole export, so the first read with a cache_path parses every row
+    # and later reads of any length are served from the cache
+    reader = pd.read_csv(file_path, usecols=list(dict.fromkeys(columns)), dtype=column_dtypes,
+                         chunksize=chunk_size, nrows=None if cache_path else max_rows)
+
+    cache_file = None
+    tmp_path = None
+    if cache_path:
+        tmp_path = cache_path + ".tmp"
+        cache_file = open(tmp_path, "wb")
+        cache_file.write(_cache_header(key))
+    remaining = float("inf") if max_rows is None else max_rows
+    try:
+        for chunk in reader:
+            times = _parse_times(chunk[time_header_name])
+            magnitudes = chunk[list(magnitude_header_names)].to_numpy(dtype=np.float64).T
+            angles = chunk[list(angle_header_names)].to_numpy(dtype=np.float64).T
+            if cache_file is not None:
+                records = np.empty(len(times), dtype=dtype)
+                records["time"] = times.view("int64")
+                records["magnitudes"] = magnitudes.T
+                records["angles"] = angles.T
+                cache_file.write(records.tobytes())
+            if remaining > 0:
+                rows = int(min(remaining, len(times)))
+                remaining -= rows
+                yield times[:rows], magnitudes[:, :rows], angles[:, :rows]
+        if cache_file is not None:
+            cache_file.close()
+            os.replace(tmp_path, cache_path)
+            cache_file = None
+    finally:
+        reader.close()
+        if cache_file is not None:
+            # the read was abandoned or failed half way, don't leave a truncated cache behind
+            cache_file.close()
+            os.remove(tmp_path)
+
+
+# reads the whole export (or its first max_rows rows) through iter_csv_blocks
+def parse_csv_data(file_path, time_header_name, magnitude_header_names, angle_header_names,
+                   chunk_size=DEFAULT_CHUNK_SIZE, cache_path=None, max_rows=None):
+    blocks = list(iter_csv_blocks(file_path, time_header_name, magnitude_header_names, angle_header_names,
+                                  chunk_size, cache_path, max_rows))
+    if blocks:
+        times = np.concatenate([block[0] for block in blocks])
+        magnitudes = np.concatenate([block[1] for block in blocks], axis=1)
+        angles = np.concatenate([block[2] for block in blocks], axis=1)
+    else:
+        times = np.zeros(0, dtype="datetime64[ns]")
+        magnitudes = np.zeros((len(magnitude_header_names), 0))
+        angles = np.zeros((len(angle_header_names), 0))
+    return {"times": times, "magnitudes": list(magnitudes), "phase_angles": list(angles)}
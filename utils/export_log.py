@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import socket
+import struct
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pmu_lib.binary_log import export_log, export_records, open_log, EXPORTERS, EPOCH_UNITS, FORMAT_IPV4
+from pmu_lib.segment_log import query_segments, segment_log_header
+
+def parse_console_args(parser):
+    parser.add_argument('log', help='Binary log written by receive.py or the pmu_logging controller, or a directory of log segments')
+    parser.add_argument('output', nargs='?', help='Exported file, defaults to the log name with the format extension')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default=None, help='Export format, picked from the output extension by default (csv unless .parquet/.pq)')
+    parser.add_argument('--chunk_records', type=int, default=65536, help='Records converted at a time')
+    parser.add_argument('--schema', action='store_true', help='Only print the record layout of the log')
+    parser.add_argument('--time_field', default='timestamp_us', help='Time field of the segments')
+    parser.add_argument('--start', default=None, help='Only records at or after this time, UTC (2014-01-28T23:00:13) or epoch seconds (segments only)')
+    parser.add_argument('--end', default=None, help='Only records before this time (segments only)')
+    parser.add_argument('--where', nargs='*', default=[], help='Only records with field=value, e.g. src_addr=10.0.1.1 (segments only)')
+
+    return parser.parse_args()
+
+#a --start/--end argument in the units of the time field
+def parse_time(value, fmt):
+    if value is None:
+        return None
+    try:
+        seconds = np.datetime64(int(float(value) * 1000000), 'us')
+    except ValueError:
+        seconds = np.datetime64(value, 'us')
+    return int(seconds.astype('datetime64[%s]' % EPOCH_UNITS.get(fmt, 's')).astype(np.int64))
+
+def parse_where(conditions, formats):
+    where = {}
+    for condition in conditions:
+        name, _, value = condition.partition('=')
+        if formats.get(name) == FORMAT_IPV4:
+            where[name] = struct.unpack(">I", socket.inet_aton(value))[0]
+        else:
+            where[name] = float(value) if '.' in value else int(value)
+    return where
+
+def print_schema(header):
+    print("compression: %s" % header["compression"])
+    for name, base, shape in header["fields"]:
+        print("%s: %s%s%s" % (name, base, str(tuple(shape)) if shape else "",
+                              " (%s)" % header["formats"][name] if name in header["formats"] else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                        prog='export-log',
+                        description='Exports a binary PMU log, or a time range of a segmented log, to csv or parquet')
+    args = parse_console_args(parser)
+
+    segments = os.path.isdir(args.log)
+    if segments:
+        header = segment_log_header(args.log)
+        if header is None:
+            sys.exit("%s holds no log segments" % args.log)
+    else:
+        f, header = open_log(args.log)
+        f.close()
+
+    if args.schema:
+        print_schema(header)
+        sys.exit(0)
+
+    output = args.output or os.path.splitext(args.log.rstrip(os.sep))[0] + "." + (args.format or "csv")
+    try:
+        if segments:
+            records = query_segments(args.log, args.time_field,
+                                     parse_time(args.start, header["formats"].get(args.time_field)),
+                                     parse_time(args.end, header["formats"].get(args.time_field)),
+                                     parse_where(args.where, header["formats"]))
+            count = export_records(records, header["dtype"], header["formats"], output, args.format)
+        else:
+            count = export_log(args.log, output, args.format, args.chunk_records)
+    except (RuntimeError, ValueError) as e:
+        sys.exit(str(e))
+    print("Exported %d records to %s" % (count, output))
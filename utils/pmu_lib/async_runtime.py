@@ -0,0 +1,177 @@
+import asyncio
+import errno
+import signal
+import socket
+
+from .batch_receiver import BatchReceiver
+
+'''
+asyncio runtime shared by the receiver and the controllers, one event loop instead of a
+producer thread plus queue per source:
+- open_pmu_endpoint watches a UDP socket and, whenever it is readable, drains it with a
+  BatchReceiver and hands each datagram to a callback (PmuDatagramEndpoint), any number of
+  ports can be served by one loop
+- AsyncNanomsgSocket waits on the nanomsg socket's RCVFD instead of blocking in recv()
+- every() runs a callback periodically (log flushing, stats) between the packet callbacks
+- SIGINT/SIGTERM stop the loop gracefully: running tasks are cancelled and the registered
+  cleanups (closing logs, writing results) run in reverse order before run() returns
+'''
+
+SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+class PmuDatagramEndpoint(object):
+    # handler(data) is called with a memoryview of every datagram, valid during the call only
+    def __init__(self, sock, handler, loop, **receiver_options):
+        self.sock = sock
+        self.handler = handler
+        self.loop = loop
+        self.receiver = BatchReceiver(sock, **receiver_options)
+        self.errors = 0
+        loop.add_reader(sock.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        try:
+            batch = self.receiver.receive_batch(wait=False)
+        except OSError:
+            self.errors += 1
+            return
+        if batch is None:
+            return
+        try:
+            for data in batch:
+                self.handler(data)
+        finally:
+            self.receiver.release(batch)
+
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+
+class AsyncNanomsgSocket(object):
+    # sub is a connected nnpy socket, its RCVFD is watched by the loop
+    def __init__(self, sub, loop):
+        import nnpy
+        self._nnpy = nnpy
+        self.sub = sub
+        self.loop = loop
+        self._fd = sub.getsockopt(nnpy.SOL_SOCKET, nnpy.RCVFD)
+        self._readable = asyncio.Event()
+        loop.add_reader(self._fd, self._readable.set)
+
+    def _try_recv(self):
+        try:
+            return self.sub.recv(flags=self._nnpy.DONTWAIT)
+        except self._nnpy.errors.NNError as e:
+            if e.error_no != errno.EAGAIN:
+                raise
+            return None
+
+    async def recv(self):
+        while True:
+            msg = self._try_recv()
+            if msg is not None:
+                return msg
+            self._readable.clear()
+            await self._readable.wait()
+
+    # every message that is already queued, waits for the first one
+    async def recv_batch(self, max_items=256):
+        batch = [await self.recv()]
+        while len(batch) < max_items:
+            msg = self._try_recv()
+            if msg is None:
+                break
+            batch.append(msg)
+        return batch
+
+    def close(self):
+        self.loop.remove_reader(self._fd)
+
+
+class AsyncRuntime(object):
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._stopping = asyncio.Event()
+        self._tasks = []
+        self._cleanups = []
+        self.stop_reason = None
+
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.append(task)
+        return task
+
+    # calls callback() every interval seconds until shutdown
+    def every(self, interval, callback):
+        async def periodic():
+            while True:
+                await asyncio.sleep(interval)
+                callback()
+        return self.spawn(periodic())
+
+    # cleanups run once the loop stops, last registered first
+    def add_cleanup(self, callback):
+        self._cleanups.append(callback)
+
+    # serves an already bound sock, or binds a new one to local_addr. receiver_options go to BatchReceiver
+    def open_pmu_endpoint(self, handler, local_addr=None, sock=None, **receiver_options):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(local_addr)
+        endpoint = PmuDatagramEndpoint(sock, handler, self.loop, **receiver_options)
+        self.add_cleanup(endpoint.close)
+        return endpoint
+
+    def nanomsg_socket(self, sub):
+        nn_socket = AsyncNanomsgSocket(sub, self.loop)
+        self.add_cleanup(nn_socket.close)
+        return nn_socket
+
+    def stop(self, reason="stopped"):
+        if self.stop_reason is None:
+            self.stop_reason = reason
+        self._stopping.set()
+
+    def _run_cleanups(self):
+        while self._cleanups:
+            self._cleanups.pop()()
+
+    # runs until stop() is called or a shutdown signal arrives, then cleans up. A task that
+    # raises stops the runtime too, the exception is re-raised after the cleanups
+    def run(self):
+        for signum in SHUTDOWN_SIGNALS:
+            self.loop.add_signal_handler(signum, self.stop, signal.Signals(signum).name)
+
+        async def wait_for_stop():
+            stop_waiter = asyncio.ensure_future(self._stopping.wait())
+            pending = set(self._tasks) | {stop_waiter}
+            while not self._stopping.is_set():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not stop_waiter and not task.cancelled() and task.exception() is not None:
+                        self.stop("error")
+                        return task.exception()
+                # tasks spawned while running
+                pending |= {task for task in self._tasks if not task.done()}
+            return None
+
+        async def cancel_tasks():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        try:
+            error = self.loop.run_until_complete(wait_for_stop())
+        finally:
+            self.loop.run_until_complete(cancel_tasks())
+            try:
+                self._run_cleanups()
+            finally:
+                for signum in SHUTDOWN_SIGNALS:
+                    self.loop.remove_signal_handler(signum)
+                self.loop.close()
+        if error is not None:
+            raise error
+        return self.stop_reason
@@ -0,0 +1,150 @@
+import queue
+import select
+import socket
+import struct
+
+'''
+Batched UDP receive. Every wakeup drains as many datagrams as are queued on the socket (up to
+batch_size) into one preallocated buffer, so the receiving thread hands the processing stage
+whole batches instead of one queue hop per datagram. Batch buffers come from a fixed pool and
+go back to it with release(), nothing is allocated per datagram; when the consumer holds every
+buffer the receiver waits for one, and the kernel socket buffer absorbs the burst.
+Python has no recvmmsg, so a batch is one blocking recv for the first datagram plus
+MSG_DONTWAIT recvs for the rest. With track_drops the socket has SO_RXQ_OVFL enabled and the
+kernel's count of datagrams dropped because the socket buffer was full is read from the
+ancillary data, so loss on the host can be told apart from loss in the network.
+'''
+
+# Linux value, older Pythons do not export the constant
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+_DROP_COUNTER = struct.Struct("I")
+
+
+class DatagramBatch(object):
+    __slots__ = ("buffer", "view", "slot_size", "lengths", "count")
+
+    def __init__(self, batch_size, slot_size):
+        self.buffer = bytearray(batch_size * slot_size)
+        self.view = memoryview(self.buffer)
+        self.slot_size = slot_size
+        self.lengths = [0] * batch_size
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # keeps only the first count datagrams, the rest are not handed out
+    def truncate(self, count):
+        self.count = max(0, min(self.count, count))
+
+    # memoryviews of the datagrams, only valid until the batch is released
+    def __iter__(self):
+        view = self.view
+        slot_size = self.slot_size
+        lengths = self.lengths
+        for i in range(self.count):
+            start = i * slot_size
+            yield view[start:start + lengths[i]]
+
+
+class BatchReceiver(object):
+    # max_datagram bytes are reserved per datagram, longer datagrams are truncated and counted.
+    # timeout (seconds) bounds the wait for the first datagram of a batch, None waits forever
+    def __init__(self, sock, batch_size=64, max_datagram=1500, num_buffers=4, timeout=None, track_drops=True):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.max_datagram = max_datagram
+        self.timeout = timeout
+        # the socket stays in blocking mode, with a timeout CPython would poll before every
+        # recv and MSG_DONTWAIT could then still wait
+        sock.setblocking(True)
+
+        self._free = queue.Queue()
+        for _ in range(num_buffers):
+            self._free.put(DatagramBatch(batch_size, max_datagram))
+
+        self._ancbufsize = 0
+        if track_drops:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._ancbufsize = socket.CMSG_SPACE(_DROP_COUNTER.size)
+            except (OSError, AttributeError):
+                pass
+
+        self.datagrams = 0
+        self.batches = 0
+        self.truncated = 0
+        self.kernel_drops = 0
+        self.pool_waits = 0
+
+    @property
+    def tracks_drops(self):
+        return self._ancbufsize > 0
+
+    def _recv_into(self, view, flags):
+        if not self._ancbufsize:
+            return self.sock.recv_into(view, self.max_datagram, flags)
+        nbytes, ancdata, msg_flags, _ = self.sock.recvmsg_into([view], self._ancbufsize, flags)
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= _DROP_COUNTER.size:
+                # cumulative since the socket was created, as of when this datagram was queued
+                self.kernel_drops = _DROP_COUNTER.unpack_from(data)[0]
+        if msg_flags & socket.MSG_TRUNC:
+            self.truncated += 1
+        return nbytes
+
+    # blocks until at least one datagram arrived, then takes whatever else is already queued.
+    # Returns None if the timeout passed without a datagram, or with wait=False (the caller
+    # already knows the socket is readable) if nothing was queued after all
+    def receive_batch(self, wait=True):
+        try:
+            batch = self._free.get_nowait()
+        except queue.Empty:
+            self.pool_waits += 1
+            batch = self._free.get()
+
+        view = batch.view
+        lengths = batch.lengths
+        slot_size = batch.slot_size
+        if wait and self.timeout is not None and not select.select([self.sock], [], [], self.timeout)[0]:
+            self._free.put(batch)
+            return None
+        try:
+            lengths[0] = self._recv_into(view[0:slot_size], 0 if wait else socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            self._free.put(batch)
+            return None
+        count = 1
+        while count < self.batch_size:
+            start = count * slot_size
+            try:
+                lengths[count] = self._recv_into(view[start:start + slot_size], socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            count += 1
+
+        batch.count = count
+        self.datagrams += count
+        self.batches += 1
+        return batch
+
+    # hands a processed batch's buffer back to the pool
+    def release(self, batch):
+        batch.count = 0
+        self._free.put(batch)
+
+    def stats(self):
+        return {
+            "datagrams": self.datagrams,
+            "batches": self.batches,
+            "mean_batch": self.datagrams / self.batches if self.batches else 0.0,
+            "truncated": self.truncated,
+            "kernel_drops": self.kernel_drops if self.tracks_drops else None,
+            "pool_waits": self.pool_waits,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        kernel_drops = "n/a" if stats["kernel_drops"] is None else str(stats["kernel_drops"])
+        print("Datagrams received: %d in %d batches (mean %.1f) | truncated: %d | socket buffer drops: %s | pool waits: %d" % (
+            stats["datagrams"], stats["batches"], stats["mean_batch"], stats["truncated"], kernel_drops, stats["pool_waits"]))
@@ -0,0 +1,258 @@
+import csv
+import json
+import os
+import socket
+import struct
+import zlib
+
+import numpy as np
+
+from .log_sink import LogSink
+
+'''
+Append-only binary log of fixed size records, the alternative to the csv sinks when nothing
+on the hot path should format text. A file is
+- the magic, a uint32 header length and a JSON header: the numpy dtype of the records, the
+  compression and how fields are presented on export (formats), padded to 8 bytes
+- then the records: back to back little endian records for compression "none", so a reader
+  can map the file and view it as a structured array, or one block per written batch for
+  "zlib", each block a (record count, compressed length) uint32 pair and the compressed records
+A torn last record or block (the writer was killed) is ignored by the readers.
+export_log turns a log into csv, or parquet if pyarrow is installed, in chunks (epoch times as UTC).
+'''
+
+BINARY_LOG_MAGIC = b"PMUBLOG1"
+HEADER_LENGTH = struct.Struct("<I")
+BLOCK_HEADER = struct.Struct("<II")
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_ZLIB)
+
+# field formats applied on export, fields without one are written as numbers
+FORMAT_IPV4 = "ipv4"
+FORMAT_EPOCH_US = "epoch_us"
+FORMAT_EPOCH_NS = "epoch_ns"
+EPOCH_UNITS = {FORMAT_EPOCH_US: "us", FORMAT_EPOCH_NS: "ns"}
+
+
+def _dtype_to_json(dtype):
+    return [[name, dtype.fields[name][0].base.str, list(dtype.fields[name][0].shape)] for name in dtype.names]
+
+
+def _dtype_from_json(fields):
+    return np.dtype([(name, base, tuple(shape)) if shape else (name, base) for name, base, shape in fields])
+
+
+def _encode_header(dtype, compression, formats):
+    header = json.dumps({"fields": _dtype_to_json(dtype), "compression": compression, "formats": formats or {}}).encode()
+    # records start 8 byte aligned
+    header += b" " * (-(len(BINARY_LOG_MAGIC) + HEADER_LENGTH.size + len(header)) % 8)
+    return BINARY_LOG_MAGIC + HEADER_LENGTH.pack(len(header)) + header
+
+
+# returns the header dict with "dtype" (numpy dtype) and "offset" (where the records start) added,
+# raises ValueError if the file is not a binary log
+def read_log_header(f):
+    magic = f.read(len(BINARY_LOG_MAGIC))
+    if magic != BINARY_LOG_MAGIC:
+        raise ValueError("%s is not a binary log" % getattr(f, "name", f))
+    length, = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+    header = json.loads(f.read(length))
+    header["dtype"] = _dtype_from_json(header["fields"])
+    header["offset"] = len(BINARY_LOG_MAGIC) + HEADER_LENGTH.size + length
+    return header
+
+
+# end of the last whole record (or block) of the log
+def _valid_end(f, header):
+    size = os.fstat(f.fileno()).st_size
+    offset = header["offset"]
+    if header["compression"] == COMPRESSION_NONE:
+        return offset + (size - offset) // header["dtype"].itemsize * header["dtype"].itemsize
+    f.seek(offset)
+    while offset + BLOCK_HEADER.size <= size:
+        count, length = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+        if offset + BLOCK_HEADER.size + length > size:
+            break
+        offset += BLOCK_HEADER.size + length
+        f.seek(offset)
+    return offset
+
+
+# records are tuples in dtype's field order, written in batches (LogSink settings) and, with zlib,
+# compressed one batch per block. Appending to an existing log requires the same dtype and compression
+class BinaryLogSink(LogSink):
+    def __init__(self, filename, dtype, formats=None, compression=COMPRESSION_NONE, compression_level=6, **kwargs):
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression %r, expected one of %r" % (compression, COMPRESSIONS))
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.formats = formats or {}
+        self.compression = compression
+        self.compression_level = compression_level
+        LogSink.__init__(self, filename, **kwargs)
+
+    def _open(self, filename, mode, buffering):
+        f = open(filename, mode + 'b', buffering=buffering)
+        if f.tell() == 0:
+            f.write(_encode_header(self.dtype, self.compression, self.formats))
+            return f
+        with open(filename, 'rb') as existing:
+            header = read_log_header(existing)
+            end = _valid_end(existing, header)
+        if header["dtype"] != self.dtype or header["compression"] != self.compression:
+            f.close()
+            raise ValueError("%s was written with a different record layout or compression" % filename)
+        # drop a torn record/block so appended records stay aligned
+        if end < f.tell():
+            f.truncate(end)
+        return f
+
+    def _write_batch(self, records):
+        self._write_array(np.array(records, dtype=self.dtype))
+
+    def _write_array(self, array):
+        data = array.tobytes()
+        if self.compression == COMPRESSION_ZLIB:
+            data = zlib.compress(data, self.compression_level)
+            self._file.write(BLOCK_HEADER.pack(len(array), len(data)))
+        self._file.write(data)
+
+    # writes a structured array of records as one batch, after anything still pending
+    def write_array(self, array):
+        self.flush()
+        if len(array):
+            self._write_array(np.asarray(array, dtype=self.dtype))
+            self.records_written += len(array)
+            self.batches_written += 1
+
+
+def open_log(filename):
+    f = open(filename, 'rb')
+    try:
+        header = read_log_header(f)
+    except Exception:
+        f.close()
+        raise
+    return f, header
+
+
+# yields the records as structured arrays of at most chunk_records records (or one per block for
+# compressed logs), uncompressed logs are views of a memory map
+def read_binary_log(filename, chunk_records=65536):
+    f, header = open_log(filename)
+    with f:
+        dtype = header["dtype"]
+        if header["compression"] == COMPRESSION_NONE:
+            records = load_binary_log(filename)
+            for start in range(0, len(records), chunk_records):
+                yield records[start:start + chunk_records]
+            return
+        f.seek(header["offset"])
+        while True:
+            block_header = f.read(BLOCK_HEADER.size)
+            if len(block_header) < BLOCK_HEADER.size:
+                return
+            count, length = BLOCK_HEADER.unpack(block_header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield np.frombuffer(zlib.decompress(data), dtype=dtype, count=count)
+
+
+# the count records of the batch (a block for compressed logs) written at byte offset of the log file f
+def read_batch(f, header, offset, count):
+    f.seek(offset)
+    if header["compression"] == COMPRESSION_NONE:
+        return np.frombuffer(f.read(count * header["dtype"].itemsize), dtype=header["dtype"], count=count)
+    count, length = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+    return np.frombuffer(zlib.decompress(f.read(length)), dtype=header["dtype"], count=count)
+
+
+# every record of the log: a read only memory map for uncompressed logs, compressed logs are read
+# into memory
+def load_binary_log(filename):
+    f, header = open_log(filename)
+    with f:
+        dtype = header["dtype"]
+        if header["compression"] != COMPRESSION_NONE:
+            return np.concatenate(list(read_binary_log(filename)) or [np.empty(0, dtype=dtype)])
+        count = (os.fstat(f.fileno()).st_size - header["offset"]) // dtype.itemsize
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', offset=header["offset"], shape=(count,))
+
+
+# export column names and the matching 1-d arrays of a chunk, sub array fields become name_0, name_1...
+def export_columns(records, formats):
+    columns = []
+    for name in records.dtype.names:
+        values = records[name]
+        if values.ndim > 1:
+            flat = values.reshape(len(values), int(np.prod(values.shape[1:])))
+            columns.extend(("%s_%d" % (name, i), flat[:, i]) for i in range(flat.shape[1]))
+            continue
+        fmt = formats.get(name)
+        if fmt == FORMAT_IPV4:
+            values = np.array([socket.inet_ntoa(struct.pack(">I", v)) for v in values.tolist()], dtype=object)
+        elif fmt in EPOCH_UNITS:
+            values = values.astype(np.int64).astype("datetime64[%s]" % EPOCH_UNITS[fmt])
+        columns.append((name, values))
+    return columns
+
+
+# records is an iterable of structured arrays of dtype, returns the number of records written
+def write_csv(records, dtype, formats, output):
+    count = 0
+    with open(output, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow([name for name, _ in export_columns(np.empty(0, dtype=dtype), formats)])
+        for chunk in records:
+            columns = [np.datetime_as_string(values) if values.dtype.kind == "M" else values
+                       for _, values in export_columns(chunk, formats)]
+            writer.writerows(zip(*(values.tolist() for values in columns)))
+            count += len(chunk)
+    return count
+
+
+def write_parquet(records, dtype, formats, output):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    writer = None
+    count = 0
+    try:
+        for chunk in records:
+            table = pyarrow.table(dict(export_columns(chunk, formats)))
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(output, table.schema)
+            writer.write_table(table)
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+EXPORTERS = {"csv": write_csv, "parquet": write_parquet}
+
+
+# format from the output extension: .parquet/.pq is parquet, anything else csv
+def export_format(output, fmt=None):
+    if fmt is None:
+        fmt = "parquet" if os.path.splitext(output)[1] in (".parquet", ".pq") else "csv"
+    if fmt not in EXPORTERS:
+        raise ValueError("Unknown export format %r, expected one of %r" % (fmt, sorted(EXPORTERS)))
+    return fmt
+
+
+def export_records(records, dtype, formats, output, fmt=None):
+    return EXPORTERS[export_format(output, fmt)](records, dtype, formats, output)
+
+
+def export_log(filename, output, fmt=None, chunk_records=65536):
+    f, header = open_log(filename)
+    f.close()
+    return export_records(read_binary_log(filename, chunk_records), header["dtype"], header["formats"], output, fmt)
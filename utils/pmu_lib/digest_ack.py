@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import deque
+
+from .digest_decoder import DIGEST_HEADER
+
+'''
+Acknowledges bmv2 learn buffers back to the switch. bmv2 stops sending digests for a
+learn list once too many of its buffers are left unacked, so every digest that comes
+off the notification socket (including the ones the ingest ring ends up dropping) is
+acked with bm_learning_ack_buffer.
+ack() only parses the header and appends to a deque, the Thrift calls happen on the
+acker's own thread so they never sit on the receive or decode path.
+'''
+
+
+class DigestAcker(object):
+    def __init__(self, client, flush_interval=0.005, latency_samples=4096):
+        self.client = client
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._ack_loop)
+        self._thread.daemon = True
+
+        self.acked = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.last_error = None
+        # most recent receive -> ack latencies in ns
+        self._latencies = deque(maxlen=latency_samples)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    # called with the raw digest as soon as it is received
+    def ack(self, msg):
+        _, _, ctx_id, list_id, buffer_id, _ = DIGEST_HEADER.unpack_from(msg)
+        self._pending.append((ctx_id, list_id, buffer_id, time.monotonic_ns()))
+        self._wakeup.set()
+
+    def _ack_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # let acks that arrive in a burst pile up and go out together
+            time.sleep(self.flush_interval)
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        batch = {}
+        pending = self._pending
+        while pending:
+            ctx_id, list_id, buffer_id, received_at = pending.popleft()
+            key = (ctx_id, list_id, buffer_id)
+            if key in batch:
+                # a buffer only needs to be acked once
+                self.coalesced += 1
+            else:
+                batch[key] = received_at
+
+        for (ctx_id, list_id, buffer_id), received_at in batch.items():
+            try:
+                self.client.bm_learning_ack_buffer(ctx_id, list_id, buffer_id)
+            except Exception as e:
+                self.failed += 1
+                self.last_error = e
+                continue
+            self.acked += 1
+            self._latencies.append(time.monotonic_ns() - received_at)
+
+    # acks whatever is still pending and stops the ack thread
+    def stop(self, timeout=1.0):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        else:
+            self._flush()
+
+    def latency_percentiles(self, percentiles=(50, 99, 100)):
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {}
+        return {p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] for p in percentiles}
+
+    def stats(self):
+        return {
+            "acked": self.acked,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "pending": len(self._pending),
+            "latency_ns": self.latency_percentiles(),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        latency = " | ".join("p%d: %.3f ms" % (p, ns / 1e6) for p, ns in stats["latency_ns"].items())
+        print("Digests acked: %d | failed: %d | coalesced: %d | pending: %d | ack latency %s" % (
+            stats["acked"], stats["failed"], stats["coalesced"], stats["pending"], latency or "n/a"))
+        if self.last_error is not None:
+            print("Last ack error: " + str(self.last_error))
@@ -0,0 +1,54 @@
+import struct
+from collections import namedtuple
+
+'''
+Decoders for bmv2 learn/digest messages received over the nanomsg notification socket.
+Every digest layout is compiled into a single struct.Struct, and the messages of a digest
+are unpacked straight out of a memoryview with iter_unpack, so decoding a digest never
+copies the remaining buffer and costs one C-level unpack per message.
+'''
+
+# 32 byte nanomsg header in front of every digest:
+# topic, switch_id, cxt_id, list_id, buffer_id, num (number of messages in the digest)
+DIGEST_HEADER = struct.Struct("<iQiiQi")
+DigestHeader = namedtuple("DigestHeader", ["topic", "switch_id", "ctx_id", "list_id", "buffer_id", "num"])
+
+
+class DigestLayout(object):
+    def __init__(self, name, field_names, fmt):
+        self.name = name
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        self.record_type = namedtuple(name, field_names)
+        num_values = len(self.struct.unpack(bytes(self.size)))
+        if len(self.record_type._fields) != num_values:
+            raise ValueError("Layout %r has %d fields but format %r unpacks %d values"
+                             % (name, len(field_names), fmt, num_values))
+
+    # yields one record per message, msg is the full digest including the header
+    def iter_records(self, msg, num, offset=DIGEST_HEADER.size):
+        end = offset + num * self.size
+        if len(msg) < end:
+            raise ValueError("Digest %r truncated: expected %d messages (%d bytes), got %d bytes"
+                             % (self.name, num, end - offset, len(msg) - offset))
+        return map(self.record_type._make, self.struct.iter_unpack(memoryview(msg)[offset:end]))
+
+    # fails fast at startup if the P4 struct no longer has the fields a controller reads
+    def check_fields(self, field_names):
+        missing = [name for name in field_names if name not in self.record_type._fields]
+        if missing:
+            raise ValueError("Digest %r is missing fields %r (has: %r)" % (self.name, missing, self.record_type._fields))
+
+    def __repr__(self):
+        return "DigestLayout(%r, %d bytes)" % (self.name, self.size)
+
+
+def decode_digest_header(msg):
+    return DigestHeader._make(DIGEST_HEADER.unpack_from(msg))
+
+
+# returns the digest header and an iterator over its decoded messages
+def decode_digest(msg, layout):
+    header = decode_digest_header(msg)
+    return header, layout.iter_records(msg, header.num)
+
@@ -0,0 +1,191 @@
+import threading
+from collections import deque
+
+from .digest_ack import DigestAcker
+
+'''
+Continuous ingestion of raw digests from the bmv2 nanomsg notification socket.
+A receiver thread does nothing but sub.recv() into a bounded ring buffer, the digest
+loop takes whole batches out of it. When the ring is full the overflow policy decides
+what happens:
+- drop_newest: the incoming digest is dropped
+- drop_oldest: the oldest buffered digest is dropped to make room
+- block: the receiver thread waits for room (nanomsg then buffers/drops on its side)
+serve_digests is the event loop alternative: no thread and no ring, digests are read on an
+AsyncRuntime as soon as the socket is readable and handled on the loop.
+'''
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+# digests are read on an asyncio event loop, or by a DigestIngestor thread into the ring buffer
+RUNTIME_ASYNCIO = "asyncio"
+RUNTIME_THREADS = "threads"
+RUNTIMES = (RUNTIME_ASYNCIO, RUNTIME_THREADS)
+
+
+class DigestRingBuffer(object):
+    def __init__(self, capacity=4096, policy=DROP_OLDEST):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least 1, got %r" % capacity)
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r, expected one of %r" % (policy, OVERFLOW_POLICIES))
+        self.capacity = capacity
+        self.policy = policy
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self.received = 0
+        self.dropped = 0
+        self.high_water_mark = 0
+
+    # returns False if the item (or, with drop_oldest, an older one) was dropped
+    def put(self, item, timeout=None):
+        with self._lock:
+            self.received += 1
+            accepted = True
+            if len(self._items) >= self.capacity:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    accepted = False
+                elif not self._not_full.wait_for(lambda: len(self._items) < self.capacity, timeout):
+                    self.dropped += 1
+                    return False
+            self._items.append(item)
+            if len(self._items) > self.high_water_mark:
+                self.high_water_mark = len(self._items)
+            self._not_empty.notify()
+            return accepted
+
+    # waits up to timeout seconds for at least one item, then takes up to max_items
+    def get_batch(self, max_items=256, timeout=None):
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                return []
+            n = min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(n)]
+            self._not_full.notify_all()
+            return batch
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "buffered": len(self._items),
+            "high_water_mark": self.high_water_mark,
+            "capacity": self.capacity,
+        }
+
+
+class DigestIngestor(object):
+    def __init__(self, sub, capacity=4096, policy=DROP_OLDEST, batch_size=256, acker=None):
+        self.sub = sub
+        self.acker = acker
+        self.ring = DigestRingBuffer(capacity, policy)
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._receive_loop)
+        self._thread.daemon = True
+
+    def start(self):
+        if self.acker is not None:
+            self.acker.start()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self.acker is not None:
+            self.acker.stop()
+
+    def _receive_loop(self):
+        sub = self.sub
+        put = self.ring.put
+        # acks are queued before the ring so digests it drops still free their switch buffer
+        ack = self.acker.ack if self.acker is not None else None
+        while not self._stopped.is_set():
+            msg = sub.recv()
+            if ack is not None:
+                ack(msg)
+            put(msg)
+
+    # returns the next batch of raw digests, or [] if none arrived within timeout
+    def get_batch(self, timeout=None):
+        return self.ring.get_batch(self.batch_size, timeout)
+
+    def stats(self):
+        return self.ring.stats()
+
+    def print_stats(self):
+        stats = self.stats()
+        print("Digests received: %d | dropped: %d | buffered: %d | high water mark: %d/%d" % (
+            stats["received"], stats["dropped"], stats["buffered"], stats["high_water_mark"], stats["capacity"]))
+        if self.acker is not None:
+            self.acker.print_stats()
+
+
+def add_ingest_arguments(parser):
+    parser.add_argument('--digest_buffer_size', type=int, default=4096, help='Max number of raw digests buffered between the socket and the decoder')
+    parser.add_argument('--digest_overflow', choices=OVERFLOW_POLICIES, default=DROP_OLDEST, help='What to do with digests when the buffer is full')
+    parser.add_argument('--digest_batch_size', type=int, default=256, help='Max number of digests handed to the decoder at once')
+    parser.add_argument('--no_digest_ack', action='store_true', help='Do not acknowledge digest buffers back to the switch')
+    parser.add_argument('--runtime', choices=RUNTIMES, default=RUNTIME_ASYNCIO, help='Read digests on an event loop, or on a thread into the ring buffer')
+    parser.add_argument('--stats_interval', type=float, default=0.0, help='Seconds between digest stats lines (asyncio runtime, 0 = off)')
+
+
+# client is the standard Thrift client (runtime_api.client) used to ack digest buffers
+def acker_from_args(args, client=None):
+    if client is None or args.no_digest_ack:
+        return None
+    return DigestAcker(client)
+
+
+def ingestor_from_args(sub, args, client=None):
+    return DigestIngestor(sub, args.digest_buffer_size, args.digest_overflow, args.digest_batch_size, acker_from_args(args, client))
+
+
+# asyncio counterpart of DigestIngestor: digests are read on the runtime's loop whenever the
+# notification socket is readable, acked, and handed to on_batch(batch) as a list of raw
+# digests. The runtime is stopped once on_batch returns True
+def serve_digests(runtime, sub, args, client, on_batch):
+    acker = acker_from_args(args, client)
+    received = [0]
+
+    def print_stats():
+        print("Digests received: %d" % received[0])
+        if acker is not None:
+            acker.print_stats()
+
+    # cleanups run last registered first: pending acks are flushed before the stats are printed
+    runtime.add_cleanup(print_stats)
+    if acker is not None:
+        acker.start()
+        runtime.add_cleanup(acker.stop)
+    nn_socket = runtime.nanomsg_socket(sub)
+    if args.stats_interval > 0:
+        runtime.every(args.stats_interval, print_stats)
+
+    async def receive_loop():
+        while True:
+            batch = await nn_socket.recv_batch(args.digest_batch_size)
+            received[0] += len(batch)
+            if acker is not None:
+                for msg in batch:
+                    acker.ack(msg)
+            if on_batch(batch):
+                runtime.stop("terminate_after")
+                return
+
+    return runtime.spawn(receive_loop())
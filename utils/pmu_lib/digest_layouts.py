@@ -0,0 +1,100 @@
+import json
+import re
+
+from p4runtime_lib.helper import P4InfoHelper
+
+from .digest_decoder import DigestLayout, decode_digest_header
+
+'''
+Builds digest decoders from the digests section of a build/*.p4info.txt file, so the
+controllers follow whatever struct the P4 program passes to digest() instead of
+hard-coding byte offsets. The p4info is read once at startup, every digest gets a
+precompiled DigestLayout and decoding a digest is one dict lookup on the list_id in
+the nanomsg header.
+'''
+
+# struct members that carry more than a plain unsigned integer, matched on the member
+# name and bitwidth: (pattern, bitwidth, record field names, struct format)
+FIELD_CODECS = [
+    # magnitude ++ phase angle, two 32 bit floats (angle in radians)
+    (re.compile(r"^phasors(\d*)$"), 64, ["magnitude{0}", "angle{0}"], "ff"),
+    # IPv4 addresses stay raw bytes, socket.inet_ntoa turns them into strings
+    (re.compile(r"^srcAddr$"), 32, ["src_addr"], "4s"),
+    (re.compile(r"^dstAddr$"), 32, ["dst_addr"], "4s"),
+]
+
+# bmv2 serializes every field big endian in the smallest whole number of bytes
+UINT_FORMATS = {8: "B", 16: "H", 32: "I", 64: "Q"}
+
+
+def _member_codec(name, bitwidth):
+    for pattern, codec_bitwidth, field_names, fmt in FIELD_CODECS:
+        m = pattern.match(name)
+        if m and bitwidth == codec_bitwidth:
+            return [field.format(*m.groups()) for field in field_names], fmt
+    num_bytes = (bitwidth + 7) // 8
+    if num_bytes * 8 in UINT_FORMATS:
+        return [name], UINT_FORMATS[num_bytes * 8]
+    # odd sized fields are left as raw bytes
+    return [name], "%ds" % num_bytes
+
+
+def layout_from_p4info(p4info_helper, digest):
+    struct_name = digest.type_spec.struct.name
+    if struct_name not in p4info_helper.p4info.type_info.structs:
+        raise AttributeError("Digest %r has no struct %r in type_info" % (digest.preamble.name, struct_name))
+    field_names = []
+    fmt = ">"
+    for member in p4info_helper.p4info.type_info.structs[struct_name].members:
+        if member.type_spec.WhichOneof("type_spec") != "bitstring":
+            raise Exception("Unsupported type for digest member %r of %r" % (member.name, struct_name))
+        bitstring = member.type_spec.bitstring
+        kind = bitstring.WhichOneof("type_spec")
+        member_names, member_fmt = _member_codec(member.name, getattr(bitstring, kind).bitwidth)
+        field_names.extend(member_names)
+        fmt += member_fmt
+    return DigestLayout(digest.preamble.name, field_names, fmt)
+
+
+# bmv2 puts its own learn list id (not the p4info id) in the nanomsg header,
+# these are matched to p4info digests by name through the compiled bmv2 json
+def _learn_list_ids(bmv2_json_path):
+    with open(bmv2_json_path) as f:
+        learn_lists = json.load(f).get("learn_lists", [])
+    return {learn_list["name"]: learn_list["id"] for learn_list in learn_lists}
+
+
+class DigestDecoderTable(object):
+    def __init__(self, p4info_path, bmv2_json_path=None):
+        p4info_helper = P4InfoHelper(p4info_path)
+        learn_list_ids = _learn_list_ids(bmv2_json_path) if bmv2_json_path else {}
+
+        self.by_list_id = {}
+        self.by_digest_id = {}
+        # p4c numbers learn lists from 1 in the same order as the p4info digests
+        for i, digest in enumerate(p4info_helper.p4info.digests):
+            layout = layout_from_p4info(p4info_helper, digest)
+            list_id = learn_list_ids.get(digest.preamble.name, i + 1)
+            self.by_list_id[list_id] = layout
+            self.by_digest_id[digest.preamble.id] = layout
+
+    def get(self, list_id):
+        try:
+            return self.by_list_id[list_id]
+        except KeyError:
+            raise KeyError("No digest layout for list_id %r (known: %r)" % (list_id, sorted(self.by_list_id)))
+
+    def get_by_name(self, name):
+        for layout in self.by_list_id.values():
+            if layout.name == name:
+                return layout
+        raise KeyError("No digest layout named %r" % name)
+
+    # returns the digest header, its layout and an iterator over its decoded messages
+    def decode(self, msg):
+        header = decode_digest_header(msg)
+        layout = self.get(header.list_id)
+        return header, layout, layout.iter_records(msg, header.num)
+
+    def __repr__(self):
+        return "DigestDecoderTable(%r)" % self.by_list_id
@@ -0,0 +1,129 @@
+import json
+
+import numpy as np
+
+'''
+Which frames of a replay get dropped. Drops are kept in a packed bitmap (one bit per
+frame), so membership checks are O(1) and millions of frames cost a few hundred KB.
+Besides hand written index lists (missing-data.json) drop patterns can be generated:
+- uniform: every frame is lost independently with the same probability
+- gilbert: Gilbert-Elliott bursty loss, a two state (good/bad) Markov chain
+- periodic: an outage of a fixed number of frames every period frames
+'''
+
+
+class DropSet(object):
+    def __init__(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        self.num_frames = len(mask)
+        self.count = int(mask.sum())
+        self._bits = np.packbits(mask).tobytes()
+
+    @classmethod
+    def from_indexes(cls, indexes, num_frames):
+        mask = np.zeros(num_frames, dtype=bool)
+        indexes = np.asarray(list(indexes), dtype=np.int64)
+        mask[indexes[(indexes >= 0) & (indexes < num_frames)]] = True
+        return cls(mask)
+
+    def __contains__(self, i):
+        return 0 <= i < self.num_frames and (self._bits[i >> 3] >> (7 - (i & 7))) & 1 == 1
+
+    def __len__(self):
+        return self.count
+
+    def mask(self):
+        return np.unpackbits(np.frombuffer(self._bits, dtype=np.uint8), count=self.num_frames).astype(bool)
+
+    def indexes(self):
+        return np.flatnonzero(self.mask())
+
+
+def load_drop_indexes(path, num_frames):
+    with open(path) as f:
+        return DropSet.from_indexes(json.load(f), num_frames)
+
+
+def uniform_drops(num_frames, probability, seed=None):
+    rng = np.random.default_rng(seed)
+    return DropSet(rng.random(num_frames) < probability)
+
+
+# p_good_bad / p_bad_good are the per frame transition probabilities, loss_good / loss_bad
+# the loss probability while in each state. The chain is simulated by drawing the
+# geometric run lengths of each state instead of stepping frame by frame
+def gilbert_elliott_drops(num_frames, p_good_bad, p_bad_good, loss_good=0.0, loss_bad=1.0, seed=None):
+    rng = np.random.default_rng(seed)
+    in_bad = np.zeros(num_frames, dtype=bool)
+    position = 0
+    bad = False
+    while position < num_frames:
+        leave_probability = p_bad_good if bad else p_good_bad
+        run = rng.geometric(leave_probability) if leave_probability > 0 else num_frames
+        if bad:
+            in_bad[position:position + run] = True
+        position += run
+        bad = not bad
+    loss_probability = np.where(in_bad, loss_bad, loss_good)
+    return DropSet(rng.random(num_frames) < loss_probability)
+
+
+def periodic_drops(num_frames, period, outage, offset=0):
+    frames = np.arange(num_frames)
+    return DropSet(((frames - offset) % period < outage) & (frames >= offset))
+
+
+DROP_MODELS = ("file", "uniform", "gilbert", "periodic")
+DROP_MODEL_EXAMPLES = {
+    "file": "file:./missing-data.json",
+    "uniform": "uniform:0.01",
+    "gilbert": "gilbert:0.01,0.3",
+    "periodic": "periodic:600,5",
+}
+
+
+# number of parameters each generated model takes (min, max)
+DROP_MODEL_PARAMS = {"uniform": (1, 1), "gilbert": (2, 4), "periodic": (2, 3)}
+
+
+def _drop_params(kind, params):
+    low, high = DROP_MODEL_PARAMS[kind]
+    try:
+        values = [float(value) for value in params.split(',')]
+    except ValueError:
+        values = None
+    if values is None or not low <= len(values) <= high:
+        raise ValueError("Drop model %r takes %s, e.g. %s" % (
+            kind, "1 number" if high == 1 else "%d to %d numbers" % (low, high), DROP_MODEL_EXAMPLES[kind]))
+    if kind == "periodic":
+        if not all(value.is_integer() and value >= 0 for value in values):
+            raise ValueError("Periodic drops take whole frame counts, e.g. %s" % DROP_MODEL_EXAMPLES[kind])
+        values = [int(value) for value in values]
+        if values[0] == 0 or values[1] > values[0]:
+            raise ValueError("Periodic drops need period > 0 and 0 <= outage <= period, got %r (e.g. %s)" % (
+                params, DROP_MODEL_EXAMPLES[kind]))
+    elif not all(0.0 <= value <= 1.0 for value in values):
+        raise ValueError("Drop model %r takes probabilities between 0 and 1, got %r (e.g. %s)" % (
+            kind, params, DROP_MODEL_EXAMPLES[kind]))
+    return values
+
+
+# spec is "file:<path>", "uniform:<p>", "gilbert:<p_good_bad>,<p_bad_good>[,<loss_good>,<loss_bad>]"
+# or "periodic:<period>,<outage>[,<offset>]", a spec without ":" is treated as a file.
+# Raises ValueError on an unknown model or bad parameters
+def drops_from_spec(spec, num_frames, seed=None):
+    if ':' not in spec:
+        return load_drop_indexes(spec, num_frames)
+    kind, _, params = spec.partition(':')
+    if kind not in DROP_MODELS:
+        raise ValueError("Unknown drop model %r, expected one of %r" % (kind, DROP_MODELS))
+    if not params:
+        raise ValueError("Drop model %r needs parameters, e.g. %s" % (kind, DROP_MODEL_EXAMPLES[kind]))
+    if kind == "file":
+        return load_drop_indexes(params, num_frames)
+    values = _drop_params(kind, params)
+    if kind == "uniform":
+        return uniform_drops(num_frames, *values, seed=seed)
+    if kind == "gilbert":
+        return gilbert_elliott_drops(num_frames, *values, seed=seed)
+    return periodic_drops(num_frames, *values)
@@ -0,0 +1,71 @@
+import math
+import struct
+
+import numpy as np
+
+from .frame_encoder import frame_dtype
+
+'''
+IEEE C37.118 data frame decoder, the receiving side of FrameEncoder. A frame is unpacked
+with one precompiled Struct into a PmuFrame, a __slots__ record with the phasors kept as
+two tuples (magnitudes, angles in degrees) instead of a list of dicts. decode_many views a
+buffer of back to back frames as a numpy structured array without copying it.
+'''
+
+RAD_TO_DEG = 180 / math.pi
+
+
+class PmuFrame(object):
+    __slots__ = ("sync", "frame_size", "id_code", "soc", "frac_sec", "stat",
+                 "magnitudes", "angles", "freq", "dfreq", "analog", "digital", "chk", "received_at")
+
+    def __init__(self, sync, frame_size, id_code, soc, frac_sec, stat, magnitudes, angles,
+                 freq, dfreq, analog, digital, chk, received_at=None):
+        self.sync = sync
+        self.frame_size = frame_size
+        self.id_code = id_code
+        self.soc = soc
+        self.frac_sec = frac_sec
+        self.stat = stat
+        self.magnitudes = magnitudes
+        self.angles = angles
+        self.freq = freq
+        self.dfreq = dfreq
+        self.analog = analog
+        self.digital = digital
+        self.chk = chk
+        self.received_at = received_at
+
+    # seconds since the epoch, the sort key of received frames
+    @property
+    def timestamp(self):
+        return self.soc + self.frac_sec / 1000000
+
+    def __repr__(self):
+        return "PmuFrame(id_code=%d, soc=%d, frac_sec=%d, stat=%d, magnitudes=%r, angles=%r)" % (
+            self.id_code, self.soc, self.frac_sec, self.stat, self.magnitudes, self.angles)
+
+
+class FrameDecoder(object):
+    def __init__(self, num_phasors=1):
+        self.num_phasors = num_phasors
+        self.struct = struct.Struct(">HHHIIH%dfHHIHH" % (2 * num_phasors))
+        self.size = self.struct.size
+        self.dtype = frame_dtype(num_phasors)
+
+    # raises ValueError on frames shorter than the configured layout, trailing bytes are ignored
+    def decode(self, data, received_at=None):
+        try:
+            values = self.struct.unpack_from(data)
+        except struct.error:
+            raise ValueError("Frame of %d bytes is shorter than the %d byte layout with %d phasors" % (
+                len(data), self.size, self.num_phasors))
+        phasors = values[6:-5]
+        return PmuFrame(values[0], values[1], values[2], values[3], values[4], values[5],
+                        phasors[0::2], tuple(angle * RAD_TO_DEG for angle in phasors[1::2]),
+                        *values[-5:], received_at=received_at)
+
+    # a buffer of count back to back frames (every frame exactly size bytes) as a structured array,
+    # angles stay in radians as sent
+    def decode_many(self, buffer, count=-1):
+        return np.frombuffer(buffer, dtype=self.dtype, count=count)
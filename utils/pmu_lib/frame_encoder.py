@@ -0,0 +1,88 @@
+import math
+import struct
+
+import numpy as np
+
+'''
+IEEE C37.118 data frame encoder for the frames used in these examples:
+sync | frame_size | id_code | soc | fracsec | stat | phasors (float magnitude, float angle in
+radians) x N | freq | dfreq | analog | digital | chk
+All the constant fields are written once into a preallocated template, encoding a frame is
+one Struct.pack_into of the variable fields (soc, fracsec, stat, phasors) plus a copy.
+encode_many encodes N frames into one contiguous buffer with a numpy structured array.
+'''
+
+SYNC_DATA_FRAME = 0xAA01
+# 60 Hz nominal frequency as sent by the example PMUs
+FREQ_60HZ = 0x09C4
+# stat bits set on frames the controller generates for missing data (0000000000001001)
+STAT_CONTROLLER_GENERATED = 0x0009
+
+# offset of soc, where the variable part of the frame starts
+VARIABLE_OFFSET = 6
+DEG_TO_RAD = math.pi / 180
+
+
+# numpy dtype of one frame with num_phasors phasors, for whole buffers of frames
+def frame_dtype(num_phasors):
+    return np.dtype([
+        ("sync", ">u2"), ("frame_size", ">u2"), ("id_code", ">u2"),
+        ("soc", ">u4"), ("fracsec", ">u4"), ("stat", ">u2"),
+        ("phasors", ">f4", (num_phasors, 2)),
+        ("freq", ">u2"), ("dfreq", ">u2"), ("analog", ">u4"), ("digital", ">u2"), ("chk", ">u2"),
+    ])
+
+
+class FrameEncoder(object):
+    def __init__(self, num_phasors=1, id_code=12, stat=0, freq=FREQ_60HZ, dfreq=0, analog=0, digital=0, chk=0, frame_size=None):
+        self.num_phasors = num_phasors
+        self.id_code = id_code
+        self.stat = stat
+        self.struct = struct.Struct(">HHHIIH%dfHHIHH" % (2 * num_phasors))
+        self.size = self.struct.size
+        self.frame_size = self.size if frame_size is None else frame_size
+        self._variable = struct.Struct(">IIH%df" % (2 * num_phasors))
+
+        self._template = bytearray(self.struct.pack(
+            SYNC_DATA_FRAME, self.frame_size, id_code, 0, 0, stat,
+            *([0.0] * (2 * num_phasors)),
+            freq, dfreq, analog, digital, chk))
+        self._phasor_values = [0.0] * (2 * num_phasors)
+
+        self.dtype = frame_dtype(num_phasors)
+        self._template_record = np.frombuffer(bytes(self._template), dtype=self.dtype)[0]
+
+    # magnitudes and angles (in degrees) have one value per phasor, returns the frame as bytes.
+    # The template is reused between calls, so an encoder must not be shared between threads
+    def encode(self, soc, fracsec, magnitudes, angles, stat=None):
+        values = self._phasor_values
+        values[0::2] = magnitudes
+        values[1::2] = [angle * DEG_TO_RAD for angle in angles]
+        self._variable.pack_into(self._template, VARIABLE_OFFSET, int(soc), int(fracsec),
+                                 self.stat if stat is None else stat, *values)
+        return bytes(self._template)
+
+    # encodes N frames at once: socs/fracsecs have N values, magnitudes/angles (degrees) have
+    # one column of N values per phasor. stat and id_codes can be a single value or N values.
+    # Returns one buffer of N * size bytes
+    def encode_many(self, socs, fracsecs, magnitudes, angles, stat=None, id_codes=None):
+        socs = np.asarray(socs)
+        magnitudes = np.asarray(magnitudes, dtype=np.float64).reshape(self.num_phasors, -1)
+        angles = np.asarray(angles, dtype=np.float64).reshape(self.num_phasors, -1)
+
+        frames = np.full(len(socs), self._template_record, dtype=self.dtype)
+        frames["soc"] = socs
+        frames["fracsec"] = fracsecs
+        if stat is not None:
+            frames["stat"] = stat
+        if id_codes is not None:
+            frames["id_code"] = id_codes
+        frames["phasors"][:, :, 0] = magnitudes.T
+        frames["phasors"][:, :, 1] = np.radians(angles).T
+        return frames.tobytes()
+
+    # zero copy views of the individual frames in a buffer returned by encode_many
+    def split_frames(self, buffer):
+        view = memoryview(buffer)
+        size = self.size
+        return [view[i:i + size] for i in range(0, len(view), size)]
@@ -0,0 +1,136 @@
+import os
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+from .frame_encoder import FrameEncoder
+from .replay_encoder import times_to_soc_fracsec
+from .replay_scheduler import ReplayScheduler
+from .udp_pool import UdpSocketPool
+
+'''
+Load generation with many simulated PMUs. Every PMU replays one of the source recordings
+with its own id_code, time base (a shift added to the TimeTags), phasor count and optional
+noise on top of the recorded values (relative on magnitudes, in degrees on angles). PMUs are split across a process pool; each worker
+encodes the next frame of all of its PMUs in one vectorized pass per tick and sends them
+back to back, ticks are paced like a normal replay.
+'''
+
+# times_ns (the TimeTags, used for pacing) and frame_times_ns (soc * 1e9 + fracsec * 1000 of
+# the frames) have N values, magnitudes/angles are (phasors, N) arrays
+PmuSource = namedtuple("PmuSource", ["times_ns", "frame_times_ns", "magnitudes", "angles"])
+
+# time_shift_ns is added to every timestamp of the source, noise is the relative standard
+# deviation of the gaussian noise magnitudes are scaled by and angle_noise the standard
+# deviation in degrees of the gaussian noise added to angles
+PmuStreamSpec = namedtuple("PmuStreamSpec", ["id_code", "source", "num_phasors", "time_shift_ns", "noise", "angle_noise"])
+
+
+# frames get the soc/fracsec of a single stream replay: with local_time the naive TimeTags are
+# local times, see replay_encoder.times_to_soc_fracsec
+def source_from_csv_data(pmu_csv_data, local_time=True):
+    socs, fracsecs, times_ns = times_to_soc_fracsec(pmu_csv_data["times"], local_time)
+    return PmuSource(
+        times_ns,
+        socs * 1000000000 + fracsecs * 1000,
+        np.asarray(pmu_csv_data["magnitudes"], dtype=np.float64),
+        np.asarray(pmu_csv_data["phase_angles"], dtype=np.float64))
+
+
+# PMU i replays source i % num_sources shifted by i * time_shift seconds, num_phasors is
+# either one count for every PMU or a list of counts that is cycled through
+def make_stream_specs(num_pmus, num_sources, num_phasors, first_id_code=1, time_shift=0.0, noise=0.0, angle_noise=0.0):
+    phasor_counts = [num_phasors] if isinstance(num_phasors, int) else list(num_phasors)
+    return [PmuStreamSpec(first_id_code + i, i % num_sources, phasor_counts[i % len(phasor_counts)], int(i * time_shift * 1e9),
+                          noise, angle_noise)
+            for i in range(num_pmus)]
+
+
+class _PmuGroup(object):
+    # PMUs of one worker with the same phasor count, encoded together every tick
+    def __init__(self, specs, sources, num_frames):
+        self.num_phasors = specs[0].num_phasors
+        self.encoder = FrameEncoder(num_phasors=self.num_phasors)
+        self.id_codes = np.array([spec.id_code for spec in specs])
+        self.noise = np.array([spec.noise for spec in specs])
+        self.angle_noise = np.array([spec.angle_noise for spec in specs])
+        self.has_noise = bool(self.noise.any())
+        self.has_angle_noise = bool(self.angle_noise.any())
+        k = self.num_phasors
+        self.frame_times_ns = np.stack([sources[spec.source].frame_times_ns[:num_frames] + spec.time_shift_ns for spec in specs])
+        # (pmus, phasors, frames)
+        self.magnitudes = np.stack([sources[spec.source].magnitudes[:k, :num_frames] for spec in specs])
+        self.angles = np.stack([sources[spec.source].angles[:k, :num_frames] for spec in specs])
+
+    def encode_tick(self, i, rng):
+        times_ns = self.frame_times_ns[:, i]
+        magnitudes = self.magnitudes[:, :, i]
+        angles = self.angles[:, :, i]
+        if self.has_noise:
+            magnitudes = magnitudes * (1 + self.noise[:, None] * rng.standard_normal(magnitudes.shape))
+        if self.has_angle_noise:
+            angles = angles + self.angle_noise[:, None] * rng.standard_normal(angles.shape)
+        return self.encoder.encode_many(times_ns // 1000000000, (times_ns % 1000000000) // 1000,
+                                        magnitudes.T, angles.T, id_codes=self.id_codes)
+
+
+def _run_worker(task):
+    specs, sources, destination, rate, num_frames, seed = task
+    rng = np.random.default_rng(seed)
+    by_phasors = {}
+    for spec in specs:
+        by_phasors.setdefault(spec.num_phasors, []).append(spec)
+    groups = [_PmuGroup(group_specs, sources, num_frames) for group_specs in by_phasors.values()]
+
+    pool = UdpSocketPool()
+    send_batch = pool.send_batch
+
+    def send_tick(i):
+        for group in groups:
+            send_batch(None, destination, group.encoder.split_frames(group.encode_tick(i, rng)))
+
+    scheduler = ReplayScheduler(rate)
+    times_ns = sources[0].times_ns[:num_frames]
+    scheduler.run((times_ns - times_ns[0]) / 1e9, send_tick)
+    pool.close()
+
+    stats = scheduler.stats()
+    stats["pmus"] = len(specs)
+    stats["frames_sent"] = pool.frames_sent
+    stats["send_errors"] = pool.send_errors
+    return stats
+
+
+# replays num_frames ticks (0 = as many as the shortest source has) of every spec, split over workers processes
+def run_load(sources, specs, destination, workers=None, rate=1.0, num_frames=0, seed=0):
+    shortest = min(len(source.times_ns) for source in sources)
+    num_frames = shortest if num_frames <= 0 else min(num_frames, shortest)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(specs)))
+    tasks = [(specs[w::workers], sources, destination, rate, num_frames, seed + w) for w in range(workers)]
+
+    with Pool(workers) as pool:
+        worker_stats = pool.map(_run_worker, tasks)
+
+    elapsed = max(stats.get("elapsed_s", 0.0) for stats in worker_stats)
+    frames_sent = sum(stats["frames_sent"] for stats in worker_stats)
+    return {
+        "pmus": len(specs),
+        "workers": workers,
+        "ticks": num_frames,
+        "frames_sent": frames_sent,
+        "send_errors": sum(stats["send_errors"] for stats in worker_stats),
+        "elapsed_s": elapsed,
+        "rate_fps": frames_sent / elapsed if elapsed > 0 else float("inf"),
+        "workers_stats": worker_stats,
+    }
+
+
+def print_load_stats(stats):
+    print("%d PMUs on %d workers: sent %d frames (%d errors) in %.3f s, aggregate %.1f fps" % (
+        stats["pmus"], stats["workers"], stats["frames_sent"], stats["send_errors"], stats["elapsed_s"], stats["rate_fps"]))
+    for w, worker in enumerate(stats["workers_stats"]):
+        line = "  worker %d: %d PMUs, %d ticks, %.1f ticks/s" % (w, worker["pmus"], worker["frames"], worker["rate_fps"])
+        if "jitter_ms" in worker:
+            line += ", tick lateness p99: %.3f ms" % worker["jitter_ms"]["p99"]
+        print(line)
@@ -0,0 +1,121 @@
+import csv
+import os
+import time
+
+'''
+Buffered log sinks for the digest loop. The controller hands every decoded record
+to a sink, which keeps the file handle open and writes records out in batches:
+- a batch is written once it holds max_batch_records records or once
+  max_batch_delay seconds have passed since the oldest pending record
+- fsync_policy decides how hard each batch is pushed to disk
+'''
+
+# never call fsync, leave it to the OS page cache
+FSYNC_NONE = "none"
+# fsync after every batch that is written
+FSYNC_BATCH = "batch"
+# fsync at most once every fsync_interval seconds
+FSYNC_INTERVAL = "interval"
+
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_BATCH, FSYNC_INTERVAL)
+
+
+class LogSink(object):
+    def __init__(self, filename, max_batch_records=512, max_batch_delay=1.0,
+                 fsync_policy=FSYNC_NONE, fsync_interval=5.0, mode='a', buffering=1 << 16):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy %r, expected one of %r" % (fsync_policy, FSYNC_POLICIES))
+        self.filename = filename
+        self.max_batch_records = max_batch_records
+        self.max_batch_delay = max_batch_delay
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+
+        self._file = self._open(filename, mode, buffering)
+        self._pending = []
+        self._oldest_pending_at = None
+        self._last_fsync_at = time.monotonic()
+
+        self.records_written = 0
+        self.batches_written = 0
+
+    # subclasses pick text or binary mode and write any header here
+    def _open(self, filename, mode, buffering):
+        return open(filename, mode + 'b', buffering=buffering)
+
+    # subclasses turn a list of records into file writes here
+    def _write_batch(self, records):
+        self._file.write(b''.join(records))
+
+    def write(self, record):
+        if not self._pending:
+            self._oldest_pending_at = time.monotonic()
+        self._pending.append(record)
+        if len(self._pending) >= self.max_batch_records:
+            self.flush()
+        else:
+            self.poll()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    # flushes the pending batch if it has been waiting longer than max_batch_delay,
+    # call this periodically when no new records are arriving
+    def poll(self):
+        now = time.monotonic()
+        if self._pending and now - self._oldest_pending_at >= self.max_batch_delay:
+            self.flush()
+        elif self.fsync_policy == FSYNC_INTERVAL and now - self._last_fsync_at >= self.fsync_interval:
+            self._fsync(now)
+
+    def flush(self):
+        if self._pending:
+            self._write_batch(self._pending)
+            self.records_written += len(self._pending)
+            self.batches_written += 1
+            self._pending = []
+            self._oldest_pending_at = None
+        self._file.flush()
+
+        now = time.monotonic()
+        if self.fsync_policy == FSYNC_BATCH:
+            self._fsync(now)
+        elif self.fsync_policy == FSYNC_INTERVAL and now - self._last_fsync_at >= self.fsync_interval:
+            self._fsync(now)
+
+    def _fsync(self, now):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_fsync_at = now
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        if self.fsync_policy != FSYNC_NONE:
+            self._fsync(time.monotonic())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# writes each record as a csv row, the header is only written to new/empty files
+class CsvLogSink(LogSink):
+    def __init__(self, filename, header=None, **kwargs):
+        self.header = header
+        LogSink.__init__(self, filename, **kwargs)
+
+    def _open(self, filename, mode, buffering):
+        f = open(filename, mode, newline='', buffering=buffering)
+        self._writer = csv.writer(f)
+        if self.header is not None and f.tell() == 0:
+            self._writer.writerow(self.header)
+        return f
+
+    def _write_batch(self, records):
+        self._writer.writerows(records)
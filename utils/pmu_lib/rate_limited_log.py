@@ -0,0 +1,60 @@
+import logging
+import time
+
+'''
+Leveled, rate limited logging for the per frame paths. Every call site (logger, level, format
+string) gets a token bucket of burst messages refilled at rate messages per second, anything
+over that is counted instead of formatted and written, and the count is reported on the next
+message that gets through. Debug output of every frame can stay in the code at no cost when
+the level is above DEBUG, and cannot flood the console when it is not.
+'''
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate=10.0, burst=20):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.burst = burst
+        # (name, level, msg) -> [tokens, last refill, suppressed]
+        self._buckets = {}
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = "%s (%d similar messages suppressed)" % (record.msg, bucket[2])
+            bucket[2] = 0
+        return True
+
+
+# logger with one console handler behind a RateLimitFilter, rate <= 0 disables the limit
+def get_rate_limited_logger(name, level=logging.INFO, rate=10.0, burst=20):
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        if rate > 0:
+            handler.addFilter(RateLimitFilter(rate, burst))
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
+def add_logging_arguments(parser):
+    parser.add_argument('--log_level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG logs every frame')
+    parser.add_argument('--log_rate', type=float, default=10.0,
+                        help='Messages per second allowed for each log statement, 0 = unlimited')
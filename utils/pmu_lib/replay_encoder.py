@@ -0,0 +1,100 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .replay_scheduler import times_to_ns
+
+'''
+Pre-encodes a whole replay before the first frame is sent: the TimeTag column is turned
+into (soc, fracsec) arrays in one vectorized pass and every frame is encoded into one
+contiguous buffer with FrameEncoder.encode_many, so the send loop only paces sendto calls.
+The encoded replay can be cached to disk (npz) next to the recording; the cache is keyed on
+the recording's path, size and mtime plus the frame layout, so edits invalidate it.
+'''
+
+# offsets: seconds since the first frame, frames: num_frames * frame size bytes
+EncodedReplay = namedtuple("EncodedReplay", ["offsets", "frames", "num_frames"])
+
+
+# wall clock seconds the way datetime.strftime("%s") sees them: the TimeTags are naive
+# local times, so the local UTC offset (including DST) is removed
+def _local_soc(naive_seconds):
+    return int(time.mktime(time.struct_time(time.gmtime(int(naive_seconds))[:8] + (-1,))))
+
+
+def times_to_soc_fracsec(times, local_time=True):
+    times_ns = times_to_ns(times)
+    seconds = times_ns // 1000000000
+    fracsec = (times_ns % 1000000000) // 1000
+    if local_time and len(seconds):
+        first_offset = _local_soc(seconds[0]) - seconds[0]
+        last_offset = _local_soc(seconds[-1]) - seconds[-1]
+        if first_offset == last_offset:
+            seconds = seconds + first_offset
+        else:
+            # the replay crosses a DST change, fall back to converting every timestamp
+            seconds = np.array([_local_soc(s) for s in seconds], dtype=np.int64)
+    return seconds, fracsec, times_ns
+
+
+def encode_replay(encoder, times, magnitudes, angles, local_time=True):
+    socs, fracsecs, times_ns = times_to_soc_fracsec(times, local_time)
+    frames = encoder.encode_many(socs, fracsecs, magnitudes, angles)
+    offsets = (times_ns - times_ns[0]) / 1e9 if len(times_ns) else np.zeros(0)
+    return EncodedReplay(offsets, frames, len(times_ns))
+
+
+def _cache_key(source_path, encoder, num_frames, local_time):
+    stat = os.stat(source_path)
+    return json.dumps({
+        "source": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "frame_size": encoder.size,
+        "num_phasors": encoder.num_phasors,
+        "id_code": encoder.id_code,
+        "stat": encoder.stat,
+        "num_frames": num_frames,
+        "local_time": local_time,
+    }, sort_keys=True)
+
+
+def _load_cache(cache_path, key):
+    try:
+        with np.load(cache_path) as cached:
+            if str(cached["key"]) != key:
+                return None
+            return EncodedReplay(cached["offsets"], cached["frames"].tobytes(), int(cached["num_frames"]))
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_cache(cache_path, key, replay):
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, key=np.array(key), offsets=replay.offsets,
+             frames=np.frombuffer(replay.frames, dtype=np.uint8), num_frames=np.array(replay.num_frames))
+    os.replace(tmp_path, cache_path)
+
+
+# load_csv_data() returns the parse_csv_data dict of the recording, it is only called on a cache miss.
+# num_frames <= 0 encodes the whole recording
+def prepare_replay(source_path, encoder, load_csv_data, num_frames=0, cache_path=None, local_time=True):
+    key = None
+    if cache_path:
+        key = _cache_key(source_path, encoder, num_frames, local_time)
+        replay = _load_cache(cache_path, key)
+        if replay is not None:
+            return replay
+
+    pmu_csv_data = load_csv_data()
+    n = len(pmu_csv_data["times"]) if num_frames <= 0 else min(num_frames, len(pmu_csv_data["times"]))
+    magnitudes = np.asarray(pmu_csv_data["magnitudes"], dtype=np.float64)[:encoder.num_phasors, :n]
+    angles = np.asarray(pmu_csv_data["phase_angles"], dtype=np.float64)[:encoder.num_phasors, :n]
+    replay = encode_replay(encoder, pmu_csv_data["times"][:n], magnitudes, angles, local_time)
+
+    if cache_path:
+        _save_cache(cache_path, key, replay)
+    return replay
@@ -0,0 +1,100 @@
+import time
+from array import array
+
+import pandas as pd
+
+'''
+Drift free pacing for replaying recorded PMU streams. Every frame gets an absolute
+deadline on the monotonic clock (start + original TimeTag offset / rate), so time spent
+encoding or sending a frame is absorbed instead of adding up like a fixed sleep would.
+The scheduler sleeps until shortly before a deadline and spins for the remainder, and
+records how late every frame went out so the achieved rate and jitter can be reported.
+'''
+
+
+# parses a whole TimeTag column at once into int64 nanoseconds since the epoch
+def times_to_ns(times):
+    times = pd.Series(times)
+    try:
+        timestamps = pd.to_datetime(times)
+    except ValueError:
+        # pandas >= 2 infers one format from the first value, exports mix in whole seconds without a fraction
+        timestamps = pd.to_datetime(times, format="mixed")
+    return timestamps.values.astype("datetime64[ns]").astype("int64")
+
+# offsets in seconds since the first frame from the replayed TimeTag column
+def offsets_from_times(times):
+    timestamps = times_to_ns(times)
+    return (timestamps - timestamps[0]) / 1e9
+
+
+class ReplayScheduler(object):
+    # rate is a multiplier of the original speed (1 = real time, 10 = 10x), 0 sends as fast as possible.
+    # spin is how many seconds before a deadline the scheduler stops sleeping and busy waits
+    def __init__(self, rate=1.0, spin=0.0005):
+        if rate < 0:
+            raise ValueError("Replay rate must be >= 0, got %r" % rate)
+        self.rate = rate
+        self.spin = spin
+        self.lateness_ns = array('q')
+        self.frames = 0
+        self.start_ns = None
+        self.end_ns = None
+
+    # calls send(i) for every frame i at start + offsets[i] / rate
+    def run(self, offsets, send):
+        monotonic_ns = time.monotonic_ns
+        sleep = time.sleep
+        lateness_ns = self.lateness_ns
+        spin_ns = int(self.spin * 1e9)
+        start_ns = self.start_ns = monotonic_ns()
+
+        if not self.rate:
+            # unpaced, there are no deadlines to be late for
+            for i in range(len(offsets)):
+                send(i)
+            self.frames = len(offsets)
+            self.end_ns = monotonic_ns()
+            return
+
+        scale = 1e9 / self.rate
+        for i, offset in enumerate(offsets):
+            deadline_ns = start_ns + int(offset * scale)
+            remaining_ns = deadline_ns - monotonic_ns()
+            if remaining_ns > spin_ns:
+                sleep((remaining_ns - spin_ns) / 1e9)
+            while monotonic_ns() < deadline_ns:
+                pass
+            lateness_ns.append(monotonic_ns() - deadline_ns)
+            send(i)
+        self.frames = len(lateness_ns)
+        self.end_ns = monotonic_ns()
+
+    def stats(self):
+        frames = self.frames
+        if not frames:
+            return {"frames": 0}
+        elapsed = (self.end_ns - self.start_ns) / 1e9
+        stats = {
+            "frames": frames,
+            "elapsed_s": elapsed,
+            "rate_fps": frames / elapsed if elapsed > 0 else float("inf"),
+        }
+        lateness = sorted(self.lateness_ns)
+        if lateness:
+            def percentile(p):
+                return lateness[min(len(lateness) - 1, int(len(lateness) * p / 100))] / 1e6
+            stats["jitter_ms"] = {"p50": percentile(50), "p90": percentile(90), "p99": percentile(99), "max": lateness[-1] / 1e6}
+        return stats
+
+    def print_stats(self):
+        stats = self.stats()
+        if not stats["frames"]:
+            print("No frames sent")
+            return
+        summary = "Sent %d frames in %.3f s (%.1f fps)" % (stats["frames"], stats["elapsed_s"], stats["rate_fps"])
+        if "jitter_ms" in stats:
+            jitter = stats["jitter_ms"]
+            summary += " | lateness p50: %.3f ms | p90: %.3f ms | p99: %.3f ms | max: %.3f ms" % (
+                jitter["p50"], jitter["p90"], jitter["p99"], jitter["max"])
+        print(summary)
@@ -0,0 +1,282 @@
+import os
+import re
+import struct
+
+import numpy as np
+
+from .binary_log import BinaryLogSink, open_log, read_batch, read_log_header, BLOCK_HEADER, COMPRESSION_NONE, EPOCH_UNITS
+
+'''
+Time indexed binary log split into segments, for collectors that run for months. Records go
+to the newest segment, a binary_log file named <sequence>-<first record time>.bin in the log
+directory. A new segment is started once the current one spans segment_seconds of record time
+or holds segment_bytes, and whole segments older than retention_seconds (by record time) or
+beyond retention_bytes are deleted.
+Every segment has a sparse index next to it (.idx): one (min time, max time, byte offset,
+record count) entry per written batch, so a time range query reads the small indexes, skips
+segments and batches outside the range and only reads (and decompresses) the batches that
+overlap it. Records only need to be roughly in time order, a late record widens its batch's
+time range.
+'''
+
+INDEX_ENTRY = struct.Struct("<qqQI")
+INDEX_DTYPE = np.dtype([("min_time", "<i8"), ("max_time", "<i8"), ("offset", "<u8"), ("count", "<u4")])
+SEGMENT_NAME = re.compile(r"^(\d+)-(\d+)\.bin$")
+
+# record time units per second by the time field's export format
+TIME_SCALES = {"us": 1000000, "ns": 1000000000}
+
+
+def segment_index_path(path):
+    return os.path.splitext(path)[0] + ".idx"
+
+
+# segment files of directory oldest first
+def list_segments(directory):
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        match = SEGMENT_NAME.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(directory, name)))
+    return [path for _, path in sorted(segments)]
+
+
+# the index entries of a segment as a structured array, rebuilt from the segment if the index
+# is missing or was cut short (the writer was killed between the two files)
+def read_segment_index(path, time_field):
+    index_path = segment_index_path(path)
+    entries = np.empty(0, dtype=INDEX_DTYPE)
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        entries = np.frombuffer(data, dtype=INDEX_DTYPE, count=len(data) // INDEX_DTYPE.itemsize)
+    f, header = open_log(path)
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        indexed_end = header["offset"]
+        if len(entries):
+            indexed_end = int(entries["offset"][-1]) + _batch_bytes(f, header, entries[-1])
+        if indexed_end >= size:
+            return entries
+        return np.concatenate([entries, _scan_batches(f, header, indexed_end, size, time_field)])
+
+
+def _batch_bytes(f, header, entry):
+    if header["compression"] == COMPRESSION_NONE:
+        return int(entry["count"]) * header["dtype"].itemsize
+    f.seek(int(entry["offset"]))
+    _, length = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+    return BLOCK_HEADER.size + length
+
+
+# index entries for the batches from offset on, uncompressed segments are indexed in fixed chunks
+def _scan_batches(f, header, offset, size, time_field, chunk_records=512):
+    entries = []
+    itemsize = header["dtype"].itemsize
+    while offset < size:
+        if header["compression"] == COMPRESSION_NONE:
+            count = min(chunk_records, (size - offset) // itemsize)
+            length = count * itemsize
+        else:
+            f.seek(offset)
+            block_header = f.read(BLOCK_HEADER.size)
+            if len(block_header) < BLOCK_HEADER.size:
+                break
+            count, length = BLOCK_HEADER.unpack(block_header)
+            length += BLOCK_HEADER.size
+            if offset + length > size:
+                break
+        if count == 0:
+            break
+        times = read_batch(f, header, offset, count)[time_field]
+        entries.append((times.min(), times.max(), offset, count))
+        offset += length
+    return np.array(entries, dtype=INDEX_DTYPE)
+
+
+# records of the segments in directory with start <= time < end (None = open ended) and every
+# field in where equal to its value, as structured arrays (one per matching batch)
+def query_segments(directory, time_field, start=None, end=None, where=None):
+    where = where or {}
+    for path in list_segments(directory):
+        entries = read_segment_index(path, time_field)
+        selected = np.ones(len(entries), dtype=bool)
+        if start is not None:
+            selected &= entries["max_time"] >= start
+        if end is not None:
+            selected &= entries["min_time"] < end
+        if not selected.any():
+            continue
+        f, header = open_log(path)
+        with f:
+            for entry in entries[selected]:
+                records = read_batch(f, header, int(entry["offset"]), int(entry["count"]))
+                mask = np.ones(len(records), dtype=bool)
+                if start is not None:
+                    mask &= records[time_field] >= start
+                if end is not None:
+                    mask &= records[time_field] < end
+                for name, value in where.items():
+                    mask &= records[name] == value
+                if mask.any():
+                    yield records[mask]
+
+
+# the dtype and formats the segments in directory were written with, None if there are none
+def segment_log_header(directory):
+    segments = list_segments(directory)
+    if not segments:
+        return None
+    with open(segments[0], 'rb') as f:
+        return read_log_header(f)
+
+
+# one segment: a BinaryLogSink that adds an index entry for every batch it writes
+class _Segment(BinaryLogSink):
+    def __init__(self, filename, time_field, dtype, formats, compression, **kwargs):
+        self.time_field = time_field
+        self.index_file = open(segment_index_path(filename), 'wb')
+        BinaryLogSink.__init__(self, filename, dtype, formats, compression, mode='w', **kwargs)
+        # the header goes out right away, queries of the live directory open the newest segment too
+        self._file.flush()
+
+    def _write_array(self, array):
+        offset = self._file.tell()
+        BinaryLogSink._write_array(self, array)
+        times = array[self.time_field]
+        self.index_file.write(INDEX_ENTRY.pack(int(times.min()), int(times.max()), offset, len(array)))
+
+    def flush(self):
+        BinaryLogSink.flush(self)
+        self.index_file.flush()
+
+    def close(self):
+        BinaryLogSink.close(self)
+        self.index_file.close()
+
+
+# a sink (write, poll, flush, close like LogSink) that spreads records over rotated segments.
+# segment_seconds, retention_seconds are in seconds of record time, time_scale is the number of
+# time_field units per second (taken from its epoch format if not given). 0 disables a limit
+class SegmentedLog(object):
+    def __init__(self, directory, dtype, time_field, formats=None, compression=COMPRESSION_NONE,
+                 segment_seconds=3600, segment_bytes=64 << 20, retention_seconds=0, retention_bytes=0,
+                 time_scale=None, **sink_options):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        if time_field not in self.dtype.names:
+            raise ValueError("Time field %r is not a field of the records %r" % (time_field, self.dtype.names))
+        self.time_field = time_field
+        self._time_index = self.dtype.names.index(time_field)
+        self.formats = formats or {}
+        self.compression = compression
+        if time_scale is None:
+            time_scale = TIME_SCALES.get(EPOCH_UNITS.get(self.formats.get(time_field)), 1)
+        self.segment_span = segment_seconds * time_scale
+        self.segment_bytes = segment_bytes
+        self.retention_span = retention_seconds * time_scale
+        self.retention_bytes = retention_bytes
+        self.sink_options = sink_options
+        self.max_batch_delay = sink_options.get("max_batch_delay", 1.0)
+
+        os.makedirs(directory, exist_ok=True)
+        existing = list_segments(directory)
+        self._sequence = int(SEGMENT_NAME.match(os.path.basename(existing[-1])).group(1)) + 1 if existing else 0
+        self._segment = None
+        self._segment_start = None
+        self.records_written = 0
+        self.segments_created = 0
+        self.segments_deleted = 0
+        self._apply_retention(None)
+
+    def _rotate(self, time):
+        if self._segment is not None:
+            self._close_segment()
+        path = os.path.join(self.directory, "%08d-%d.bin" % (self._sequence, time))
+        self._sequence += 1
+        self._segment = _Segment(path, self.time_field, self.dtype, self.formats, self.compression, **self.sink_options)
+        self._segment_start = time
+        self.segments_created += 1
+        self._apply_retention(time)
+
+    def _close_segment(self):
+        self._segment.close()
+        self.records_written += self._segment.records_written
+        self._segment = None
+
+    # bytes in the current segment, the records still pending in the batch counted uncompressed
+    def _segment_size(self):
+        return self._segment._file.tell() + len(self._segment._pending) * self.dtype.itemsize
+
+    def write(self, record):
+        time = record[self._time_index]
+        if (self._segment is None
+                or (self.segment_span and time - self._segment_start >= self.segment_span)
+                or (self.segment_bytes and self._segment_size() >= self.segment_bytes)):
+            self._rotate(time)
+        self._segment.write(record)
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def poll(self):
+        if self._segment is not None:
+            self._segment.poll()
+
+    def flush(self):
+        if self._segment is not None:
+            self._segment.flush()
+
+    def close(self):
+        if self._segment is not None:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # deletes the oldest closed segments that ended more than retention_span before newest_time,
+    # then more while all segments together are over retention_bytes
+    def _apply_retention(self, newest_time):
+        if not self.retention_span and not self.retention_bytes:
+            return
+        current = self._segment.filename if self._segment is not None else None
+        closed = [path for path in list_segments(self.directory) if path != current]
+        if self.retention_span and newest_time is not None:
+            while closed:
+                entries = read_segment_index(closed[0], self.time_field)
+                if len(entries) and entries["max_time"].max() >= newest_time - self.retention_span:
+                    break
+                self._delete(closed.pop(0))
+        if self.retention_bytes:
+            total = sum(os.path.getsize(path) for path in closed)
+            while closed and total > self.retention_bytes:
+                path = closed.pop(0)
+                total -= os.path.getsize(path)
+                self._delete(path)
+
+    def _delete(self, path):
+        os.remove(path)
+        if os.path.exists(segment_index_path(path)):
+            os.remove(segment_index_path(path))
+        self.segments_deleted += 1
+
+    # records with start <= time < end and the where fields equal, see query_segments
+    def query(self, start=None, end=None, **where):
+        self.flush()
+        return query_segments(self.directory, self.time_field, start, end, where)
+
+    def stats(self):
+        segments = list_segments(self.directory)
+        return {
+            "records_written": self.records_written + (self._segment.records_written if self._segment is not None else 0),
+            "segments": len(segments),
+            "segments_created": self.segments_created,
+            "segments_deleted": self.segments_deleted,
+            "bytes": sum(os.path.getsize(path) for path in segments),
+        }
@@ -0,0 +1,83 @@
+import struct
+import time
+
+import numpy as np
+
+'''
+Journal of when every replayed frame was sent, for latency analysis against the receiver
+logs. Each send is one fixed width little endian record (index, monotonic ns, wall clock ns)
+packed into a preallocated batch buffer that is written out whenever it fills up, so memory
+stays constant however long the replay runs. read_journal yields the records back as numpy
+structured arrays in chunks, load_journal maps the whole journal without reading it.
+'''
+
+JOURNAL_MAGIC = b"PMUSJ001"
+RECORD = struct.Struct("<qqq")
+RECORD_DTYPE = np.dtype([("index", "<i8"), ("monotonic_ns", "<i8"), ("wall_ns", "<i8")])
+
+
+class SendJournal(object):
+    # batch_records records are buffered in memory before one write to the file
+    def __init__(self, filename, batch_records=4096):
+        self.filename = filename
+        self._file = open(filename, 'wb', buffering=0)
+        self._file.write(JOURNAL_MAGIC)
+        self._buffer = bytearray(batch_records * RECORD.size)
+        self._offset = 0
+        self.records_written = 0
+
+    def record(self, index, monotonic_ns=None, wall_ns=None):
+        RECORD.pack_into(self._buffer, self._offset, index,
+                         time.monotonic_ns() if monotonic_ns is None else monotonic_ns,
+                         time.time_ns() if wall_ns is None else wall_ns)
+        self._offset += RECORD.size
+        self.records_written += 1
+        if self._offset == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        if self._offset:
+            self._file.write(memoryview(self._buffer)[:self._offset])
+            self._offset = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _check_magic(f, filename):
+    if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+        raise ValueError("%s is not a send journal" % filename)
+
+
+# yields structured arrays (index, monotonic_ns, wall_ns) of at most chunk_records records,
+# a partially written trailing record is ignored
+def read_journal(filename, chunk_records=1 << 20):
+    with open(filename, 'rb') as f:
+        _check_magic(f, filename)
+        while True:
+            data = f.read(chunk_records * RECORD.size)
+            usable = len(data) - len(data) % RECORD.size
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=RECORD_DTYPE)
+            if len(data) < chunk_records * RECORD.size:
+                return
+
+
+# the whole journal as a read only memory mapped structured array
+def load_journal(filename):
+    with open(filename, 'rb') as f:
+        _check_magic(f, filename)
+        f.seek(0, 2)
+        num_records = (f.tell() - len(JOURNAL_MAGIC)) // RECORD.size
+    if not num_records:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(filename, dtype=RECORD_DTYPE, mode='r', offset=len(JOURNAL_MAGIC), shape=(num_records,))
@@ -0,0 +1,338 @@
+import csv
+import ctypes
+import datetime
+import heapq
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import struct
+import time
+
+import numpy as np
+
+from .batch_receiver import BatchReceiver
+from .binary_log import BinaryLogSink, read_binary_log, read_log_header, FORMAT_EPOCH_NS
+from .frame_encoder import STAT_CONTROLLER_GENERATED
+
+'''
+Sharded PMU receiver: frames are partitioned by id_code (id_code % num_shards) across worker
+processes, every shard keeps its own reorder window and streams its own log, and the shard logs
+are merged into one time ordered log afterwards. The logs are csv rows or fixed size binary_log
+records (frame_log_dtype), which are k-way merged chunk by chunk instead of parsing text. Two
+ways of getting frames to the shards:
+- reuseport: one SO_REUSEPORT socket per shard on the same port, with a classic BPF program
+  attached to the group that picks the socket from the frame's id_code, so the kernel does
+  the partitioning and no process sees another shard's frames
+- dispatch: the parent receives everything and forwards each datagram to its shard over an
+  AF_UNIX datagram socketpair, for kernels without SO_ATTACH_REUSEPORT_CBPF (Linux < 4.5)
+'''
+
+MODE_REUSEPORT = "reuseport"
+MODE_DISPATCH = "dispatch"
+SHARD_MODES = (MODE_REUSEPORT, MODE_DISPATCH)
+
+# Linux values, not exported by the socket module
+SO_ATTACH_REUSEPORT_CBPF = 51
+# offset of id_code in a C37.118 frame
+ID_CODE_OFFSET = 4
+
+SHARD_LOG_HEADER = ["index", "id_code", "soc", "frac_sec", "magnitude", "phase_angle", "is_predicted", "received_at"]
+
+# binary frame log record, angles in degrees
+def frame_log_dtype(num_phasors):
+    return np.dtype([
+        ("index", "<i8"), ("id_code", "<u2"), ("stat", "<u2"), ("soc", "<u4"), ("fracsec", "<u4"),
+        ("magnitude", "<f4", (num_phasors,)), ("angle", "<f4", (num_phasors,)), ("received_at_ns", "<i8"),
+    ])
+
+FRAME_LOG_FORMATS = {"received_at_ns": FORMAT_EPOCH_NS}
+
+
+def shard_of(data, num_shards):
+    if len(data) < ID_CODE_OFFSET + 2:
+        return 0
+    return ((data[ID_CODE_OFFSET] << 8) | data[ID_CODE_OFFSET + 1]) % num_shards
+
+
+def _id_code_bpf(num_shards):
+    # A = id_code (the program sees the UDP payload), A %= num_shards, return A as the socket index
+    instructions = [(0x28, 0, 0, ID_CODE_OFFSET), (0x94, 0, 0, num_shards), (0x16, 0, 0, 0)]
+    return b"".join(struct.pack("HBBI", *instruction) for instruction in instructions)
+
+
+# num_shards sockets bound to the same port, datagrams steered to socket id_code % num_shards.
+# Raises OSError if the kernel cannot attach the steering program
+def reuseport_socket_group(address, num_shards):
+    socks = []
+    try:
+        for _ in range(num_shards):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            socks.append(sock)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(address)
+        code = _id_code_bpf(num_shards)
+        program = ctypes.create_string_buffer(code, len(code))
+        # struct sock_fprog {unsigned short len; struct sock_filter *filter;}
+        fprog = struct.pack("HL", len(code) // 8, ctypes.addressof(program))
+        socks[0].setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+    except (OSError, AttributeError):
+        for sock in socks:
+            sock.close()
+        raise
+    return socks
+
+
+# make_handler(shard) runs in the worker and returns the shard's frame handler: called with a
+# memoryview of every datagram, and handler.close() once the shard stops. Frames are claimed from
+# the shared received counter before they are handled, so all shards together handle at most
+# terminate_after frames (0 = no limit)
+def _shard_worker(shard, sock, make_handler, stop_event, received, terminate_after, batch_size, results):
+    # the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    handler = make_handler(shard)
+    receiver = BatchReceiver(sock, batch_size, timeout=0.1)
+    frames = 0
+    while not stop_event.is_set():
+        batch = receiver.receive_batch()
+        if batch is None:
+            continue
+        with received.get_lock():
+            if terminate_after > 0:
+                batch.truncate(terminate_after - received.value)
+            received.value += len(batch)
+        for data in batch:
+            handler(data)
+        frames += len(batch)
+        receiver.release(batch)
+    handler.close()
+    stats = receiver.stats()
+    stats["shard"] = shard
+    stats["frames"] = frames
+    results.put(stats)
+
+
+# forwards every datagram to its shard, a shard that falls behind loses datagrams (counted)
+# instead of stalling the others
+def _dispatch(sock, shard_socks, stop, batch_size):
+    receiver = BatchReceiver(sock, batch_size, timeout=0.1)
+    num_shards = len(shard_socks)
+    for shard_sock in shard_socks:
+        shard_sock.setblocking(False)
+    sends = [shard_sock.send for shard_sock in shard_socks]
+    forward_drops = 0
+    while not stop():
+        batch = receiver.receive_batch()
+        if batch is None:
+            continue
+        for data in batch:
+            try:
+                sends[shard_of(data, num_shards)](data)
+            except BlockingIOError:
+                forward_drops += 1
+        receiver.release(batch)
+    stats = receiver.stats()
+    stats["forward_drops"] = forward_drops
+    return stats
+
+
+# receives on address with num_shards worker processes until terminate_after frames (0 = no
+# limit) were received across all shards or SIGINT/SIGTERM. Falls back to dispatch mode if the
+# reuseport group cannot be set up. Returns the per shard stats
+def run_sharded(address, num_shards, make_handler, mode=MODE_REUSEPORT, terminate_after=0,
+                batch_size=64, socket_buffer=None):
+    if mode not in SHARD_MODES:
+        raise ValueError("Unknown shard mode %r, expected one of %r" % (mode, SHARD_MODES))
+    context = multiprocessing.get_context("fork")
+    stop_event = context.Event()
+    received = context.Value("q", 0)
+    results = context.Queue()
+
+    interrupted = []
+
+    def on_signal(signum, frame):
+        interrupted.append(signum)
+
+    previous_handlers = [(signum, signal.signal(signum, on_signal)) for signum in (signal.SIGINT, signal.SIGTERM)]
+
+    def stop():
+        return bool(interrupted) or (terminate_after > 0 and received.value >= terminate_after)
+
+    dispatch_sock = None
+    if mode == MODE_REUSEPORT:
+        try:
+            shard_socks = reuseport_socket_group(address, num_shards)
+            parent_ends = []
+        except OSError:
+            mode = MODE_DISPATCH
+    if mode == MODE_DISPATCH:
+        dispatch_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        dispatch_sock.bind(address)
+        pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(num_shards)]
+        parent_ends = [pair[0] for pair in pairs]
+        shard_socks = [pair[1] for pair in pairs]
+    if socket_buffer:
+        for sock in shard_socks + ([dispatch_sock] if dispatch_sock else []):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, socket_buffer)
+
+    workers = [context.Process(target=_shard_worker, args=(shard, sock, make_handler, stop_event, received, terminate_after, batch_size, results))
+               for shard, sock in enumerate(shard_socks)]
+    for worker in workers:
+        worker.start()
+    # the workers have their own copies
+    for sock in shard_socks:
+        sock.close()
+
+    dispatch_stats = None
+    try:
+        if dispatch_sock is not None:
+            dispatch_stats = _dispatch(dispatch_sock, parent_ends, stop, batch_size)
+        else:
+            while not stop():
+                time.sleep(0.05)
+    finally:
+        stop_event.set()
+        stats = []
+        for worker in workers:
+            try:
+                stats.append(results.get(timeout=5.0))
+            except queue.Empty:
+                # a worker died without reporting
+                break
+        for worker in workers:
+            worker.join()
+        for sock in parent_ends + ([dispatch_sock] if dispatch_sock else []):
+            sock.close()
+        for signum, handler in previous_handlers:
+            signal.signal(signum, handler)
+
+    stats.sort(key=lambda shard_stats: shard_stats["shard"])
+    return {"mode": mode, "shards": stats, "dispatch": dispatch_stats, "interrupted": bool(interrupted)}
+
+
+def print_sharded_stats(stats):
+    print("%d shards (%s)" % (len(stats["shards"]), stats["mode"]))
+    for shard in stats["shards"]:
+        kernel_drops = "n/a" if shard["kernel_drops"] is None else str(shard["kernel_drops"])
+        print("Shard %d: %d frames in %d batches | socket buffer drops: %s" % (
+            shard["shard"], shard["frames"], shard["batches"], kernel_drops))
+    if stats["dispatch"] is not None:
+        dispatch = stats["dispatch"]
+        print("Dispatcher: %d frames | socket buffer drops: %s | dropped forwarding to a full shard: %d" % (
+            dispatch["datagrams"], "n/a" if dispatch["kernel_drops"] is None else dispatch["kernel_drops"], dispatch["forward_drops"]))
+
+
+def shard_log_path(output, shard):
+    root, ext = os.path.splitext(output)
+    return "%s.shard%d%s" % (root, shard, ext or ".csv")
+
+
+# SHARD_LOG_HEADER row of a PmuFrame, the shard handlers emit frames in (timestamp, id_code) order
+def shard_log_row(index, pmu):
+    return [index, pmu.id_code, pmu.soc, pmu.frac_sec, pmu.magnitudes[0], pmu.angles[0],
+            pmu.stat == STAT_CONTROLLER_GENERATED, pmu.received_at]
+
+
+# received_at as ns since the epoch: datetimes (naive ones are local time like datetime.now()),
+# ints are taken as ns already, None is stored as 0
+def to_epoch_ns(received_at):
+    if received_at is None:
+        return 0
+    if isinstance(received_at, datetime.datetime):
+        return round(received_at.timestamp() * 1000000) * 1000
+    return int(received_at)
+
+
+# frame_log_dtype record of a PmuFrame
+def frame_log_record(index, pmu):
+    return (index, pmu.id_code, pmu.stat, pmu.soc, pmu.frac_sec, pmu.magnitudes, pmu.angles, to_epoch_ns(pmu.received_at))
+
+
+def frame_log_sink(path, num_phasors, **kwargs):
+    return BinaryLogSink(path, frame_log_dtype(num_phasors), FRAME_LOG_FORMATS, mode='w', **kwargs)
+
+
+def _is_binary_log(path):
+    with open(path, 'rb') as f:
+        try:
+            read_log_header(f)
+        except ValueError:
+            return False
+    return True
+
+
+def _shard_rows(path):
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            # sort key: soc, frac_sec, id_code
+            yield (int(row[2]), int(row[3]), int(row[1])), row
+
+
+# (soc, fracsec) of every frame as one uint64, frames are ordered by it and then by id_code
+def _frame_times(frames):
+    return (frames["soc"].astype(np.uint64) << np.uint64(32)) | frames["fracsec"].astype(np.uint64)
+
+
+# number of frames of a time ordered chunk at or before (time, id_code)
+def _count_until(times, id_codes, time, id_code):
+    start = np.searchsorted(times, time, "left")
+    end = np.searchsorted(times, time, "right")
+    return int(start + np.searchsorted(id_codes[start:end], id_code, "right"))
+
+
+# next non empty chunk of a shard log reader with the times of its frames, None at the end
+def _next_chunk(reader):
+    for frames in reader:
+        if len(frames):
+            return frames, _frame_times(frames)
+    return None
+
+
+# k-way merge of the time ordered binary shard logs, read chunk_records frames per shard at a time.
+# Every round writes the buffered frames up to the smallest last key of the shards' chunks, which
+# drains at least one chunk, so memory stays at about one chunk per shard however long the logs are
+def _merge_binary_shard_logs(paths, output, dtype, compression, chunk_records):
+    readers = [read_binary_log(path, chunk_records) for path in paths]
+    chunks = [_next_chunk(reader) for reader in readers]
+    count = 0
+    with BinaryLogSink(output, dtype, FRAME_LOG_FORMATS, compression, mode='w') as sink:
+        while any(chunk is not None for chunk in chunks):
+            bound = min((times[-1], frames["id_code"][-1]) for frames, times in filter(None, chunks))
+            parts = []
+            for shard, chunk in enumerate(chunks):
+                if chunk is None:
+                    continue
+                frames, times = chunk
+                n = _count_until(times, frames["id_code"], *bound)
+                parts.append(frames[:n])
+                chunks[shard] = (frames[n:], times[n:]) if n < len(frames) else _next_chunk(readers[shard])
+            frames = np.concatenate(parts)
+            frames = frames[np.lexsort((frames["id_code"], frames["fracsec"], frames["soc"]))]
+            frames["index"] = np.arange(count, count + len(frames))
+            sink.write_array(frames)
+            count += len(frames)
+    return count
+
+
+# streams the time ordered shard logs into one time ordered log with a global index, binary shard
+# logs are merged into a binary log
+def merge_shard_logs(paths, output, chunk_records=65536):
+    paths = [path for path in paths if os.path.exists(path)]
+    if paths and _is_binary_log(paths[0]):
+        with open(paths[0], 'rb') as f:
+            header = read_log_header(f)
+        return _merge_binary_shard_logs(paths, output, header["dtype"], header["compression"], chunk_records)
+    merged = heapq.merge(*[_shard_rows(path) for path in paths], key=lambda item: item[0])
+    with open(output, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(SHARD_LOG_HEADER)
+        count = 0
+        for _, row in merged:
+            row[0] = count
+            writer.writerow(row)
+            count += 1
+    return count
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# pmu_lib is imported as a package from utils/, like the src scripts import it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
@@ -0,0 +1,174 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from pmu_lib.binary_log import (BinaryLogSink, load_binary_log, read_binary_log, read_batch, open_log,
+                                export_log, export_format, BLOCK_HEADER, COMPRESSIONS, COMPRESSION_ZLIB,
+                                FORMAT_IPV4, FORMAT_EPOCH_US)
+
+DTYPE = np.dtype([("index", "<i8"), ("src_addr", "<u4"), ("timestamp_us", "<i8"), ("magnitude", "<f4", (2,))])
+FORMATS = {"src_addr": FORMAT_IPV4, "timestamp_us": FORMAT_EPOCH_US}
+
+
+def record(i):
+    # 10.0.1.<i % 256>, one record per ms from 2014-01-28T23:00:13Z
+    return (i, 0x0a000100 + i % 256, 1390950013000000 + i * 1000, (float(i), -float(i)))
+
+
+def write_log(path, count, compression, first=0, mode='w', **kwargs):
+    sink = BinaryLogSink(str(path), DTYPE, FORMATS, compression, mode=mode, **kwargs)
+    for i in range(first, first + count):
+        sink.write(record(i))
+    sink.close()
+    return sink
+
+
+def expected(first, count):
+    return np.array([record(i) for i in range(first, first + count)], dtype=DTYPE)
+
+
+def assert_records(records, first, count):
+    want = expected(first, count)
+    assert len(records) == count
+    for name in DTYPE.names:
+        np.testing.assert_array_equal(records[name], want[name])
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trip(tmp_path, compression):
+    path = tmp_path / "log.bin"
+    sink = write_log(path, 1000, compression, max_batch_records=64)
+    assert sink.records_written == 1000
+    assert sink.batches_written == 16
+
+    records = load_binary_log(str(path))
+    assert_records(records, 0, 1000)
+    chunks = list(read_binary_log(str(path), chunk_records=100))
+    # compressed logs are read one block (written batch) at a time
+    assert [len(chunk) for chunk in chunks] == ([100] * 10 if compression == "none" else [64] * 15 + [40])
+    assert_records(np.concatenate(chunks), 0, 1000)
+
+    f, header = open_log(str(path))
+    f.close()
+    assert header["dtype"] == DTYPE
+    assert header["compression"] == compression
+    assert header["formats"] == FORMATS
+    # records start 8 byte aligned
+    assert header["offset"] % 8 == 0
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_append_and_write_array(tmp_path, compression):
+    path = tmp_path / "log.bin"
+    write_log(path, 10, compression)
+    sink = BinaryLogSink(str(path), DTYPE, FORMATS, compression)
+    sink.write(record(10))
+    sink.write_array(expected(11, 5))
+    sink.write_array(np.empty(0, dtype=DTYPE))
+    sink.close()
+    assert sink.records_written == 6
+    assert_records(load_binary_log(str(path)), 0, 16)
+
+
+def test_zlib_blocks_are_smaller_on_repetitive_records(tmp_path):
+    write_log(tmp_path / "plain.bin", 2000, "none")
+    write_log(tmp_path / "zlib.bin", 2000, COMPRESSION_ZLIB)
+    assert os.path.getsize(tmp_path / "zlib.bin") < os.path.getsize(tmp_path / "plain.bin") / 2
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_torn_tail_is_ignored_and_truncated_on_append(tmp_path, compression):
+    path = tmp_path / "log.bin"
+    write_log(path, 100, compression, max_batch_records=30)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 5)
+    # the torn last record (or the whole last block) is skipped by the readers
+    kept = 99 if compression == "none" else 90
+    assert_records(load_binary_log(str(path)), 0, kept)
+    assert sum(len(chunk) for chunk in read_binary_log(str(path))) == kept
+
+    write_log(path, 3, compression, first=kept, mode='a')
+    assert_records(load_binary_log(str(path)), 0, kept + 3)
+
+
+def test_append_with_another_layout_is_rejected(tmp_path):
+    path = tmp_path / "log.bin"
+    write_log(path, 1, "none")
+    with pytest.raises(ValueError):
+        BinaryLogSink(str(path), DTYPE, FORMATS, COMPRESSION_ZLIB)
+    with pytest.raises(ValueError):
+        BinaryLogSink(str(path), DTYPE[["index", "src_addr"]].descr, FORMATS, "none")
+    with pytest.raises(ValueError):
+        BinaryLogSink(str(tmp_path / "other.bin"), DTYPE, compression="lz4")
+    assert_records(load_binary_log(str(path)), 0, 1)
+
+
+def test_not_a_binary_log(tmp_path):
+    path = tmp_path / "received.csv"
+    path.write_text("index,magnitude\n")
+    with pytest.raises(ValueError):
+        open_log(str(path))
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_read_batch(tmp_path, compression):
+    path = tmp_path / "log.bin"
+    sink = BinaryLogSink(str(path), DTYPE, FORMATS, compression, mode='w')
+    offsets = []
+    for first in range(0, 30, 10):
+        offsets.append(sink._file.tell())
+        sink.write_array(expected(first, 10))
+    sink.close()
+    f, header = open_log(str(path))
+    with f:
+        for first, offset in zip(range(0, 30, 10), offsets):
+            assert_records(read_batch(f, header, offset, 10), first, 10)
+    if compression == COMPRESSION_ZLIB:
+        assert offsets[1] - offsets[0] > BLOCK_HEADER.size
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_export_csv_applies_the_formats(tmp_path, compression):
+    path = tmp_path / "log.bin"
+    write_log(path, 300, compression)
+    output = tmp_path / "log.csv"
+    assert export_log(str(path), str(output), chunk_records=128) == 300
+    with open(output, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["index", "src_addr", "timestamp_us", "magnitude_0", "magnitude_1"]
+    assert len(rows) == 301
+    assert rows[1] == ["0", "10.0.1.0", "2014-01-28T23:00:13.000000", "0.0", "-0.0"]
+    assert rows[258] == ["257", "10.0.1.1", "2014-01-28T23:00:13.257000", "257.0", "-257.0"]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_export_empty_log(tmp_path, compression):
+    path = tmp_path / "log.bin"
+    write_log(path, 0, compression)
+    assert len(load_binary_log(str(path))) == 0
+    output = tmp_path / "log.csv"
+    assert export_log(str(path), str(output)) == 0
+    assert output.read_text().splitlines() == ["index,src_addr,timestamp_us,magnitude_0,magnitude_1"]
+
+
+def test_export_format():
+    assert export_format("log.csv") == "csv"
+    assert export_format("log.parquet") == "parquet"
+    assert export_format("log.pq") == "parquet"
+    assert export_format("log.txt", "parquet") == "parquet"
+    with pytest.raises(ValueError):
+        export_format("log.csv", "xlsx")
+
+
+def test_parquet_export_needs_pyarrow(tmp_path):
+    try:
+        import pyarrow
+    except ImportError:
+        path = tmp_path / "log.bin"
+        write_log(path, 1, "none")
+        with pytest.raises(RuntimeError):
+            export_log(str(path), str(tmp_path / "log.parquet"))
+    else:
+        pytest.skip("pyarrow is installed")
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+from pmu_lib.drop_model import DropSet, drops_from_spec, periodic_drops
+
+
+def test_drop_set_membership():
+    drops = DropSet.from_indexes([0, 9, 17, 17, -1, 100], 20)
+    assert len(drops) == 3
+    assert [i for i in range(-2, 25) if i in drops] == [0, 9, 17]
+    assert drops.indexes().tolist() == [0, 9, 17]
+
+
+def test_file_specs(tmp_path):
+    path = tmp_path / "missing-data.json"
+    path.write_text(json.dumps([1, 3, 5]))
+    assert drops_from_spec(str(path), 10).indexes().tolist() == [1, 3, 5]
+    assert drops_from_spec("file:" + str(path), 10).indexes().tolist() == [1, 3, 5]
+
+
+def test_generated_specs():
+    assert drops_from_spec("periodic:10,2,1", 30).indexes().tolist() == [1, 2, 11, 12, 21, 22]
+    assert drops_from_spec("periodic:5,0", 30).count == 0
+    assert drops_from_spec("periodic:5,5", 30).count == 30
+    assert drops_from_spec("uniform:0", 100).count == 0
+    assert drops_from_spec("uniform:1", 100).count == 100
+    uniform = drops_from_spec("uniform:0.5", 1000, seed=1)
+    assert uniform.indexes().tolist() == drops_from_spec("uniform:0.5", 1000, seed=1).indexes().tolist()
+    assert 400 < len(uniform) < 600
+    assert drops_from_spec("gilbert:0.01,0.3", 1000, seed=1).num_frames == 1000
+    assert drops_from_spec("gilbert:0.1,0.1,0,1", 1000, seed=1).count > 0
+
+
+def test_periodic_offset():
+    assert periodic_drops(12, 4, 1, 2).indexes().tolist() == [2, 6, 10]
+
+
+@pytest.mark.parametrize("spec", [
+    "uniform:", "periodic:", "gilbert:", "file:", "bursty:0.1",
+    # parameter counts
+    "uniform:0.1,0.2", "gilbert:0.01", "gilbert:0.1,0.2,0.3,0.4,0.5", "periodic:600", "periodic:600,5,0,1",
+    # values
+    "uniform:x", "uniform:1.5", "uniform:-0.1", "gilbert:0.01,1.3", "gilbert:0.1,0.2,-1,1",
+    "periodic:0,5", "periodic:5,6", "periodic:10.5,2", "periodic:10,-1", "periodic:10,2,-3",
+])
+def test_bad_specs_raise_value_error(spec):
+    with pytest.raises(ValueError):
+        drops_from_spec(spec, 100)
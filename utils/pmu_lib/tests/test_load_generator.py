@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+import pytest
+
+from pmu_lib.frame_encoder import FrameEncoder
+from pmu_lib.load_generator import _PmuGroup, make_stream_specs, source_from_csv_data
+from pmu_lib.replay_encoder import encode_replay
+
+CSV_DATA = {
+    "times": ["2014-01-28 23:00:13.583000000", "2014-01-28 23:00:13.600000000", "2014-01-28 23:00:14"],
+    "magnitudes": [[253793.2, 253811.5, 253820.0], [260943.5, 260916.0, 260900.0], [255880.6, 255825.7, 255800.0]],
+    "phase_angles": [[-14.35, -14.13, -13.9], [-133.94, -133.73, -133.5], [107.39, 107.61, 107.8]],
+}
+
+
+# the TimeTags are local times, so the sent socs depend on the time zone
+@pytest.fixture(params=["UTC", "America/Chicago"])
+def time_zone(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def load_frames(specs, num_frames=3):
+    group = _PmuGroup(specs, [source_from_csv_data(CSV_DATA)], num_frames)
+    rng = np.random.default_rng(0)
+    return [group.encode_tick(i, rng) for i in range(num_frames)]
+
+
+def test_load_frames_match_a_single_stream_replay(time_zone):
+    replay = encode_replay(FrameEncoder(num_phasors=3, id_code=12), CSV_DATA["times"],
+                           CSV_DATA["magnitudes"], CSV_DATA["phase_angles"])
+    frames = load_frames(make_stream_specs(1, 1, 3, first_id_code=12))
+    assert b"".join(frames) == replay.frames
+
+
+def test_time_shift_moves_the_frame_times(time_zone):
+    encoder = FrameEncoder(num_phasors=1)
+    specs = make_stream_specs(2, 1, 1, first_id_code=1, time_shift=1.5)
+    for tick in load_frames(specs):
+        first, second = np.frombuffer(tick, dtype=encoder.dtype)
+        shifted = (int(first["soc"]) * 1000000 + int(first["fracsec"])) + 1500000
+        assert int(second["soc"]) * 1000000 + int(second["fracsec"]) == shifted
+        assert (first["id_code"], second["id_code"]) == (1, 2)
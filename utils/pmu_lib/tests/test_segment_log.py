@@ -0,0 +1,166 @@
+import os
+
+import numpy as np
+import pytest
+
+from pmu_lib.binary_log import load_binary_log, COMPRESSIONS, FORMAT_EPOCH_US, FORMAT_IPV4
+from pmu_lib.segment_log import (SegmentedLog, list_segments, query_segments, read_segment_index,
+                                 segment_index_path, segment_log_header, INDEX_DTYPE)
+
+DTYPE = np.dtype([("timestamp_us", "<u8"), ("magnitude", "<f4", (3,)), ("src_addr", "<u4")])
+FORMATS = {"timestamp_us": FORMAT_EPOCH_US, "src_addr": FORMAT_IPV4}
+START_US = 1390950013000000
+
+
+# one record every step_us from START_US, from one of 4 source addresses
+def record(i, step_us=250000):
+    return (START_US + i * step_us, (float(i), 0.0, 0.0), 0x0a000101 + i % 4)
+
+
+def open_log(directory, **kwargs):
+    kwargs.setdefault("segment_seconds", 0)
+    kwargs.setdefault("segment_bytes", 0)
+    return SegmentedLog(str(directory), DTYPE, "timestamp_us", FORMATS, **kwargs)
+
+
+def all_records(directory):
+    chunks = list(query_segments(str(directory), "timestamp_us"))
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=DTYPE)
+
+
+def indexes(records):
+    return records["magnitude"][:, 0].astype(int).tolist()
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_rotation_by_record_time(tmp_path, compression):
+    with open_log(tmp_path, compression=compression, segment_seconds=1) as log:
+        log.write_many(record(i) for i in range(10))
+    segments = list_segments(str(tmp_path))
+    # 4 records per second of record time
+    assert [len(load_binary_log(path)) for path in segments] == [4, 4, 2]
+    assert [os.path.basename(path) for path in segments] == [
+        "00000000-%d.bin" % START_US, "00000001-%d.bin" % (START_US + 1000000), "00000002-%d.bin" % (START_US + 2000000)]
+    assert indexes(all_records(tmp_path)) == list(range(10))
+    assert log.stats()["records_written"] == 10
+    assert log.stats()["segments_created"] == 3
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_rotation_by_bytes_counts_pending_records(tmp_path, compression):
+    segment_bytes = 4096
+    # nothing reaches the file before the batch is full, rotation still has to happen
+    with open_log(tmp_path, compression=compression, segment_bytes=segment_bytes, max_batch_records=512) as log:
+        log.write_many(record(i) for i in range(1000))
+    segments = list_segments(str(tmp_path))
+    assert len(segments) > 1
+    assert all(os.path.getsize(path) < segment_bytes + DTYPE.itemsize for path in segments)
+    assert indexes(all_records(tmp_path)) == list(range(1000))
+
+
+def test_rotation_by_bytes_uncompressed_fills_segments(tmp_path):
+    with open_log(tmp_path, segment_bytes=4096, max_batch_records=7) as log:
+        log.write_many(record(i) for i in range(1000))
+    sizes = [os.path.getsize(path) for path in list_segments(str(tmp_path))]
+    # every segment but the last stops within one record of the limit
+    assert all(4096 <= size < 4096 + DTYPE.itemsize for size in sizes[:-1])
+
+
+def test_retention_by_record_time(tmp_path):
+    with open_log(tmp_path, segment_seconds=1, retention_seconds=2) as log:
+        log.write_many(record(i) for i in range(40))
+    records = all_records(tmp_path)
+    newest = START_US + 39 * 250000
+    # whole closed segments older than 2 s before the newest segment's first record are gone
+    assert records["timestamp_us"].min() >= newest - 4000000
+    assert indexes(records) == list(range(40 - len(records), 40))
+    assert log.stats()["segments_deleted"] == log.stats()["segments_created"] - log.stats()["segments"]
+    assert log.stats()["segments_deleted"] > 0
+    assert all(os.path.exists(segment_index_path(path)) for path in list_segments(str(tmp_path)))
+    assert len(os.listdir(str(tmp_path))) == 2 * len(list_segments(str(tmp_path)))
+
+
+def test_retention_by_bytes(tmp_path):
+    with open_log(tmp_path, segment_seconds=1, retention_bytes=3000) as log:
+        log.write_many(record(i) for i in range(200))
+        closed = list_segments(str(tmp_path))[:-1]
+        assert sum(os.path.getsize(path) for path in closed) <= 3000
+    # the newest records are kept
+    assert indexes(all_records(tmp_path))[-1] == 199
+    assert log.stats()["segments_deleted"] > 0
+
+
+def test_retention_applies_to_segments_of_an_earlier_run(tmp_path):
+    with open_log(tmp_path, segment_seconds=1) as log:
+        log.write_many(record(i) for i in range(20))
+    assert len(list_segments(str(tmp_path))) == 5
+    with open_log(tmp_path, segment_seconds=1, retention_bytes=1) as log:
+        assert len(list_segments(str(tmp_path))) == 0
+        log.write(record(20))
+    # a reopened log continues the segment sequence
+    assert os.path.basename(list_segments(str(tmp_path))[0]).startswith("00000005-")
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_time_range_and_where_queries(tmp_path, compression):
+    with open_log(tmp_path, compression=compression, segment_seconds=2, max_batch_records=5) as log:
+        log.write_many(record(i) for i in range(100))
+        everything = all_records(tmp_path)
+        # query flushes the pending batch first
+        assert len(np.concatenate(list(log.query()))) == 100
+
+        start, end = START_US + 3100000, START_US + 11000000
+        selected = np.concatenate(list(log.query(start, end, src_addr=0x0a000102)))
+        want = everything[(everything["timestamp_us"] >= start) & (everything["timestamp_us"] < end)
+                          & (everything["src_addr"] == 0x0a000102)]
+        assert indexes(selected) == indexes(want)
+        assert indexes(selected) == [i for i in range(13, 44) if i % 4 == 1]
+
+        assert list(log.query(START_US + 100 * 250000)) == []
+        assert list(log.query(end=START_US)) == []
+        assert indexes(np.concatenate(list(log.query(end=START_US + 1)))) == [0]
+
+
+def test_late_records_widen_their_batch(tmp_path):
+    times = [0, 1, 2, 3, 10, 4, 11, 12]
+    with open_log(tmp_path, max_batch_records=4) as log:
+        log.write_many((START_US + t, (float(t), 0.0, 0.0), 1) for t in times)
+    entries = read_segment_index(list_segments(str(tmp_path))[0], "timestamp_us")
+    assert (entries["min_time"] - START_US).tolist() == [0, 4]
+    assert (entries["max_time"] - START_US).tolist() == [3, 12]
+    selected = np.concatenate(list(query_segments(str(tmp_path), "timestamp_us", START_US + 4, START_US + 5)))
+    assert indexes(selected) == [4]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_missing_or_short_index_is_rebuilt(tmp_path, compression):
+    with open_log(tmp_path, compression=compression, max_batch_records=10) as log:
+        log.write_many(record(i) for i in range(95))
+    path = list_segments(str(tmp_path))[0]
+    written = read_segment_index(path, "timestamp_us")
+    assert len(written) == 10
+    assert written["count"].sum() == 95
+
+    # the writer was killed between the segment and its index
+    with open(segment_index_path(path), 'r+b') as f:
+        f.truncate(3 * INDEX_DTYPE.itemsize)
+    rebuilt = read_segment_index(path, "timestamp_us")
+    assert rebuilt["count"].sum() == 95
+    assert rebuilt["min_time"].min() == START_US
+    assert indexes(all_records(tmp_path)) == list(range(95))
+
+    os.remove(segment_index_path(path))
+    assert read_segment_index(path, "timestamp_us")["count"].sum() == 95
+    selected = np.concatenate(list(query_segments(str(tmp_path), "timestamp_us", record(50)[0], record(60)[0])))
+    assert indexes(selected) == list(range(50, 60))
+
+
+def test_header_and_bad_time_field(tmp_path):
+    assert segment_log_header(str(tmp_path / "missing")) is None
+    with pytest.raises(ValueError):
+        SegmentedLog(str(tmp_path), DTYPE, "received_at")
+    with open_log(tmp_path) as log:
+        log.write(record(0))
+    header = segment_log_header(str(tmp_path))
+    assert header["dtype"] == DTYPE
+    assert header["formats"] == FORMATS
@@ -0,0 +1,97 @@
+import csv
+import datetime
+import random
+
+import numpy as np
+import pytest
+
+from pmu_lib.frame_decoder import FrameDecoder
+from pmu_lib.frame_encoder import FrameEncoder
+from pmu_lib.binary_log import load_binary_log, COMPRESSIONS
+from pmu_lib.sharded_receiver import (frame_log_dtype, frame_log_record, frame_log_sink, merge_shard_logs,
+                                      shard_log_path, to_epoch_ns, SHARD_LOG_HEADER)
+
+
+def test_to_epoch_ns():
+    assert to_epoch_ns(None) == 0
+    assert to_epoch_ns(123) == 123
+    moment = datetime.datetime(2014, 1, 28, 23, 0, 13, 250000, tzinfo=datetime.timezone.utc)
+    assert to_epoch_ns(moment) == 1390950013250000000
+    # naive datetimes are local time, like datetime.now()
+    assert to_epoch_ns(moment.astimezone().replace(tzinfo=None)) == 1390950013250000000
+
+
+def test_frame_log_record_of_a_decoded_frame():
+    encoder = FrameEncoder(num_phasors=2, id_code=7)
+    pmu = FrameDecoder(num_phasors=2).decode(encoder.encode(1390950013, 250000, [1.0, 2.0], [30.0, -60.0]),
+                                             received_at=1390950013300000000)
+    record = np.array([frame_log_record(5, pmu)], dtype=frame_log_dtype(2))[0]
+    assert (record["index"], record["id_code"], record["soc"], record["fracsec"]) == (5, 7, 1390950013, 250000)
+    np.testing.assert_allclose(record["magnitude"], [1.0, 2.0])
+    np.testing.assert_allclose(record["angle"], [30.0, -60.0], atol=1e-4)
+    assert record["received_at_ns"] == 1390950013300000000
+
+
+# time ordered frames of each shard, id_code % num_shards like the receiver partitions them, with
+# frames of several PMUs at the same time and PMUs that stop sending early
+def shard_frames(num_shards, num_pmus=7, num_frames=300, seed=1):
+    rng = random.Random(seed)
+    shards = [[] for _ in range(num_shards)]
+    for i in range(num_frames):
+        soc, fracsec = 1390950013 + i // 60, (i % 60) * 16666
+        for id_code in range(1, num_pmus + 1):
+            if rng.random() < 0.8 and i < num_frames - 20 * id_code:
+                shards[id_code % num_shards].append((id_code, soc, fracsec))
+    return shards
+
+
+def write_shard_logs(tmp_path, shards, compression, **kwargs):
+    output = str(tmp_path / "received.bin")
+    paths = []
+    for shard, frames in enumerate(shards):
+        paths.append(shard_log_path(output, shard))
+        with frame_log_sink(paths[-1], 1, compression=compression, **kwargs) as sink:
+            for index, (id_code, soc, fracsec) in enumerate(frames):
+                sink.write((index, id_code, 0, soc, fracsec, (float(soc),), (float(fracsec),), index))
+    return paths, output
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("chunk_records", [1, 7, 65536])
+def test_binary_merge_matches_sorting_everything(tmp_path, compression, chunk_records):
+    shards = shard_frames(3)
+    paths, output = write_shard_logs(tmp_path, shards, compression, max_batch_records=50)
+    count = merge_shard_logs(paths, output, chunk_records=chunk_records)
+    frames = load_binary_log(output)
+    expected = sorted((frame for frames in shards for frame in frames), key=lambda frame: (frame[1], frame[2], frame[0]))
+    assert count == len(expected) == len(frames)
+    assert list(zip(frames["id_code"].tolist(), frames["soc"].tolist(), frames["fracsec"].tolist())) == expected
+    assert frames["index"].tolist() == list(range(count))
+
+
+def test_binary_merge_with_empty_and_missing_shards(tmp_path):
+    shards = shard_frames(2)
+    paths, output = write_shard_logs(tmp_path, shards + [[]], "none")
+    count = merge_shard_logs(paths + [str(tmp_path / "missing.bin")], output, chunk_records=16)
+    assert count == sum(len(frames) for frames in shards)
+    assert np.all(np.diff(load_binary_log(output)["soc"].astype(np.int64)) >= 0)
+
+
+def test_csv_merge(tmp_path):
+    output = str(tmp_path / "received.csv")
+    paths = []
+    for shard, frames in enumerate(shard_frames(2)):
+        paths.append(shard_log_path(output, shard))
+        with open(paths[-1], "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(SHARD_LOG_HEADER)
+            for index, (id_code, soc, fracsec) in enumerate(frames):
+                writer.writerow([index, id_code, soc, fracsec, 1.0, 0.0, False, ""])
+    count = merge_shard_logs(paths, output)
+    with open(output, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == SHARD_LOG_HEADER
+    keys = [(int(row[2]), int(row[3]), int(row[1])) for row in rows[1:]]
+    assert count == len(keys)
+    assert keys == sorted(keys)
+    assert [int(row[0]) for row in rows[1:]] == list(range(count))
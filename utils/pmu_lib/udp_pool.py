@@ -0,0 +1,62 @@
+import socket
+
+'''
+Pool of long lived UDP sockets for injecting PMU frames, keyed by (interface, destination).
+Each socket is bound to its interface once (SO_BINDTODEVICE) and connected to its
+destination, so sending a frame is a single send() call with no socket setup or
+address lookup. Python's socket module has no sendmmsg, so send_batch pushes a whole
+batch of frames through one connected socket in a tight loop instead.
+'''
+
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+
+class UdpSocketPool(object):
+    def __init__(self, send_buffer_bytes=None):
+        self.send_buffer_bytes = send_buffer_bytes
+        self._sockets = {}
+        self.frames_sent = 0
+        self.send_errors = 0
+
+    # interface=None sends through whatever interface the routing table picks
+    def get(self, interface, destination):
+        key = (interface, destination)
+        udp_socket = self._sockets.get(key)
+        if udp_socket is None:
+            udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if interface is not None:
+                udp_socket.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, (interface + '\0').encode('utf-8'))
+            if self.send_buffer_bytes:
+                udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_bytes)
+            udp_socket.connect(destination)
+            self._sockets[key] = udp_socket
+        return udp_socket
+
+    def send(self, interface, destination, frame):
+        return self.send_batch(interface, destination, (frame,))
+
+    # sends every frame as its own datagram, returns the number of frames sent
+    def send_batch(self, interface, destination, frames):
+        send = self.get(interface, destination).send
+        sent = 0
+        for frame in frames:
+            try:
+                send(frame)
+            except OSError:
+                # e.g. ECONNREFUSED from an earlier datagram, the frame itself is lost
+                self.send_errors += 1
+                continue
+            sent += 1
+        self.frames_sent += sent
+        return sent
+
+    def close(self):
+        for udp_socket in self._sockets.values():
+            udp_socket.close()
+        self._sockets.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()